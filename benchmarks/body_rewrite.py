@@ -0,0 +1,97 @@
+"""
+Micro-benchmark of the issue and comment body rewriting.
+
+Compares the previous implementation (two regexes built per call, a separate upload scan, str.replace per
+upload, dateutil and a pytz lookup per timestamp) with the precompiled single-pass BodyRewriter and the
+fast ISO 8601 path, over a corpus of typical GitLab issue and comment bodies.
+
+    python benchmarks/body_rewrite.py [iterations]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+import dateutil.parser
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import migrate  # noqa: E402
+
+GITLAB_URL = 'https://gitlab.example.com'
+GITEA_URL = 'https://gitea.example.com'
+
+CORPUS = [
+    "Fixed in the latest build.",
+    "Duplicate of " + GITLAB_URL + "/platform/backend/-/issues/1234, closing.",
+    "Steps to reproduce:\n\n1. Open the settings page\n2. Click *Save*\n\n"
+    "![screenshot](/uploads/0123456789abcdef0123456789abcdef/screenshot.png)\n\n"
+    "Related: " + GITLAB_URL + "/platform/frontend/-/issues/87 and " + GITLAB_URL + "/group/sub/frontend/-/issues/12\n"
+    "See also " + GITLAB_URL + "/platform/frontend/-/merge_requests/455, cc @jdoe @asmith",
+    "Log output:\n\n```\n" + "\n".join("2021-03-0%d 12:00:00 ERROR worker %d crashed" % (i % 9 + 1, i) for i in range(40)) + "\n```\n"
+    "[trace.log](/uploads/fedcba9876543210fedcba9876543210/trace.log)",
+    "\n".join("- [ ] task %d, blocked by " % i + GITLAB_URL + "/platform/backend/-/issues/%d" % (100 + i) for i in range(25)),
+    "Design attached: [mockup.pdf](/uploads/aaaabbbbccccddddeeeeffff00001111/mockup.pdf) "
+    "![before](/uploads/11112222333344445555666677778888/before.png) ![after](/uploads/99990000aaaabbbbccccddddeeeeffff/after.png)",
+    "lorem ipsum dolor sit amet " * 200,
+]
+
+TIMESTAMPS = ['2021-03-04T12:34:56.789Z', '2019-11-30T23:59:59.000+01:00', '2020-02-29T00:00:00Z']
+
+
+def upload_mapping(text: str) -> dict:
+    return {link: GITEA_URL + '/attachments/' + str(i) for i, link in enumerate(re.findall(r'\[.*?\]\((/uploads/.*?)\)', text))}
+
+
+def legacy_replace_issue_links(text: str, gitlab_url: str, gitea_url: str) -> str:
+    pattern = re.escape(gitlab_url) + r'/([^/]+)/([^/]+)/([^/]+)/-/issues/(\d+)'
+    replacement = gitea_url + r'/\2/\3/issues/\4'
+    text = re.sub(pattern, replacement, text or '')
+    pattern = re.escape(gitlab_url) + r'/([^/]+)/([^/]+)/-/issues/(\d+)'
+    replacement = gitea_url + r'/\1/\2/issues/\3'
+    text = re.sub(pattern, replacement, text or '')
+    return text
+
+
+def legacy(text: str, uploads: dict, timestamp: str) -> str:
+    created_at = dateutil.parser.parse(timestamp).astimezone(pytz.timezone('Europe/Berlin')).strftime('%d.%m.%Y %H:%M')
+    body = legacy_replace_issue_links(f"{text}\n\n{created_at}", GITLAB_URL, GITEA_URL)
+    body = legacy_replace_issue_links(body, GITLAB_URL, GITEA_URL)
+    for link in list(dict.fromkeys(re.findall(r'\[.*?\]\((/uploads/.*?)\)', text))):
+        body = body.replace(link, uploads[link])
+    return body
+
+
+def current(text: str, uploads: dict, timestamp: str) -> str:
+    rewriter = migrate.get_body_rewriter(GITLAB_URL, GITEA_URL)
+    created_at = migrate.format_local_timestamp(timestamp)
+    body = rewriter.rewrite(f"{text}\n\n{created_at}")
+    rewriter.upload_links(text)
+    return rewriter.rewrite(body, uploads)
+
+
+def run(implementation, items) -> None:
+    for text, uploads, timestamp in items:
+        implementation(text, uploads, timestamp)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    items = [(text, upload_mapping(text), TIMESTAMPS[i % len(TIMESTAMPS)]) for i, text in enumerate(CORPUS)]
+
+    for text, uploads, timestamp in items:
+        assert legacy(text, uploads, timestamp) == current(text, uploads, timestamp), text
+
+    corpus_bytes = sum(len(text.encode()) for text in CORPUS) * iterations
+    results = {}
+    for name, implementation in (('legacy', legacy), ('single-pass', current)):
+        seconds = min(timeit.repeat(lambda: run(implementation, items), number=iterations, repeat=3))
+        results[name] = seconds
+        print(f"{name:12} {seconds:8.3f}s  {len(items) * iterations / seconds:10.0f} bodies/s  {corpus_bytes / seconds / 1024 / 1024:8.1f} MiB/s")
+
+    print(f"speedup      {results['legacy'] / results['single-pass']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
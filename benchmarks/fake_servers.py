@@ -0,0 +1,780 @@
+"""
+Local stand-ins for the GitLab v4 and Gitea v1 APIs, for benchmarking migrate.py without real servers.
+
+The fake GitLab serves a generated, deterministic data set (users with keys and avatars, groups with members
+and labels, projects with members, labels, milestones, issues and notes). Objects are generated on request,
+so even very large scenarios need no memory. The fake Gitea keeps just enough state for the existence checks
+of the migration: users, organizations, teams, repositories, labels, milestones, collaborators, issues and
+comments. Comment bodies are interned, the repeated generated texts are stored once.
+
+With --gitea-database the fake Gitea also writes its users, organizations, repositories, labels and milestones
+to the Gitea tables of a SQLite database and serves the issues and comments from there, for the database
+backend of the issue import (ISSUE_IMPORT_BACKEND=database with GITEA_DB_PATH set to the same file).
+
+Both servers can delay every response, fail a share of the requests and cap or hide the pagination headers:
+
+    python benchmarks/fake_servers.py --scenario projects-1k --latency 0.002 --error-rate 0.01
+
+prints {"gitlab": <url>, "gitea": <url>} on the first line of stdout and serves until it is terminated.
+"""
+
+import argparse
+import http.server
+import itertools
+import json
+import random
+import re
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+
+TIMESTAMP = '2021-03-04T12:34:56.789Z'
+AVATAR = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 16
+
+SCENARIOS = {
+    # quick check of the harness
+    'smoke': dict(users=20, groups=4, projects=8, issues=10, notes=2),
+    'users-10k': dict(users=10000, groups=50, projects=0, issues=0, notes=0),
+    'projects-1k': dict(users=200, groups=40, projects=1000, issues=5, notes=3),
+    'issues-50k': dict(users=100, groups=1, projects=1, issues=50000, notes=10),
+}
+
+
+# the columns of the Gitea tables that the issue import and its counters use
+GITEA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS `user` (id INTEGER PRIMARY KEY, lower_name TEXT NOT NULL UNIQUE, name TEXT NOT NULL, type INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS repository (id INTEGER PRIMARY KEY, owner_id INTEGER NOT NULL, lower_name TEXT NOT NULL, name TEXT NOT NULL,
+    num_issues INTEGER NOT NULL DEFAULT 0, num_closed_issues INTEGER NOT NULL DEFAULT 0, UNIQUE (owner_id, lower_name));
+CREATE TABLE IF NOT EXISTS issue (id INTEGER PRIMARY KEY AUTOINCREMENT, repo_id INTEGER, `index` INTEGER, poster_id INTEGER,
+    original_author TEXT, original_author_id INTEGER, name TEXT, content TEXT, milestone_id INTEGER, priority INTEGER, is_closed BOOLEAN,
+    is_pull BOOLEAN, num_comments INTEGER, ref TEXT, deadline_unix INTEGER, created_unix INTEGER, updated_unix INTEGER,
+    closed_unix INTEGER, is_locked BOOLEAN, UNIQUE (repo_id, `index`));
+CREATE TABLE IF NOT EXISTS comment (id INTEGER PRIMARY KEY AUTOINCREMENT, type INTEGER, poster_id INTEGER, original_author TEXT,
+    original_author_id INTEGER, issue_id INTEGER, content TEXT, created_unix INTEGER, updated_unix INTEGER);
+CREATE INDEX IF NOT EXISTS comment_issue ON comment (issue_id);
+CREATE TABLE IF NOT EXISTS issue_label (id INTEGER PRIMARY KEY AUTOINCREMENT, issue_id INTEGER, label_id INTEGER, UNIQUE (issue_id, label_id));
+CREATE TABLE IF NOT EXISTS issue_assignees (id INTEGER PRIMARY KEY AUTOINCREMENT, assignee_id INTEGER, issue_id INTEGER);
+CREATE TABLE IF NOT EXISTS issue_index (group_id INTEGER PRIMARY KEY, max_index INTEGER);
+CREATE TABLE IF NOT EXISTS label (id INTEGER PRIMARY KEY, repo_id INTEGER NOT NULL DEFAULT 0, org_id INTEGER NOT NULL DEFAULT 0, name TEXT,
+    num_issues INTEGER NOT NULL DEFAULT 0, num_closed_issues INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS milestone (id INTEGER PRIMARY KEY, repo_id INTEGER NOT NULL, name TEXT, num_issues INTEGER NOT NULL DEFAULT 0,
+    num_closed_issues INTEGER NOT NULL DEFAULT 0, completeness INTEGER NOT NULL DEFAULT 0);
+"""
+
+
+class Scenario:
+    """Sizes of the generated GitLab data set."""
+
+    def __init__(self, users: int, groups: int, projects: int, issues: int, notes: int,
+                 group_members: int = 5, project_members: int = 3, labels: int = 3, milestones: int = 2):
+        self.users = users
+        self.groups = max(1, groups)
+        self.projects = projects
+        self.issues = issues
+        self.notes = notes
+        self.group_members = min(group_members, users)
+        self.project_members = min(project_members, users)
+        self.labels = labels
+        self.milestones = milestones
+
+
+class FakeServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, handler, latency: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 max_page_size: int = 100, total_headers: bool = True):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.max_page_size = max_page_size
+        self.total_headers = total_headers
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:' + str(self.server_address[1])
+
+
+class FakeHandler(http.server.BaseHTTPRequestHandler):
+    """Keep-alive JSON request handler, routes are (method, path regex, handler method name) tuples."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    API_PREFIX = ''
+    ROUTES = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if body and self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(body.decode('utf-8'))
+        return body
+
+    def dispatch(self, method: str):
+        server: FakeServer = self.server
+        with server.lock:
+            server.requests += 1
+        body = self.read_body()
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            self.respond(server.error_status, {"message": "injected error"}, {'Retry-After': '0'})
+            return
+
+        parts = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(parts.query))
+        path = urllib.parse.unquote(parts.path)
+        for route_method, pattern, name in self.ROUTES:
+            match = re.fullmatch(self.API_PREFIX + pattern, path) if route_method == method else None
+            if match:
+                getattr(self, name)(query, body, *match.groups())
+                return
+        self.respond(404, {"message": "Not Found"})
+
+    def respond(self, status: int, data=None, headers: dict = None, content_type: str = 'application/json'):
+        if isinstance(data, bytes):
+            payload = data
+        else:
+            payload = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeGitLab(FakeHandler):
+    API_PREFIX = '/api/v4'
+    ROUTES = [
+        ('GET', r'/user', 'current_user'),
+        ('GET', r'/version', 'version'),
+        ('GET', r'/users', 'users'),
+        ('GET', r'/users/(\d+)', 'user'),
+        ('GET', r'/users/(\d+)/keys', 'user_keys'),
+        ('GET', r'/groups', 'groups'),
+        ('GET', r'/groups/(\d+)', 'group'),
+        ('GET', r'/groups/(\d+)/members(?:/all)?', 'group_members'),
+        ('GET', r'/groups/(\d+)/labels', 'group_labels'),
+        ('GET', r'/groups/(\d+)/projects', 'group_projects'),
+        ('GET', r'/projects', 'projects'),
+        ('GET', r'/projects/(\d+)', 'project'),
+        ('GET', r'/projects/(\d+)/(?:members(?:/all)?|users)', 'project_members'),
+        ('GET', r'/projects/(\d+)/labels', 'project_labels'),
+        ('GET', r'/projects/(\d+)/milestones', 'project_milestones'),
+        ('GET', r'/projects/(\d+)/issues', 'project_issues'),
+        ('GET', r'/projects/(\d+)/issues_statistics', 'issues_statistics'),
+        ('GET', r'/projects/(\d+)/issues/(\d+)/notes', 'issue_notes'),
+        ('GET', r'/projects/(\d+)/uploads/([0-9a-f]+)/(.+)', 'upload'),
+        ('POST', r'/projects/(\d+)/archive', 'archive'),
+    ]
+
+    @property
+    def scenario(self) -> Scenario:
+        return self.server.scenario
+
+    def dispatch(self, method: str):
+        if self.path.startswith('/uploads/-/system/user/avatar/'):
+            self.read_body()
+            self.respond(200, AVATAR, content_type='image/png')
+            return
+        super().dispatch(method)
+
+    def paginate(self, query: dict, count: int, make_item):
+        """Responds with one page of count generated items, with GitLab style Link and X-* headers."""
+        per_page = min(int(query.get('per_page') or 20), self.server.max_page_size)
+        page = int(query.get('page') or 1)
+        first = (page - 1) * per_page
+        items = [make_item(index) for index in range(first, min(count, first + per_page))]
+        headers = {'X-Page': str(page), 'X-Per-Page': str(per_page)}
+        if first + per_page < count:
+            next_query = dict(query, page=page + 1, per_page=per_page)
+            next_url = self.server.url + urllib.parse.urlsplit(self.path).path + '?' + urllib.parse.urlencode(next_query)
+            headers['Link'] = '<' + next_url + '>; rel="next"'
+            headers['X-Next-Page'] = str(page + 1)
+        else:
+            headers['X-Next-Page'] = ''
+        if self.server.total_headers:
+            headers['X-Total'] = str(count)
+            headers['X-Total-Pages'] = str(-(-count // per_page))
+        self.respond(200, items, headers)
+
+    # users
+
+    def make_user(self, index: int) -> dict:
+        user_id = index + 1
+        # every tenth user has the shared default avatar
+        avatar = 'default' if user_id % 10 == 0 else str(user_id)
+        return {
+            "id": user_id, "username": "user" + str(user_id), "name": "User " + str(user_id),
+            "email": "user" + str(user_id) + "@example.com", "state": "active",
+            "avatar_url": self.server.url + "/uploads/-/system/user/avatar/" + avatar + "/avatar.png",
+            "created_at": TIMESTAMP
+        }
+
+    def member(self, user_index: int, access_level: int) -> dict:
+        return dict(self.make_user(user_index % self.scenario.users), access_level=access_level)
+
+    def current_user(self, query, body):
+        self.respond(200, {"id": 0, "username": "root", "name": "Administrator", "is_admin": True})
+
+    def version(self, query, body):
+        self.respond(200, {"version": "16.0.0", "revision": "fake"})
+
+    def users(self, query, body):
+        self.paginate(query, self.scenario.users, self.make_user)
+
+    def user(self, query, body, user_id):
+        if 1 <= int(user_id) <= self.scenario.users:
+            self.respond(200, self.make_user(int(user_id) - 1))
+        else:
+            self.respond(404, {"message": "404 User Not Found"})
+
+    def user_keys(self, query, body, user_id):
+        self.paginate(query, 1, lambda index: {
+            "id": int(user_id), "title": "key" + user_id, "created_at": TIMESTAMP,
+            "key": "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAI" + user_id.rjust(43, 'A') + " user" + user_id
+        })
+
+    # groups
+
+    def make_group(self, index: int) -> dict:
+        group_id = index + 1
+        name = "group" + str(group_id)
+        return {
+            "id": group_id, "name": name, "path": name, "full_name": name, "full_path": name,
+            "description": "Group " + str(group_id), "visibility": "private"
+        }
+
+    def groups(self, query, body):
+        self.paginate(query, self.scenario.groups, self.make_group)
+
+    def group(self, query, body, group_id):
+        self.respond(200, self.make_group(int(group_id) - 1))
+
+    def group_members(self, query, body, group_id):
+        levels = (50, 40, 30, 20, 10)
+        self.paginate(query, self.scenario.group_members,
+                      lambda index: self.member(int(group_id) * 7 + index, levels[index % len(levels)]))
+
+    def group_labels(self, query, body, group_id):
+        self.paginate(query, self.scenario.labels, lambda index: {
+            "id": 100000 + int(group_id) * 100 + index, "name": "group-label-" + str(index), "color": "#428bca",
+            "description": "Group label " + str(index)
+        })
+
+    def group_projects(self, query, body, group_id):
+        ids = range(int(group_id), self.scenario.projects + 1, self.scenario.groups)
+        self.paginate(query, len(ids), lambda index: self.make_project(ids[index] - 1))
+
+    # projects
+
+    def make_project(self, index: int) -> dict:
+        project_id = index + 1
+        group = self.make_group(index % self.scenario.groups)
+        name = "project" + str(project_id)
+        return {
+            "id": project_id, "name": name, "path": name, "description": "Project " + str(project_id),
+            "name_with_namespace": group['name'] + " / " + name, "visibility": "private", "archived": False,
+            "namespace": {"id": group['id'], "name": group['name'], "path": group['path'], "kind": "group", "full_path": group['full_path']},
+            "http_url_to_repo": self.server.url + "/" + group['path'] + "/" + name + ".git",
+            "ssh_url_to_repo": "git@127.0.0.1:" + group['path'] + "/" + name + ".git",
+            "last_activity_at": TIMESTAMP, "empty_repo": False
+        }
+
+    @staticmethod
+    def project_statistics(index: int) -> dict:
+        # a few large repositories among many small ones
+        repository_size = ((index * 7919) % 100) ** 3 * 100
+        return {"repository_size": repository_size, "lfs_objects_size": 0, "storage_size": repository_size, "commit_count": index % 500}
+
+    def projects(self, query, body):
+        if query.get('statistics') in ('true', 'True', '1'):
+            self.paginate(query, self.scenario.projects, lambda index: dict(self.make_project(index), statistics=self.project_statistics(index)))
+        else:
+            self.paginate(query, self.scenario.projects, self.make_project)
+
+    def project(self, query, body, project_id):
+        project = self.make_project(int(project_id) - 1)
+        if query.get('statistics') in ('true', 'True', '1'):
+            project['statistics'] = self.project_statistics(int(project_id) - 1)
+        self.respond(200, project)
+
+    def issues_statistics(self, query, body, project_id):
+        self.respond(200, {"statistics": {"counts": {"all": self.scenario.issues, "closed": 0, "opened": self.scenario.issues}}})
+
+    def project_members(self, query, body, project_id):
+        self.paginate(query, self.scenario.project_members, lambda index: self.member(int(project_id) * 3 + index, (40, 30, 20)[index % 3]))
+
+    def project_labels(self, query, body, project_id):
+        self.paginate(query, self.scenario.labels, lambda index: {
+            "id": int(project_id) * 100 + index, "name": "label-" + str(index), "color": "#d9534f",
+            "description": "Label " + str(index)
+        })
+
+    def make_milestone(self, project_id: int, index: int) -> dict:
+        return {
+            "id": project_id * 100 + index, "iid": index + 1, "title": "Milestone " + str(index + 1),
+            "description": "Milestone " + str(index + 1), "state": "active", "due_date": "2021-12-31",
+            "created_at": TIMESTAMP, "updated_at": TIMESTAMP
+        }
+
+    def project_milestones(self, query, body, project_id):
+        # every object has the same update time, a delta sync after it lists nothing
+        count = 0 if query.get('updated_after', '') > TIMESTAMP else self.scenario.milestones
+        self.paginate(query, count, lambda index: self.make_milestone(int(project_id), index))
+
+    def project_issues(self, query, body, project_id):
+        project_id = int(project_id)
+        count = 0 if query.get('updated_after', '') > TIMESTAMP else self.scenario.issues
+
+        def make_issue(index: int) -> dict:
+            iid = index + 1
+            author = self.make_user((project_id + iid) % self.scenario.users)
+            assignee = self.make_user((project_id + iid * 3) % self.scenario.users) if iid % 2 else None
+            return {
+                "id": project_id * 10000000 + iid, "iid": iid, "project_id": project_id,
+                "title": "Issue " + str(iid) + " of project " + str(project_id),
+                "description": "Something is broken in module " + str(iid % 17) + ".\n\nSteps to reproduce:\n\n1. Open it\n2. Watch it fail",
+                "state": "closed" if iid % 3 == 0 else "opened",
+                "labels": ["label-" + str(iid % max(1, self.scenario.labels))] if self.scenario.labels else [],
+                "milestone": self.make_milestone(project_id, iid % self.scenario.milestones) if self.scenario.milestones and iid % 4 else None,
+                "author": {"id": author['id'], "username": author['username'], "name": author['name']},
+                "assignee": {"id": assignee['id'], "username": assignee['username'], "name": assignee['name']} if assignee else None,
+                "assignees": [{"id": assignee['id'], "username": assignee['username'], "name": assignee['name']}] if assignee else [],
+                "due_date": None, "created_at": TIMESTAMP, "updated_at": TIMESTAMP, "closed_at": None
+            }
+
+        self.paginate(query, count, make_issue)
+
+    def issue_notes(self, query, body, project_id, iid):
+        issue_id = int(project_id) * 10000000 + int(iid)
+
+        def make_note(index: int) -> dict:
+            author = self.make_user((issue_id + index) % self.scenario.users)
+            return {
+                "id": issue_id * 1000 + index, "body": "Comment " + str(index + 1) + " on issue " + iid + ", looks like a regression.",
+                "author": {"id": author['id'], "username": author['username'], "name": author['name']},
+                "created_at": TIMESTAMP, "updated_at": TIMESTAMP, "system": False
+            }
+
+        self.paginate(query, self.scenario.notes, make_note)
+
+    def upload(self, query, body, project_id, secret, filename):
+        self.respond(200, AVATAR, content_type='application/octet-stream')
+
+    def archive(self, query, body, project_id):
+        self.respond(201, dict(self.make_project(int(project_id) - 1), archived=True))
+
+
+class GiteaState:
+    """The Gitea objects created by the migration, keyed by lower case names like in Gitea."""
+
+    def __init__(self, database: str = None):
+        self.lock = threading.Lock()
+        # id 1 is the admin user of the token
+        self.ids = itertools.count(2)
+        self.users = {}
+        self.orgs = {}
+        self.repos = {}
+        self.lists = {}
+        self.issues = {}
+        self.comments = {}
+        self.comments_by_id = {}
+        self.database = None
+        if database:
+            self.database = sqlite3.connect(database, check_same_thread=False, isolation_level=None, timeout=60)
+            self.database.executescript(GITEA_SCHEMA)
+            self.database.execute("INSERT OR IGNORE INTO `user` (id, lower_name, name) VALUES (1, 'gitea_admin', 'gitea_admin')")
+
+    def next_id(self) -> int:
+        return next(self.ids)
+
+    def write(self, sql: str, params: tuple):
+        """Writes a row of the Gitea database, if there is one, the caller holds the lock."""
+        if self.database is not None:
+            self.database.execute(sql, params)
+
+    def read(self, sql: str, params: tuple) -> list:
+        with self.lock:
+            return self.database.execute(sql, params).fetchall()
+
+    def items(self, key: str) -> list:
+        return self.lists.setdefault(key.lower(), [])
+
+
+class FakeGitea(FakeHandler):
+    API_PREFIX = '/api/v1'
+    ROUTES = [
+        ('GET', r'/version', 'version'),
+        ('GET', r'/user', 'current_user'),
+        ('POST', r'/user/avatar', 'no_content'),
+        ('GET', r'/admin/users', 'list_users'),
+        ('POST', r'/admin/users', 'create_user'),
+        ('DELETE', r'/admin/users/([^/]+)', 'delete_user'),
+        ('POST', r'/admin/users/([^/]+)/keys', 'create_key'),
+        ('POST', r'/admin/users/([^/]+)/repos', 'create_repo'),
+        ('GET', r'/users/([^/]+)', 'get_user'),
+        ('GET', r'/users/([^/]+)/keys', 'list_items'),
+        ('GET', r'/users/([^/]+)/repos', 'list_user_repos'),
+        ('GET', r'/orgs', 'list_orgs'),
+        ('POST', r'/orgs', 'create_org'),
+        ('GET', r'/orgs/([^/]+)', 'get_org'),
+        ('DELETE', r'/orgs/([^/]+)', 'delete_org'),
+        ('GET', r'/orgs/([^/]+)/(?:teams|labels)', 'list_items'),
+        ('POST', r'/orgs/([^/]+)/(?:teams|labels)', 'create_item'),
+        ('PATCH', r'/orgs/([^/]+)/labels/(\d+)', 'update_item'),
+        ('GET', r'/orgs/([^/]+)/repos', 'list_user_repos'),
+        ('GET', r'/teams/(\d+)/members', 'list_items'),
+        ('PUT', r'/teams/(\d+)/members/([^/]+)', 'add_member'),
+        ('DELETE', r'/teams/(\d+)/members/([^/]+)', 'remove_member'),
+        ('POST', r'/repos/migrate', 'migrate_repo'),
+        ('GET', r'/repos/([^/]+)/([^/]+)', 'get_repo'),
+        ('DELETE', r'/repos/([^/]+)/([^/]+)', 'delete_repo'),
+        ('GET', r'/repos/([^/]+)/([^/]+)/collaborators', 'list_items'),
+        ('GET', r'/repos/([^/]+)/([^/]+)/collaborators/([^/]+)', 'get_member'),
+        ('PUT', r'/repos/([^/]+)/([^/]+)/collaborators/([^/]+)', 'add_member'),
+        ('DELETE', r'/repos/([^/]+)/([^/]+)/collaborators/([^/]+)', 'remove_member'),
+        ('GET', r'/repos/([^/]+)/([^/]+)/(?:labels|milestones)', 'list_items'),
+        ('POST', r'/repos/([^/]+)/([^/]+)/(?:labels|milestones)', 'create_item'),
+        ('PATCH', r'/repos/([^/]+)/([^/]+)/(?:labels|milestones)/(\d+)', 'update_item'),
+        ('GET', r'/repos/([^/]+)/([^/]+)/issues', 'list_issues'),
+        ('POST', r'/repos/([^/]+)/([^/]+)/issues', 'create_issue'),
+        ('GET', r'/repos/([^/]+)/([^/]+)/issues/comments', 'list_comments'),
+        ('PATCH', r'/repos/([^/]+)/([^/]+)/issues/comments/(\d+)', 'update_comment'),
+        ('POST', r'/repos/([^/]+)/([^/]+)/issues/comments/(\d+)/assets', 'create_asset'),
+        ('GET', r'/repos/([^/]+)/([^/]+)/issues/(\d+)', 'get_issue'),
+        ('PATCH', r'/repos/([^/]+)/([^/]+)/issues/(\d+)', 'get_issue'),
+        ('PUT', r'/repos/([^/]+)/([^/]+)/issues/(\d+)/labels', 'no_content'),
+        ('POST', r'/repos/([^/]+)/([^/]+)/issues/(\d+)/comments', 'create_comment'),
+        ('POST', r'/repos/([^/]+)/([^/]+)/issues/(\d+)/assets', 'create_asset'),
+    ]
+
+    @property
+    def state(self) -> GiteaState:
+        return self.server.state
+
+    def collection(self) -> str:
+        return urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)[len(self.API_PREFIX):]
+
+    def paginate(self, query: dict, items: list):
+        """Responds with one page of items, with the X-Total-Count header of Gitea."""
+        limit = min(int(query.get('limit') or 30), self.server.max_page_size)
+        page = int(query.get('page') or 1)
+        headers = {'X-Total-Count': str(len(items))} if self.server.total_headers else {}
+        self.respond(200, items[(page - 1) * limit:page * limit], headers)
+
+    def no_content(self, query, body, *args):
+        self.respond(204)
+
+    def version(self, query, body):
+        self.respond(200, {"version": "1.21.0"})
+
+    def current_user(self, query, body):
+        self.respond(200, {"id": 1, "login": "gitea_admin", "is_admin": True})
+
+    def list_users(self, query, body):
+        with self.state.lock:
+            users = list(self.state.users.values())
+        self.paginate(query, users)
+
+    def create_user(self, query, body):
+        with self.state.lock:
+            if body['username'].lower() in self.state.users:
+                self.respond(422, {"message": "user already exists"})
+                return
+            user = {"id": self.state.next_id(), "login": body['username'], "username": body['username'],
+                    "full_name": body.get('full_name'), "email": body.get('email')}
+            self.state.users[body['username'].lower()] = user
+            self.state.write("INSERT INTO `user` (id, lower_name, name) VALUES (?, ?, ?)", (user['id'], body['username'].lower(), body['username']))
+        self.respond(201, user)
+
+    def get_user(self, query, body, name):
+        # like Gitea, /users/ also finds organizations
+        with self.state.lock:
+            user = self.state.users.get(name.lower()) or self.state.orgs.get(name.lower())
+        self.respond(200, user) if user else self.respond(404, {"message": "user does not exist"})
+
+    def create_key(self, query, body, name):
+        with self.state.lock:
+            key = dict(body, id=self.state.next_id())
+            self.state.items('/users/' + name + '/keys').append(key)
+        self.respond(201, key)
+
+    def list_user_repos(self, query, body, owner):
+        with self.state.lock:
+            repos = [repo for (repo_owner, _), repo in self.state.repos.items() if repo_owner == owner.lower()]
+        self.paginate(query, repos)
+
+    def delete_user(self, query, body, name):
+        with self.state.lock:
+            if any(owner == name.lower() for owner, _ in self.state.repos):
+                self.respond(422, {"message": "user still has ownership of repositories"})
+                return
+            user = self.state.users.pop(name.lower(), None)
+        self.respond(204) if user else self.respond(404, {"message": "user does not exist"})
+
+    def list_orgs(self, query, body):
+        with self.state.lock:
+            orgs = list(self.state.orgs.values())
+        self.paginate(query, orgs)
+
+    def create_org(self, query, body):
+        with self.state.lock:
+            if body['username'].lower() in self.state.orgs:
+                self.respond(422, {"message": "organization already exists"})
+                return
+            org = dict(body, id=self.state.next_id(), login=body['username'])
+            self.state.orgs[body['username'].lower()] = org
+            self.state.write("INSERT INTO `user` (id, lower_name, name, type) VALUES (?, ?, ?, 1)", (org['id'], body['username'].lower(), body['username']))
+            # like Gitea, every new organization has an Owners team with its creator
+            owners = {"id": self.state.next_id(), "name": "Owners", "permission": "owner"}
+            self.state.items('/orgs/' + body['username'] + '/teams').append(owners)
+            self.state.items('/teams/' + str(owners['id']) + '/members').append({"id": 1, "login": "gitea_admin", "username": "gitea_admin"})
+        self.respond(201, org)
+
+    def get_org(self, query, body, name):
+        with self.state.lock:
+            org = self.state.orgs.get(name.lower())
+        self.respond(200, org) if org else self.respond(404, {"message": "org does not exist"})
+
+    def delete_org(self, query, body, name):
+        with self.state.lock:
+            if any(owner == name.lower() for owner, _ in self.state.repos):
+                self.respond(422, {"message": "org still has ownership of repositories"})
+                return
+            org = self.state.orgs.pop(name.lower(), None)
+        self.respond(204) if org else self.respond(404, {"message": "org does not exist"})
+
+    def list_items(self, query, body, *names):
+        with self.state.lock:
+            items = list(self.state.items(self.collection()))
+        self.paginate(query, items)
+
+    def create_item(self, query, body, *names):
+        collection = self.collection()
+        with self.state.lock:
+            item = dict(body, id=self.state.next_id())
+            self.state.items(collection).append(item)
+            if collection.startswith('/repos/'):
+                repo_id = self.state.repos[(names[0].lower(), names[1].lower())]['id']
+                if collection.endswith('/labels'):
+                    self.state.write("INSERT INTO label (id, repo_id, name) VALUES (?, ?, ?)", (item['id'], repo_id, body['name']))
+                elif collection.endswith('/milestones'):
+                    self.state.write("INSERT INTO milestone (id, repo_id, name) VALUES (?, ?, ?)", (item['id'], repo_id, body['title']))
+            elif collection.endswith('/labels'):
+                org_id = self.state.orgs[names[0].lower()]['id']
+                self.state.write("INSERT INTO label (id, org_id, name) VALUES (?, ?, ?)", (item['id'], org_id, body['name']))
+        self.respond(201, item)
+
+    def update_item(self, query, body, *names):
+        collection, _, item_id = self.collection().rpartition('/')
+        with self.state.lock:
+            for item in self.state.items(collection):
+                if item['id'] == int(item_id):
+                    item.update(body)
+                    self.respond(200, item)
+                    return
+        self.respond(404, {"message": "not found"})
+
+    def get_member(self, query, body, *names):
+        with self.state.lock:
+            found = any(member['username'].lower() == names[-1].lower() for member in self.state.items(self.collection().rpartition('/')[0]))
+        self.respond(204) if found else self.respond(404, {"message": "not a member"})
+
+    def add_member(self, query, body, *names):
+        collection = self.collection().rpartition('/')[0]
+        with self.state.lock:
+            members = self.state.items(collection)
+            if not any(member['username'].lower() == names[-1].lower() for member in members):
+                members.append({"id": self.state.next_id(), "login": names[-1], "username": names[-1]})
+        self.respond(204)
+
+    def remove_member(self, query, body, *names):
+        collection = self.collection().rpartition('/')[0]
+        with self.state.lock:
+            self.state.lists[collection.lower()] = [member for member in self.state.items(collection)
+                                                    if member['username'].lower() != names[-1].lower()]
+        self.respond(204)
+
+    def create_repo(self, query, body, owner):
+        self.add_repo(owner, body['name'])
+
+    def migrate_repo(self, query, body):
+        with self.state.lock:
+            owner = next((entity['login'] for entity in itertools.chain(self.state.users.values(), self.state.orgs.values())
+                          if entity['id'] == body['uid']), None)
+        if owner is None:
+            self.respond(422, {"message": "owner does not exist"})
+        else:
+            self.add_repo(owner, body['repo_name'])
+
+    def add_repo(self, owner: str, name: str):
+        with self.state.lock:
+            if (owner.lower(), name.lower()) in self.state.repos:
+                self.respond(409, {"message": "repository already exists"})
+                return
+            repo = {"id": self.state.next_id(), "name": name, "full_name": owner + "/" + name,
+                    "owner": {"login": owner}, "empty": False}
+            self.state.repos[(owner.lower(), name.lower())] = repo
+            owner_id = (self.state.users.get(owner.lower()) or self.state.orgs[owner.lower()])['id']
+            self.state.write("INSERT INTO repository (id, owner_id, lower_name, name) VALUES (?, ?, ?, ?)", (repo['id'], owner_id, name.lower(), name))
+        self.respond(201, repo)
+
+    def delete_repo(self, query, body, owner, name):
+        with self.state.lock:
+            repo = self.state.repos.pop((owner.lower(), name.lower()), None)
+        self.respond(204) if repo else self.respond(404, {"message": "repo does not exist"})
+
+    def get_repo(self, query, body, owner, name):
+        with self.state.lock:
+            repo = self.state.repos.get((owner.lower(), name.lower()))
+        self.respond(200, repo) if repo else self.respond(404, {"message": "repository does not exist"})
+
+    def issue_url(self, owner: str, name: str, number) -> str:
+        return self.server.url + "/api/v1/repos/" + owner + "/" + name + "/issues/" + str(number)
+
+    def database_issues(self, owner: str, name: str, number: int = None) -> list:
+        rows = self.state.read(
+            "SELECT issue.id, issue.`index`, issue.name, issue.is_closed FROM issue JOIN repository ON issue.repo_id = repository.id "
+            "JOIN `user` ON repository.owner_id = `user`.id WHERE `user`.lower_name = ? AND repository.lower_name = ? AND issue.is_pull = 0 "
+            "AND (? IS NULL OR issue.`index` = ?) ORDER BY issue.`index`", (owner.lower(), name.lower(), number, number)
+        )
+        return [{"id": issue_id, "number": index, "title": title, "state": "closed" if is_closed else "open",
+                 "url": self.issue_url(owner, name, index)} for issue_id, index, title, is_closed in rows]
+
+    def list_issues(self, query, body, owner, name):
+        if self.state.database is not None:
+            self.paginate(query, self.database_issues(owner, name))
+            return
+        with self.state.lock:
+            issues = list(self.state.issues.get((owner.lower(), name.lower()), []))
+        self.paginate(query, issues)
+
+    def create_issue(self, query, body, owner, name):
+        with self.state.lock:
+            issues = self.state.issues.setdefault((owner.lower(), name.lower()), [])
+            number = len(issues) + 1
+            issue = {"id": self.state.next_id(), "number": number, "title": body['title'], "state": "open",
+                     "url": self.issue_url(owner, name, number)}
+            issues.append(issue)
+        self.respond(201, issue)
+
+    def get_issue(self, query, body, owner, name, number):
+        if self.state.database is not None:
+            issues = self.database_issues(owner, name, int(number))
+            self.respond(200, issues[0]) if issues else self.respond(404, {"message": "issue does not exist"})
+            return
+        with self.state.lock:
+            issues = self.state.issues.get((owner.lower(), name.lower()), [])
+            issue = issues[int(number) - 1] if 0 < int(number) <= len(issues) else None
+        self.respond(200, issue) if issue else self.respond(404, {"message": "issue does not exist"})
+
+    def list_comments(self, query, body, owner, name):
+        if self.state.database is not None:
+            rows = self.state.read(
+                "SELECT comment.id, comment.content, issue.`index` FROM comment JOIN issue ON comment.issue_id = issue.id "
+                "JOIN repository ON issue.repo_id = repository.id JOIN `user` ON repository.owner_id = `user`.id "
+                "WHERE `user`.lower_name = ? AND repository.lower_name = ? ORDER BY comment.id", (owner.lower(), name.lower())
+            )
+            self.paginate(query, [{"id": comment_id, "body": content, "issue_url": self.issue_url(owner, name, index)}
+                                  for comment_id, content, index in rows])
+            return
+        with self.state.lock:
+            comments = list(self.state.comments.get((owner.lower(), name.lower()), []))
+        self.paginate(query, comments)
+
+    def create_comment(self, query, body, owner, name, number):
+        with self.state.lock:
+            comment = {"id": self.state.next_id(), "body": sys.intern(body['body']), "issue_url": self.issue_url(owner, name, number)}
+            self.state.comments.setdefault((owner.lower(), name.lower()), []).append(comment)
+            self.state.comments_by_id[comment['id']] = comment
+        self.respond(201, comment)
+
+    def update_comment(self, query, body, owner, name, comment_id):
+        with self.state.lock:
+            comment = self.state.comments_by_id.get(int(comment_id))
+            if comment is not None:
+                comment['body'] = sys.intern(body['body'])
+        self.respond(200, comment) if comment else self.respond(404, {"message": "comment does not exist"})
+
+    def create_asset(self, query, body, *names):
+        with self.state.lock:
+            asset_id = self.state.next_id()
+        self.respond(201, {"id": asset_id, "browser_download_url": self.server.url + "/attachments/" + str(asset_id)})
+
+
+def start(scenario: Scenario, gitea_database: str = None, **options) -> (FakeServer, FakeServer):
+    """
+    Starts a fake GitLab and a fake Gitea on free local ports, options are passed to both FakeServers. The
+    fake Gitea writes to the Gitea tables of the SQLite database gitea_database, if given.
+    """
+    gitlab_server = FakeServer(FakeGitLab, **options)
+    gitlab_server.scenario = scenario
+    gitea_server = FakeServer(FakeGitea, **options)
+    gitea_server.state = GiteaState(gitea_database)
+    for server in (gitlab_server, gitea_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return gitlab_server, gitea_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', default='smoke', choices=sorted(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with --error-status')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--max-page-size', type=int, default=100, help='cap of per_page (GitLab) and limit (Gitea)')
+    parser.add_argument('--no-total-headers', action='store_true', help='omit X-Total (GitLab) and X-Total-Count (Gitea)')
+    parser.add_argument('--gitea-database', help='SQLite database file for the Gitea tables of the issue import')
+    args = parser.parse_args()
+
+    gitlab_server, gitea_server = start(Scenario(**SCENARIOS[args.scenario]), gitea_database=args.gitea_database, latency=args.latency,
+                                        error_rate=args.error_rate, error_status=args.error_status, max_page_size=args.max_page_size,
+                                        total_headers=not args.no_total_headers)
+    print(json.dumps({"gitlab": gitlab_server.url, "gitea": gitea_server.url}))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
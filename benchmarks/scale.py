@@ -0,0 +1,326 @@
+"""
+Scale benchmark of the migration against the local fake GitLab and Gitea servers of fake_servers.py.
+
+Every scenario runs in a fresh process with its own journal. The migration is driven phase by phase with
+the functions main() uses (discovery, users, groups, projects), followed by a rerun with an empty journal
+that finds everything in Gitea already. The wall time, the number of requests, the errors and the peak RSS
+of every phase are reported:
+
+    python benchmarks/scale.py smoke projects-1k --latency 0.002 --output results.json
+    python benchmarks/scale.py projects-1k --by-groups --schedule size --compare results.json --tolerance 0.2
+    python benchmarks/scale.py projects-1k --shard-workers 3
+
+--by-groups, --schedule, --shard-workers and --issue-backend set MIGRATE_BY_GROUPS, PROJECT_SCHEDULE,
+WORK_LEDGER and ISSUE_IMPORT_BACKEND for the migration. A sharded run starts that many worker processes on one work ledger and reports their discovery,
+users, groups and projects together as one phase, the slowest worker sets its time. Results are keyed by the
+scenario and these options, with --compare the run fails if a phase is slower, or sends more requests,
+than in the baseline report of the same configuration beyond the tolerance.
+
+With --issue-backend database the issues and comments are inserted into a SQLite database with the Gitea
+tables, see fake_servers.py, and the rows and counters are checked afterwards; the run fails if they do not
+match the scenario. It has no rerun, the comments would be inserted again: existing comments are looked up
+by the GitLab note body, the migrated comments carry the author and creation time as well.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+import fake_servers  # noqa: E402
+
+
+class RssSampler:
+    """Samples the resident set size of the process in the background and keeps the peak."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def rss() -> int:
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * resource.getpagesize()
+        except OSError:
+            # no procfs, the peak of the whole process is the best there is (kilobytes on Linux, bytes on macOS)
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self.rss())
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+def run_scenario(result_path: str, rerun: bool):
+    """Worker process: runs the migration against the servers configured in the environment."""
+    import migrate
+
+    results = []
+
+    @contextlib.contextmanager
+    def phase(name: str):
+        requests_before = sum(stats["requests"] for stats in migrate.REQUEST_METRICS.report()["endpoints"])
+        errors_before = migrate.GLOBAL_ERROR_COUNT
+        started = time.monotonic()
+        with RssSampler() as sampler, migrate.metrics_phase(name):
+            yield
+        requests = sum(stats["requests"] for stats in migrate.REQUEST_METRICS.report()["endpoints"]) - requests_before
+        results.append({
+            "phase": name, "seconds": round(time.monotonic() - started, 3), "requests": requests,
+            "errors": migrate.GLOBAL_ERROR_COUNT - errors_before, "peak_rss_mb": round(sampler.peak / 1024 / 1024, 1)
+        })
+
+    gl = migrate.GitlabClient(migrate.GITLAB_URL, private_token=migrate.GITLAB_TOKEN, session=migrate.GITLAB_SESSION)
+    gl.auth()
+    gt = migrate.GiteaClient(migrate.GITEA_URL, migrate.GITEA_TOKEN)
+
+    def import_projects(projects):
+        if migrate.PROJECT_SCHEDULE == 'size':
+            migrate.import_projects_scheduled(gl, gt, projects)
+        else:
+            migrate.import_projects(gl, gt, projects)
+
+    # the migration output is not part of the benchmark
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        migrate.setup_logging()
+        if migrate.WORK_LEDGER:
+            # the first worker discovers for all of them
+            with phase('sharded'):
+                migrate.import_sharded(gl, gt)
+        else:
+            with phase('discovery'):
+                users, groups, projects = migrate.discover(gl)
+            with phase('users'):
+                migrate._import_users(gt, users)
+            with phase('groups'):
+                migrate._import_groups(gt, groups)
+            with phase('projects'):
+                import_projects(projects)
+
+            if rerun:
+                # a run that lost its journal: every user, group, repository, issue and comment is looked up in Gitea
+                migrate.get_journal().reset()
+                with phase('rerun'):
+                    users, groups, projects = migrate.discover(gl)
+                    migrate._import_users(gt, users)
+                    migrate._import_groups(gt, groups)
+                    import_projects(projects)
+
+        migrate.LOG_WRITER.stop()
+
+    report = migrate.REQUEST_METRICS.report()
+    with open(result_path, 'w') as f:
+        json.dump({"phases": results, "endpoints": report["endpoints"][:10]}, f)
+
+
+def merge_results(results: [{}]) -> {}:
+    """Merges the results of the workers of a sharded run, they work in parallel, so the slowest one sets the time."""
+    phases = {}
+    for result in results:
+        for phase in result["phases"]:
+            merged = phases.setdefault(phase["phase"], dict(phase, seconds=0.0, requests=0, errors=0, peak_rss_mb=0.0))
+            merged["seconds"] = max(merged["seconds"], phase["seconds"])
+            merged["requests"] += phase["requests"]
+            merged["errors"] += phase["errors"]
+            merged["peak_rss_mb"] = max(merged["peak_rss_mb"], phase["peak_rss_mb"])
+    endpoints = sorted((stats for result in results for stats in result["endpoints"]), key=lambda stats: stats["seconds_total"], reverse=True)
+    return {"phases": list(phases.values()), "endpoints": endpoints[:10]}
+
+
+def check_gitea_database(path: str, scenario: dict) -> [str]:
+    """Compares the issues, comments and counters in the Gitea database with the generated GitLab data set."""
+    issues, notes = scenario['issues'], scenario['notes']
+    labels, milestones = scenario.get('labels', 3), scenario.get('milestones', 2)
+    database = sqlite3.connect(path)
+    failures = []
+
+    def check(what: str, sql: str, params=()):
+        failures.extend(what + ": " + str(row) for row in database.execute(sql, params).fetchall())
+
+    repositories = database.execute("SELECT count(*) FROM repository").fetchone()[0]
+    if repositories != scenario['projects']:
+        failures.append("repositories: " + str(repositories) + " instead of " + str(scenario['projects']))
+    # every third generated issue is closed, every issue has a label and all but every fourth a milestone
+    check("repository issues (id, issues, numbers, max number, issue index, num_issues, closed, num_closed_issues, labels, milestones)",
+          "SELECT repository.id, count(issue.id), count(DISTINCT issue.`index`), max(issue.`index`), "
+          "(SELECT max_index FROM issue_index WHERE group_id = repository.id), repository.num_issues, "
+          "sum(issue.is_closed), repository.num_closed_issues, "
+          "(SELECT count(*) FROM issue_label JOIN issue AS labeled ON labeled.id = issue_label.issue_id WHERE labeled.repo_id = repository.id), "
+          "sum(issue.milestone_id > 0) "
+          "FROM repository LEFT JOIN issue ON issue.repo_id = repository.id GROUP BY repository.id "
+          "HAVING count(issue.id) != :issues OR count(DISTINCT issue.`index`) != :issues OR coalesce(max(issue.`index`), 0) != :issues "
+          "OR coalesce((SELECT max_index FROM issue_index WHERE group_id = repository.id), 0) != :issues OR repository.num_issues != :issues "
+          "OR coalesce(sum(issue.is_closed), 0) != :closed OR repository.num_closed_issues != :closed "
+          "OR (SELECT count(*) FROM issue_label JOIN issue AS labeled ON labeled.id = issue_label.issue_id WHERE labeled.repo_id = repository.id) != :labeled "
+          "OR coalesce(sum(issue.milestone_id > 0), 0) != :with_milestone",
+          {"issues": issues, "closed": issues // 3, "labeled": issues if labels else 0,
+           "with_milestone": issues - issues // 4 if milestones else 0})
+    check("issue comments (id, comments, num_comments)",
+          "SELECT issue.id, count(comment.id), issue.num_comments FROM issue LEFT JOIN comment ON comment.issue_id = issue.id "
+          "GROUP BY issue.id HAVING count(comment.id) != ? OR issue.num_comments != ?", (notes, notes))
+    check("label counters (id, num_issues, issues, num_closed_issues, closed)",
+          "SELECT label.id, label.num_issues, count(issue.id), label.num_closed_issues, coalesce(sum(issue.is_closed), 0) FROM label "
+          "LEFT JOIN issue_label ON issue_label.label_id = label.id LEFT JOIN issue ON issue.id = issue_label.issue_id GROUP BY label.id "
+          "HAVING label.num_issues != count(issue.id) OR label.num_closed_issues != coalesce(sum(issue.is_closed), 0)")
+    check("milestone counters (id, num_issues, issues, num_closed_issues, closed, completeness)",
+          "SELECT milestone.id, milestone.num_issues, count(issue.id), milestone.num_closed_issues, coalesce(sum(issue.is_closed), 0), "
+          "milestone.completeness FROM milestone LEFT JOIN issue ON issue.milestone_id = milestone.id GROUP BY milestone.id "
+          "HAVING milestone.num_issues != count(issue.id) OR milestone.num_closed_issues != coalesce(sum(issue.is_closed), 0) "
+          "OR milestone.completeness != (CASE WHEN count(issue.id) > 0 THEN coalesce(sum(issue.is_closed), 0) * 100 / count(issue.id) ELSE 0 END)")
+    database.close()
+    return failures
+
+
+def scenario_key(scenario: str, args) -> str:
+    """Names the scenario together with the options that change the code paths of the migration."""
+    options = []
+    if args.by_groups:
+        options.append('by-groups')
+    if args.schedule != 'listing':
+        options.append('schedule-' + args.schedule)
+    if args.shard_workers:
+        options.append('shards-' + str(args.shard_workers))
+    if args.issue_backend != 'api':
+        options.append('issues-' + args.issue_backend)
+    return '+'.join([scenario] + options)
+
+
+def benchmark(scenario: str, args) -> {}:
+    with tempfile.TemporaryDirectory() as work_dir:
+        gitea_database = os.path.join(work_dir, 'gitea.db')
+        server_command = [sys.executable, os.path.join(BENCHMARK_DIR, 'fake_servers.py'), '--scenario', scenario,
+                          '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+                          '--error-status', str(args.error_status), '--max-page-size', str(args.max_page_size)]
+        if args.no_total_headers:
+            server_command.append('--no-total-headers')
+        if args.issue_backend == 'database':
+            server_command += ['--gitea-database', gitea_database]
+        server = subprocess.Popen(server_command, stdout=subprocess.PIPE, universal_newlines=True)
+        try:
+            urls = json.loads(server.stdout.readline())
+            env = dict(os.environ, GITLAB_URL=urls['gitlab'], GITLAB_TOKEN='token', GITEA_URL=urls['gitea'], GITEA_TOKEN='token',
+                       JOURNAL_PATH=os.path.join(work_dir, 'journal.sqlite'), METRICS_REPORT_PATH='', METRICS_PORT='0',
+                       PROJECT_WORKERS=str(args.project_workers), REPOSITORY_TRANSFER_MODE='migrate', DELTA_SYNC='0',
+                       MIGRATE_BY_GROUPS='1' if args.by_groups else '0', PROJECT_SCHEDULE=args.schedule,
+                       WORK_LEDGER=os.path.join(work_dir, 'ledger.sqlite') if args.shard_workers else '', WORKER_PROCESSES='1',
+                       ISSUE_IMPORT_BACKEND=args.issue_backend, GITEA_DB_TYPE='sqlite3', GITEA_DB_PATH=gitea_database,
+                       PYTHONPATH=os.path.join(BENCHMARK_DIR, '..'))
+            rerun = not args.no_rerun and args.issue_backend == 'api'
+            worker_command = [sys.executable, os.path.abspath(__file__), '--worker', '--rerun' if rerun else '--no-rerun']
+            result_paths = [os.path.join(work_dir, 'result.' + str(index) + '.json') for index in range(max(1, args.shard_workers))]
+            workers = [subprocess.Popen(worker_command + [result_path], env=dict(env, WORKER_ID='benchmark/' + str(index)), cwd=work_dir)
+                       for index, result_path in enumerate(result_paths)]
+            for worker in workers:
+                if worker.wait() != 0:
+                    raise subprocess.CalledProcessError(worker.returncode, worker_command)
+        finally:
+            server.terminate()
+            server.wait()
+
+        results = []
+        for result_path in result_paths:
+            with open(result_path) as f:
+                results.append(json.load(f))
+        result = merge_results(results)
+        if args.issue_backend == 'database':
+            result["check_failures"] = check_gitea_database(gitea_database, fake_servers.SCENARIOS[scenario])
+        return result
+
+
+def compare(results: {}, baseline: {}, tolerance: float) -> [str]:
+    regressions = []
+    for scenario, result in results.items():
+        baseline_phases = {phase["phase"]: phase for phase in baseline.get(scenario, {}).get("phases", [])}
+        for phase in result["phases"]:
+            before = baseline_phases.get(phase["phase"])
+            if before is None:
+                continue
+            for field in ("seconds", "requests"):
+                if phase[field] > before[field] * (1 + tolerance) and phase[field] - before[field] > (0.05 if field == "seconds" else 0):
+                    regressions.append(scenario + " " + phase["phase"] + ": " + field + " " + str(before[field]) + " -> " + str(phase[field]))
+    return regressions
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--worker':
+        run_scenario(sys.argv[3], sys.argv[2] == '--rerun')
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenarios', nargs='*', default=['smoke'], help='one or more of ' + ', '.join(sorted(fake_servers.SCENARIOS)))
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response of the fake servers')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--max-page-size', type=int, default=100)
+    parser.add_argument('--no-total-headers', action='store_true')
+    parser.add_argument('--project-workers', type=int, default=4)
+    parser.add_argument('--by-groups', action='store_true', help='discover the users and projects by crawling the groups')
+    parser.add_argument('--schedule', choices=['listing', 'size'], default='listing', help='PROJECT_SCHEDULE of the migration')
+    parser.add_argument('--shard-workers', type=int, default=0, help='migrate with this many worker processes on one work ledger')
+    parser.add_argument('--no-rerun', action='store_true', help='skip the rerun with an empty journal')
+    parser.add_argument('--issue-backend', choices=['api', 'database'], default='api',
+                        help='ISSUE_IMPORT_BACKEND of the migration, database checks the Gitea rows and counters afterwards')
+    parser.add_argument('--output', help='write the results as JSON, e.g. as a baseline for --compare')
+    parser.add_argument('--compare', help='baseline results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression for --compare')
+    args = parser.parse_args()
+
+    results = {}
+    check_failures = []
+    for scenario in args.scenarios:
+        if scenario not in fake_servers.SCENARIOS:
+            parser.error("unknown scenario " + scenario)
+        key = scenario_key(scenario, args)
+        print("Scenario " + key + " " + json.dumps(fake_servers.SCENARIOS[scenario]))
+        results[key] = benchmark(scenario, args)
+        print("    {:10} {:>10} {:>10} {:>10} {:>8} {:>12}".format('phase', 'seconds', 'requests', 'req/s', 'errors', 'peak RSS MB'))
+        for phase in results[key]["phases"]:
+            rate = phase["requests"] / phase["seconds"] if phase["seconds"] else 0
+            print("    {:10} {:>10.2f} {:>10} {:>10.0f} {:>8} {:>12.1f}".format(
+                phase["phase"], phase["seconds"], phase["requests"], rate, phase["errors"], phase["peak_rss_mb"]))
+        if "check_failures" in results[key]:
+            print("    database check: " + (str(len(results[key]["check_failures"])) + " mismatches" if results[key]["check_failures"] else "ok"))
+            check_failures += [key + " " + failure for failure in results[key]["check_failures"]]
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    for failure in check_failures[:50]:
+        print("CHECK FAILED " + failure)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+    if regressions or check_failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
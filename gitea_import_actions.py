@@ -1,34 +1,269 @@
-# Import commits to gitea action database.
+# Import the commit history of migrated repositories into the Gitea action table, so the activity heatmaps
+# and feeds of the users also show the commits made before the migration.
+#
+# The bare repositories are read directly, either from the Gitea repository root (<owner>/<repo>.git) or from
+# the mirror cache of migrate.py in push mode (<gitlab project id>.git, resolved through the repository migrations
+# recorded in the migration journal).
+# Commits are streamed from git log, commit authors are matched to Gitea users by e-mail address and inserted
+# in batches, one transaction per repository. Commits that are already in the action table are skipped, so the
+# script can be re-run at any time.
+#
 # use:
-# git log --pretty=format:'%H,%at,%s' --date=default > /tmp/commit.log
-# to get the commits logfile for a repository
+# ACTIONS_REPOSITORY_ROOT=/data/git/repositories GITEA_DB_TYPE=mysql GITEA_DB_PASSWD=... python3 gitea_import_actions.py
 
-import mysql.connector as mariadb
+import concurrent.futures
+import datetime
+import json
+import os
+import sqlite3
+import subprocess
+import tempfile
+import threading
 
-# set the following variables to fit your need...
-USERID = 1
-REPOID = 1
-BRANCH = "master"
+#######################
+# CONFIG SECTION START
+#######################
 
-mydb = mariadb.connect(
-  host="localhost",
-  user="user",
-  passwd="password",
-  database="gitea"
-)
+# Directory of the bare repositories and its layout:
+#  - 'gitea': the Gitea repository root, <owner>/<repo>.git
+#  - 'mirror_cache': the MIRROR_CACHE_DIR of migrate.py, <gitlab project id>.git
+ACTIONS_REPOSITORY_ROOT = os.getenv('ACTIONS_REPOSITORY_ROOT', '/data/git/repositories')
+ACTIONS_REPOSITORY_LAYOUT = os.getenv('ACTIONS_REPOSITORY_LAYOUT', 'gitea')
+# Migration journal of migrate.py, needed for the 'mirror_cache' layout
+JOURNAL_PATH = os.getenv('JOURNAL_PATH', 'migration_journal.sqlite')
 
-mycursor = mydb.cursor()
+# Branch whose commits are imported, the default branch of each repository if empty
+ACTIONS_BRANCH = os.getenv('ACTIONS_BRANCH', '')
+# Gitea user the commits of unknown e-mail addresses are attributed to, these commits are skipped if empty
+ACTIONS_FALLBACK_USER = os.getenv('ACTIONS_FALLBACK_USER', '')
 
-sql = "INSERT INTO action (user_id, op_type, act_user_id, repo_id, comment_id, ref_name, is_private, created_unix) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+# Number of repositories imported in parallel and number of rows per multi-row insert
+ACTIONS_WORKERS = int(os.getenv('ACTIONS_WORKERS', '4'))
+ACTIONS_BATCH_SIZE = int(os.getenv('ACTIONS_BATCH_SIZE', '1000'))
 
-with open("/tmp/commit.log") as f:
-    for line in f:
-        line_clean = line.rstrip('\n')
-        line_split = line_clean.split(',')
-        val = (USERID, 5, USERID, REPOID, 0, BRANCH, 1, int(line_split[1]))  # 5 means commit
-        print(val)
-        mycursor.execute(sql, val)
+# Gitea database, same settings as the [database] section of the Gitea app.ini (DB_TYPE 'sqlite3' or 'mysql')
+GITEA_DB_TYPE = os.getenv('GITEA_DB_TYPE', 'mysql')
+GITEA_DB_PATH = os.getenv('GITEA_DB_PATH', '/data/gitea/gitea.db')
+GITEA_DB_HOST = os.getenv('GITEA_DB_HOST', 'localhost:3306')
+GITEA_DB_NAME = os.getenv('GITEA_DB_NAME', 'gitea')
+GITEA_DB_USER = os.getenv('GITEA_DB_USER', 'user')
+GITEA_DB_PASSWD = os.getenv('GITEA_DB_PASSWD', 'password')
+#######################
+# CONFIG SECTION END
+#######################
 
-mydb.commit()
+OP_COMMIT_REPO = 5  # action type of pushed commits
+PRINT_LOCK = threading.Lock()
 
-print("actions inserted.")
\ No newline at end of file
+
+def connect():
+    if GITEA_DB_TYPE == 'sqlite3':
+        return sqlite3.connect(GITEA_DB_PATH, isolation_level=None, timeout=60)
+    elif GITEA_DB_TYPE == 'mysql':
+        import mysql.connector as mariadb
+
+        host, _, port = GITEA_DB_HOST.partition(':')
+        # autocommit like the SQLite connection, so reads do not open a transaction before start_transaction()
+        return mariadb.connect(host=host, port=int(port or 3306), user=GITEA_DB_USER, passwd=GITEA_DB_PASSWD, database=GITEA_DB_NAME,
+                               autocommit=True)
+    else:
+        raise ValueError("Unsupported GITEA_DB_TYPE " + GITEA_DB_TYPE + ", use 'sqlite3' or 'mysql'")
+
+
+def sql(statement: str) -> str:
+    return statement if GITEA_DB_TYPE == 'sqlite3' else statement.replace('?', '%s')
+
+
+def open_cursor(connection):
+    # MySQL cursors are buffered, an unread result of fetchone() would block the next statement
+    return connection.cursor() if GITEA_DB_TYPE == 'sqlite3' else connection.cursor(buffered=True)
+
+
+def log(message: str):
+    with PRINT_LOCK:
+        print(message)
+
+
+def find_repositories() -> [(str, str, str)]:
+    """Returns the (git dir, owner, repo name) tuples of all bare repositories below ACTIONS_REPOSITORY_ROOT."""
+    repositories = []
+    if ACTIONS_REPOSITORY_LAYOUT == 'gitea':
+        for owner in sorted(os.listdir(ACTIONS_REPOSITORY_ROOT)):
+            owner_path = os.path.join(ACTIONS_REPOSITORY_ROOT, owner)
+            if not os.path.isdir(owner_path):
+                continue
+            for repo in sorted(os.listdir(owner_path)):
+                if repo.endswith('.git'):
+                    repositories.append((os.path.join(owner_path, repo), owner, repo[:-len('.git')]))
+    elif ACTIONS_REPOSITORY_LAYOUT == 'mirror_cache':
+        # push mode records every synchronized repository in repo_clones, the 'repo' entities only exist in migrate mode
+        journal = sqlite3.connect(JOURNAL_PATH)
+        migrated_repos = dict(journal.execute("SELECT gitlab_id, gitea_id FROM entities WHERE kind = 'repo'").fetchall())
+        migrated_repos.update(journal.execute("SELECT project_id, repo FROM repo_clones").fetchall())
+        journal.close()
+        for mirror in sorted(os.listdir(ACTIONS_REPOSITORY_ROOT)):
+            if not mirror.endswith('.git'):
+                continue
+            project_id = mirror[:-len('.git')]
+            if project_id not in migrated_repos:
+                log("Mirror " + mirror + " has no migrated repository in the journal " + JOURNAL_PATH + ", skipping!")
+                continue
+            owner, _, repo = migrated_repos[project_id].partition('/')
+            repositories.append((os.path.join(ACTIONS_REPOSITORY_ROOT, mirror), owner, repo))
+    else:
+        raise ValueError("Unsupported ACTIONS_REPOSITORY_LAYOUT " + ACTIONS_REPOSITORY_LAYOUT + ", use 'gitea' or 'mirror_cache'")
+
+    return repositories
+
+
+def load_user_emails(connection) -> {}:
+    """Returns the Gitea user ids by lower case e-mail address, primary and additional addresses."""
+    cursor = open_cursor(connection)
+    cursor.execute("SELECT lower(email), id FROM `user` WHERE email <> ''")
+    user_emails = dict(cursor.fetchall())
+    cursor.execute(sql("SELECT lower_email, uid FROM email_address WHERE is_activated = ?"), (True,))
+    user_emails.update(cursor.fetchall())
+    cursor.close()
+    return user_emails
+
+
+def load_user_id(connection, username: str) -> int:
+    cursor = open_cursor(connection)
+    cursor.execute(sql("SELECT id FROM `user` WHERE lower_name = ?"), (username.lower(),))
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None:
+        raise LookupError("Fallback user " + username + " not found in Gitea")
+    return row[0]
+
+
+def stream_commits(git_dir: str, branch: str):
+    """Yields the (sha, author e-mail, author name, timestamp, subject) tuples of the branch, newest first."""
+    # stderr goes to a file, a pipe that is only read after stdout could fill up and block git
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(
+            ['git', '--git-dir', git_dir, 'log', '--format=%H%x00%ae%x00%an%x00%at%x00%s', 'refs/heads/' + branch, '--'],
+            stdout=subprocess.PIPE, stderr=stderr_file
+        )
+        try:
+            for line in process.stdout:
+                sha, email, name, timestamp, subject = line.decode('utf-8', errors='replace').rstrip('\n').split('\x00', 4)
+                yield sha, email, name, int(timestamp), subject
+        finally:
+            process.stdout.close()
+            if process.wait() != 0:
+                stderr_file.seek(0)
+                raise RuntimeError("git log of " + git_dir + " failed: " + stderr_file.read().decode('utf-8', errors='replace').strip())
+
+
+def existing_commits(cursor, repo_id: int, branch: str) -> (set, set):
+    """
+    Returns the commit ids and the (user id, timestamp) pairs of the commit actions of a repository.
+    Actions of earlier versions of this script have no content and are matched by user and time.
+    """
+    cursor.execute(sql("SELECT act_user_id, created_unix, content FROM action WHERE repo_id = ? AND op_type = ? AND ref_name = ?"),
+                   (repo_id, OP_COMMIT_REPO, branch))
+    shas = set()
+    user_times = set()
+    for act_user_id, created_unix, content in cursor.fetchall():
+        if not content:
+            user_times.add((act_user_id, created_unix))
+            continue
+        try:
+            shas.update(commit['Sha1'] for commit in json.loads(content).get('Commits') or [])
+        except ValueError:
+            pass
+    return shas, user_times
+
+
+def import_repository(git_dir: str, owner: str, repo: str, user_emails: {}, fallback_user_id: int) -> int:
+    connection = connect()
+    cursor = open_cursor(connection)
+    try:
+        cursor.execute(sql(
+            "SELECT repository.id, repository.is_private, repository.default_branch FROM repository "
+            "JOIN `user` ON repository.owner_id = `user`.id WHERE `user`.lower_name = ? AND repository.lower_name = ?"
+        ), (owner.lower(), repo.lower()))
+        row = cursor.fetchone()
+        if row is None:
+            log("Repository " + owner + "/" + repo + " not found in Gitea, skipping!")
+            return 0
+        repo_id, is_private, default_branch = row
+        branch = ACTIONS_BRANCH or default_branch
+        if subprocess.run(['git', '--git-dir', git_dir, 'rev-parse', '--verify', '--quiet', 'refs/heads/' + branch],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+            log("Repository " + owner + "/" + repo + " has no branch " + branch + ", skipping!")
+            return 0
+
+        if GITEA_DB_TYPE == 'sqlite3':
+            cursor.execute("BEGIN IMMEDIATE")
+        else:
+            connection.start_transaction()
+
+        shas, user_times = existing_commits(cursor, repo_id, branch)
+        statement = sql(
+            "INSERT INTO action (user_id, op_type, act_user_id, repo_id, comment_id, ref_name, is_private, content, created_unix) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        )
+        inserted = 0
+        skipped = 0
+        batch = []
+        for sha, email, name, timestamp, subject in stream_commits(git_dir, branch):
+            user_id = user_emails.get(email.lower(), fallback_user_id)
+            if user_id is None or sha in shas or (user_id, timestamp) in user_times:
+                skipped += 1
+                continue
+
+            content = json.dumps({
+                "Commits": [{"Sha1": sha, "Message": subject, "AuthorEmail": email, "AuthorName": name,
+                             "CommitterEmail": email, "CommitterName": name,
+                             "Timestamp": datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}],
+                "HeadCommit": None, "CompareURL": "", "Len": 1
+            })
+            batch.append((user_id, OP_COMMIT_REPO, user_id, repo_id, 0, branch, is_private, content, timestamp))
+            if len(batch) >= ACTIONS_BATCH_SIZE:
+                cursor.executemany(statement, batch)
+                inserted += len(batch)
+                batch = []
+
+        if batch:
+            cursor.executemany(statement, batch)
+            inserted += len(batch)
+        connection.commit()
+        log("Repository " + owner + "/" + repo + ": " + str(inserted) + " actions inserted, " + str(skipped) + " commits skipped.")
+        return inserted
+    except BaseException:
+        if GITEA_DB_TYPE == 'mysql' or connection.in_transaction:
+            connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def main():
+    repositories = find_repositories()
+    print("Found " + str(len(repositories)) + " repositories in " + ACTIONS_REPOSITORY_ROOT)
+
+    connection = connect()
+    user_emails = load_user_emails(connection)
+    fallback_user_id = load_user_id(connection, ACTIONS_FALLBACK_USER) if ACTIONS_FALLBACK_USER else None
+    connection.close()
+
+    inserted = 0
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, ACTIONS_WORKERS)) as executor:
+        futures = {executor.submit(import_repository, git_dir, owner, repo, user_emails, fallback_user_id): owner + "/" + repo
+                   for git_dir, owner, repo in repositories}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                inserted += future.result()
+            except Exception as e:
+                failed += 1
+                log("Repository " + futures[future] + " failed: " + str(e))
+
+    print(str(inserted) + " actions inserted, " + str(failed) + " repositories failed.")
+
+
+if __name__ == "__main__":
+    main()
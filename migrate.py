@@ -1,20 +1,42 @@
+import atexit
 import base64
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import hashlib
+import heapq
+import importlib
+import http.server
 import os
+import threading
+import uuid
 import time
 import random
+import socket
+import socketserver
+import sqlite3
 import string
+import subprocess
+import sys
 import requests
 import json
+import logging
+import logging.handlers
+import queue
 import dateutil.parser
 import datetime
+import email.utils
+import functools
+import gzip
 import re
-from typing import List
-import json
+import urllib.parse
+from typing import Dict, Iterable, List
 import pytz
 
 import gitlab  # pip install python-gitlab
 import gitlab.v4.objects
-import pygitea # pip install pygitea (https://github.com/h44z/pygitea)
 
 SCRIPT_VERSION = "1.0"
 GLOBAL_ERROR_COUNT = 0
@@ -23,11 +45,27 @@ GLOBAL_ERROR_COUNT = 0
 # CONFIG SECTION START
 #######################
 
+# Migration stage:
+#  - 'migrate': read GitLab and load Gitea in one run
+#  - 'export': only read GitLab into a snapshot in SNAPSHOT_DIR (compressed JSONL files and a blob store
+#              for uploads and avatars, plus the mirror cache in push mode), Gitea is not contacted
+#  - 'import': only load Gitea from the snapshot in SNAPSHOT_DIR, the GitLab API is not contacted. Repositories
+#              are cloned from GitLab in 'migrate' transfer mode and pushed from the mirror cache in 'push' mode.
+MIGRATION_STAGE = os.getenv('MIGRATION_STAGE', 'migrate')
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'snapshot')
+
 # Gitea user to use as a fallback for groups
 # for cases where the user's permissions are too limited to access group member details on GitLab.
 GITEA_FALLBACK_GROUP_MEMBER = os.getenv('GITEA_FALLBACK_GROUP_MEMBER', 'gitea_admin')
 
 REPOSITORY_MIRROR = (os.getenv('REPOSITORY_MIRROR', 'false')) == 'true' # if true, the repository will be mirrored
+
+# How repositories are transferred:
+#  - 'migrate': Gitea clones every repository once via /repos/migrate, existing repositories are not updated
+#  - 'push': a local 'git clone --mirror' cache is kept in MIRROR_CACHE_DIR, later runs only fetch new objects
+#            from GitLab and push branches and tags to Gitea (incremental sync, e.g. right before cut-over)
+REPOSITORY_TRANSFER_MODE = os.getenv('REPOSITORY_TRANSFER_MODE', 'migrate')
+MIRROR_CACHE_DIR = os.getenv('MIRROR_CACHE_DIR', 'mirror_cache')
 GITLAB_URL = os.getenv('GITLAB_URL', 'https://gitlab.source.com')
 GITLAB_API_BASEURL = GITLAB_URL + '/api/v4'
 GITLAB_TOKEN = os.getenv('GITLAB_TOKEN', 'gitlab token')
@@ -50,204 +88,1403 @@ GITEA_TOKEN = os.getenv('GITEA_TOKEN', 'gitea token')
 # user of the GITLAB_TOKEN.
 MIGRATE_BY_GROUPS = (os.getenv('MIGRATE_BY_GROUPS', '0')) == '1'
 TRUNCATE_GITEA = (os.getenv('TRUNCATE_GITEA', '0')) == '1'
+# What TRUNCATE_GITEA deletes:
+#  - 'all': every repository, organization and user except the user of the GITEA_TOKEN
+#  - 'namespaces': the users and organizations in TRUNCATE_NAMESPACES (comma separated) with their repositories
+#  - 'journal': only the repositories, organizations and users this tool created according to the journal
+TRUNCATE_SCOPE = os.getenv('TRUNCATE_SCOPE', 'all')
+TRUNCATE_NAMESPACES = [name.strip() for name in os.getenv('TRUNCATE_NAMESPACES', '').split(',') if name.strip()]
+# Number of parallel deletions, the DELETE requests also share the GITEA_WRITE_CONCURRENCY limit below
+TRUNCATE_WORKERS = int(os.getenv('TRUNCATE_WORKERS', '8'))
 
 # Migrated projects can be automatically archived on gitlab to avoid users pushing
 # there commits after the migration to gitea
 GITLAB_ARCHIVE_MIGRATED_PROJECTS = (os.getenv('GITLAB_ARCHIVE_MIGRATED_PROJECTS', '0')) == '1'
+
+# Number of projects that are imported in parallel. The concurrency limits below are shared by all
+# project workers: GitLab API reads, Gitea API writes and repository clones (/repos/migrate) are capped separately.
+PROJECT_WORKERS = int(os.getenv('PROJECT_WORKERS', '1'))
+GITLAB_READ_CONCURRENCY = int(os.getenv('GITLAB_READ_CONCURRENCY', '4'))
+GITEA_WRITE_CONCURRENCY = int(os.getenv('GITEA_WRITE_CONCURRENCY', '4'))
+REPO_CLONE_CONCURRENCY = int(os.getenv('REPO_CLONE_CONCURRENCY', '2'))
+
+# Order of the project imports:
+#  - 'listing': in the order GitLab lists the projects, the import starts while the projects are still listed
+#  - 'size': the repository and LFS size (project statistics, needs reporter access) and the issue count of every
+#            project are fetched up front and the projects are imported longest first. Projects estimated to take
+#            less than SCHEDULE_FAST_LANE_SECONDS are imported by SCHEDULE_FAST_LANE_WORKERS separate workers with their
+#            own repository clone slots, so they are not stuck behind the large ones.
+PROJECT_SCHEDULE = os.getenv('PROJECT_SCHEDULE', 'listing')
+# Estimated seconds per project, per MB of repository and LFS objects and per issue (including its comments, GitLab has
+# no note count per project). Repository migrations measured in earlier runs replace the size based estimate.
+SCHEDULE_SECONDS_PER_PROJECT = float(os.getenv('SCHEDULE_SECONDS_PER_PROJECT', '2'))
+SCHEDULE_SECONDS_PER_MB = float(os.getenv('SCHEDULE_SECONDS_PER_MB', '0.05'))
+SCHEDULE_SECONDS_PER_ISSUE = float(os.getenv('SCHEDULE_SECONDS_PER_ISSUE', '0.3'))
+SCHEDULE_FAST_LANE_SECONDS = float(os.getenv('SCHEDULE_FAST_LANE_SECONDS', '10'))
+SCHEDULE_FAST_LANE_WORKERS = int(os.getenv('SCHEDULE_FAST_LANE_WORKERS', '2'))
+
+# Number of users imported in parallel and number of avatars downloaded ahead of the user imports
+USER_WORKERS = int(os.getenv('USER_WORKERS', '4'))
+AVATAR_WORKERS = int(os.getenv('AVATAR_WORKERS', '4'))
+
+# Repository migrations that take longer than REPO_MIGRATE_REQUEST_TIMEOUT seconds (or that fail with a gateway
+# timeout) are polled every REPO_POLL_INTERVAL seconds until Gitea reports the repository ready.
+REPO_MIGRATE_REQUEST_TIMEOUT = float(os.getenv('REPO_MIGRATE_REQUEST_TIMEOUT', '300'))
+REPO_POLL_INTERVAL = float(os.getenv('REPO_POLL_INTERVAL', '10'))
+REPO_READY_TIMEOUT = float(os.getenv('REPO_READY_TIMEOUT', '21600'))
+# Gitea deletes the repository of a failed background migration, a repository that stays missing for this many
+# seconds while it is polled counts as failed
+REPO_MISSING_GRACE = float(os.getenv('REPO_MISSING_GRACE', '120'))
+
+# Maximum number of keep-alive connections to Gitea and GitLab shared by all workers
+GITEA_POOL_SIZE = int(os.getenv('GITEA_POOL_SIZE', '16'))
+GITLAB_POOL_SIZE = int(os.getenv('GITLAB_POOL_SIZE', '16'))
+
+# Requests per second per host (0 = unlimited). The limits are lowered automatically while a server answers
+# with 429 responses, Retry-After and RateLimit-* headers are always honoured.
+GITLAB_RATE_LIMIT = float(os.getenv('GITLAB_RATE_LIMIT', '0'))
+GITEA_RATE_LIMIT = float(os.getenv('GITEA_RATE_LIMIT', '0'))
+
+# Retries for failed requests (429, 502, 503, 504 and connection errors) with jittered exponential backoff.
+# Non-idempotent requests are only retried if the server rejected them with 429.
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '5'))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', '0.5'))
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '60'))
+
+# Number of attachments relayed in parallel per issue or comment and the chunk size used to stream them
+ATTACHMENT_WORKERS = int(os.getenv('ATTACHMENT_WORKERS', '4'))
+ATTACHMENT_CHUNK_SIZE = int(os.getenv('ATTACHMENT_CHUNK_SIZE', str(256 * 1024)))
+# Attachments up to this size are hashed before the upload, so identical files are only uploaded once per repository.
+# Larger attachments are streamed and hashed on the fly.
+ATTACHMENT_DEDUP_MAX_SIZE = int(os.getenv('ATTACHMENT_DEDUP_MAX_SIZE', str(8 * 1024 * 1024)))
+
+# Number of GitLab groups, projects and users fetched in parallel during discovery in MIGRATE_BY_GROUPS mode
+DISCOVERY_WORKERS = int(os.getenv('DISCOVERY_WORKERS', '8'))
+
+# Page size for Gitea list endpoints (capped by the MAX_RESPONSE_ITEMS setting of the server) and the number
+# of pages fetched in parallel once the total count of a list is known
+GITEA_PAGE_SIZE = int(os.getenv('GITEA_PAGE_SIZE', '50'))
+GITEA_PAGINATION_WORKERS = int(os.getenv('GITEA_PAGINATION_WORKERS', '4'))
+
+# SQLite journal of all migrated entities, re-runs skip everything that is journaled and unchanged.
+# Set to an empty string to disable the journal.
+JOURNAL_PATH = os.getenv('JOURNAL_PATH', 'migration_journal.sqlite')
+# Seconds a write waits for the lock of a journal file that is shared by several worker processes
+JOURNAL_LOCK_TIMEOUT = float(os.getenv('JOURNAL_LOCK_TIMEOUT', '300'))
+
+# Only fetch issues and milestones updated since the last successful run of a project (requires the journal).
+# The overlap in seconds is subtracted from the recorded start time to tolerate clock skew between the hosts.
+DELTA_SYNC = os.getenv('DELTA_SYNC', '0') == '1'
+DELTA_SYNC_OVERLAP = int(os.getenv('DELTA_SYNC_OVERLAP', '300'))
+
+# Backend for new issues and comments:
+#  - 'api': every issue and comment is created with a Gitea API request
+#  - 'database': new issues and comments of a repository are bulk inserted into the Gitea database in one
+#                transaction, changed ones and attachments still go through the API. Nobody else should write
+#                to the migrated repositories meanwhile, rebuild the issue indexer afterwards.
+ISSUE_IMPORT_BACKEND = os.getenv('ISSUE_IMPORT_BACKEND', 'api')
+# Gitea database, same settings as the [database] section of the Gitea app.ini (DB_TYPE 'sqlite3' or 'mysql')
+GITEA_DB_TYPE = os.getenv('GITEA_DB_TYPE', 'sqlite3')
+GITEA_DB_PATH = os.getenv('GITEA_DB_PATH', '/data/gitea/gitea.db')
+GITEA_DB_HOST = os.getenv('GITEA_DB_HOST', 'localhost:3306')
+GITEA_DB_NAME = os.getenv('GITEA_DB_NAME', 'gitea')
+GITEA_DB_USER = os.getenv('GITEA_DB_USER', 'gitea')
+GITEA_DB_PASSWD = os.getenv('GITEA_DB_PASSWD', '')
+# Number of rows per multi-row insert
+GITEA_DB_BATCH_SIZE = int(os.getenv('GITEA_DB_BATCH_SIZE', '500'))
+
+# Request metrics per endpoint and migration phase: a JSON report is written to METRICS_REPORT_PATH at the end of
+# the run (empty to disable), with METRICS_PORT set they are also served in the Prometheus text format on /metrics
+METRICS_REPORT_PATH = os.getenv('METRICS_REPORT_PATH', 'migration_metrics.json')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Log level (DEBUG, INFO, WARNING, ERROR), DEBUG also logs every existence check. Log output is written in batches
+# by a background thread, LOG_JSON_PATH additionally writes JSON lines with the level, phase and entity context.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_JSON_PATH = os.getenv('LOG_JSON_PATH', '')
+LOG_COLOR = os.getenv('LOG_COLOR', '1') == '1'
+
+# Sharded migration: all worker processes, on one or more hosts, share the work ledger WORK_LEDGER and claim users,
+# groups and projects from it (empty = no sharding). WORK_LEDGER_BACKEND is 'sqlite' (WORK_LEDGER is the path of the
+# database file, all workers on one host or a file system with working locks) or the dotted name of a WorkLedger
+# subclass that is constructed with (WORK_LEDGER, WORKER_ID, WORK_CLAIM_TTL, WORK_MAX_ATTEMPTS).
+WORK_LEDGER = os.getenv('WORK_LEDGER', '')
+WORK_LEDGER_BACKEND = os.getenv('WORK_LEDGER_BACKEND', 'sqlite')
+WORKER_ID = os.getenv('WORKER_ID', socket.gethostname() + ':' + str(os.getpid()))
+# Number of worker processes started by this process on the local host, including itself
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))
+# Claims that are not renewed for this many seconds (the worker crashed) are claimed by other workers again
+WORK_CLAIM_TTL = int(os.getenv('WORK_CLAIM_TTL', '300'))
+# Items that fail are released for another attempt, after this many claims they are left open in the ledger
+WORK_MAX_ATTEMPTS = int(os.getenv('WORK_MAX_ATTEMPTS', '3'))
+WORK_POLL_INTERVAL = float(os.getenv('WORK_POLL_INTERVAL', '2'))
 #######################
 # CONFIG SECTION END
 #######################
 
+GLOBAL_ERROR_LOCK = threading.Lock()
+# the size schedule needs the repository statistics of every project
+PROJECT_LIST_OPTIONS = {'statistics': True} if PROJECT_SCHEDULE == 'size' else {}
+GITLAB_READ_SEMAPHORE = threading.BoundedSemaphore(GITLAB_READ_CONCURRENCY)
+GITEA_WRITE_SEMAPHORE = threading.BoundedSemaphore(GITEA_WRITE_CONCURRENCY)
+REPO_CLONE_SEMAPHORE = threading.BoundedSemaphore(REPO_CLONE_CONCURRENCY)
+# striped locks, so identical attachments relayed in parallel are still uploaded only once
+ATTACHMENT_DIGEST_LOCKS = [threading.Lock() for _ in range(64)]
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the request rate to one host. A rate of 0 disables the limit.
+
+    The rate is halved on every throttle() and slowly recovers towards the configured rate on recover(),
+    block_for() stops all requests to the host for the given time.
+    """
+
+    def __init__(self, rate: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def block_for(self, seconds: float):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def throttle(self):
+        with self.lock:
+            if self.max_rate > 0:
+                self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def recover(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+HOST_RATE_LIMITS = {
+    urllib.parse.urlsplit(GITLAB_URL).netloc: GITLAB_RATE_LIMIT,
+    urllib.parse.urlsplit(GITEA_URL).netloc: GITEA_RATE_LIMIT,
+}
+HOST_BUCKETS: Dict[str, TokenBucket] = {}
+HOST_BUCKETS_LOCK = threading.Lock()
+
+
+def get_host_bucket(host: str) -> TokenBucket:
+    with HOST_BUCKETS_LOCK:
+        if host not in HOST_BUCKETS:
+            HOST_BUCKETS[host] = TokenBucket(HOST_RATE_LIMITS.get(host, 0))
+        return HOST_BUCKETS[host]
+
+
+class RequestMetrics:
+    """
+    Thread-safe request statistics of all outbound HTTP, keyed by service, method, endpoint template and
+    migration phase: requests by status class, retries, connection errors, bytes and a latency histogram.
+    """
+
+    LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+    # applied in order to the path below the API root, e.g. /repos/a/b/issues/3/comments -> /repos/{o}/{r}/issues/{n}/comments
+    ENDPOINT_TEMPLATES = [
+        (re.compile(r'^/repos/(?!migrate$)[^/]+/[^/]+'), '/repos/{o}/{r}'),
+        (re.compile(r'/uploads/[0-9a-f]{32}/[^/]+'), '/uploads/{secret}/{file}'),
+        (re.compile(r'/(users|orgs|collaborators)/[^/]+'), r'/\1/{name}'),
+        (re.compile(r'/(projects|groups)/[^/]+'), r'/\1/{id}'),
+        (re.compile(r'/[0-9a-f]{32,}(?=/|$)'), '/{hash}'),
+        (re.compile(r'/\d+(?=/|$)'), '/{n}'),
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = {}
+
+    @classmethod
+    def endpoint(cls, url: str) -> (str, str):
+        """Returns the service (gitlab, gitea or the host) and the endpoint template of an url."""
+        parts = urllib.parse.urlsplit(url)
+        service = METRICS_SERVICES.get(parts.netloc, parts.netloc)
+        path = re.sub(r'^/api/v\d+', '', parts.path)
+        for pattern, template in cls.ENDPOINT_TEMPLATES:
+            path = pattern.sub(template, path)
+        return service, path
+
+    def _stats(self, method: str, url: str) -> {}:
+        service, path = self.endpoint(url)
+        key = (service, method.upper(), path, current_phase())
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = self.endpoints[key] = {
+                "requests": 0, "retries": 0, "errors": 0, "statuses": collections.Counter(),
+                "bytes_sent": 0, "bytes_received": 0, "seconds_total": 0.0, "seconds_max": 0.0,
+                "latency_buckets": [0] * (len(self.LATENCY_BUCKETS) + 1)
+            }
+        return stats
+
+    def observe(self, method: str, url: str, seconds: float, status: int = None, bytes_sent: int = 0, bytes_received: int = 0):
+        """Records one request attempt, status None for a connection error or timeout."""
+        bucket = bisect.bisect_left(self.LATENCY_BUCKETS, seconds)
+        with self.lock:
+            stats = self._stats(method, url)
+            stats["requests"] += 1
+            if status is None:
+                stats["errors"] += 1
+            else:
+                stats["statuses"][str(status // 100) + "xx"] += 1
+            stats["bytes_sent"] += bytes_sent
+            stats["bytes_received"] += bytes_received
+            stats["seconds_total"] += seconds
+            stats["seconds_max"] = max(stats["seconds_max"], seconds)
+            stats["latency_buckets"][bucket] += 1
+
+    def observe_retry(self, method: str, url: str):
+        with self.lock:
+            self._stats(method, url)["retries"] += 1
+
+    def report(self) -> {}:
+        with self.lock:
+            endpoints = [dict(stats, service=key[0], method=key[1], endpoint=key[2], phase=key[3],
+                              statuses=dict(stats["statuses"]),
+                              latency_buckets=dict(zip([str(le) for le in self.LATENCY_BUCKETS] + ["+Inf"], stats["latency_buckets"])))
+                         for key, stats in self.endpoints.items()]
+        endpoints.sort(key=lambda stats: stats["seconds_total"], reverse=True)
+
+        phases = {}
+        for stats in endpoints:
+            phase = phases.setdefault(stats["phase"], {"requests": 0, "retries": 0, "errors": 0, "seconds_total": 0.0})
+            for field in phase:
+                phase[field] += stats[field]
+        return {
+            "started_at": datetime.datetime.fromtimestamp(self.started, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            "duration_seconds": round(time.time() - self.started, 1),
+            "logged_errors": GLOBAL_ERROR_COUNT,
+            "phases": phases,
+            "endpoints": endpoints
+        }
+
+    def prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        def labels(key, **extra) -> str:
+            values = dict(zip(("service", "method", "endpoint", "phase"), key), **extra)
+            return "{" + ",".join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                                  for name, value in values.items()) + "}"
+
+        with self.lock:
+            endpoints = [(key, dict(stats, statuses=dict(stats["statuses"]), latency_buckets=list(stats["latency_buckets"])))
+                         for key, stats in self.endpoints.items()]
+
+        lines = ["# TYPE migration_http_requests_total counter"]
+        lines += ["migration_http_requests_total" + labels(key, status=status) + " " + str(count)
+                  for key, stats in endpoints for status, count in stats["statuses"].items()]
+        for name, field in (("retries", "retries"), ("errors", "errors"), ("sent_bytes", "bytes_sent"), ("received_bytes", "bytes_received")):
+            lines.append("# TYPE migration_http_" + name + "_total counter")
+            lines += ["migration_http_" + name + "_total" + labels(key) + " " + str(stats[field]) for key, stats in endpoints]
+
+        lines.append("# TYPE migration_http_request_duration_seconds histogram")
+        for key, stats in endpoints:
+            cumulative = 0
+            for le, count in zip([str(le) for le in self.LATENCY_BUCKETS] + ["+Inf"], stats["latency_buckets"]):
+                cumulative += count
+                lines.append("migration_http_request_duration_seconds_bucket" + labels(key, le=le) + " " + str(cumulative))
+            lines.append("migration_http_request_duration_seconds_sum" + labels(key) + " " + str(stats["seconds_total"]))
+            lines.append("migration_http_request_duration_seconds_count" + labels(key) + " " + str(stats["requests"]))
+
+        lines.append("# TYPE migration_logged_errors_total counter")
+        lines.append("migration_logged_errors_total " + str(GLOBAL_ERROR_COUNT))
+        return "\n".join(lines) + "\n"
+
+
+METRICS_SERVICES = {
+    urllib.parse.urlsplit(GITLAB_URL).netloc: 'gitlab',
+    urllib.parse.urlsplit(GITEA_URL).netloc: 'gitea',
+}
+REQUEST_METRICS = RequestMetrics()
+METRICS_PHASE = threading.local()
+
+
+def current_phase() -> str:
+    return getattr(METRICS_PHASE, 'name', 'other')
+
+
+@contextlib.contextmanager
+def metrics_phase(name: str):
+    """Attributes the requests of the current thread, and of the tasks it submits, to a migration phase."""
+    previous = current_phase()
+    METRICS_PHASE.name = name
+    try:
+        yield
+    finally:
+        METRICS_PHASE.name = previous
+
+
+def _call_in_phase(phase: str, context: {}, error_counters: (), fn, *args, **kwargs):
+    with metrics_phase(phase), log_context(**context), counting_errors(*error_counters):
+        return fn(*args, **kwargs)
+
+
+class PhaseThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    Thread pool whose tasks run in the metrics phase, log context and error counters of the thread that
+    submitted them.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(_call_in_phase, current_phase(), current_log_context(), current_error_counters(), fn, *args, **kwargs)
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = REQUEST_METRICS.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(port: int):
+    server = _MetricsServer(('', port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print_info("Serving request metrics on port " + str(port) + " at /metrics")
+
+
+def write_metrics_report(path: str):
+    report = REQUEST_METRICS.report()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+
+    LOG.info("Slowest endpoints (total request time):")
+    for stats in report["endpoints"][:10]:
+        LOG.info("    " + stats["phase"] + ": " + stats["service"] + " " + stats["method"] + " " + stats["endpoint"] + ": "
+              + str(stats["requests"]) + " requests, " + str(round(stats["seconds_total"], 1)) + "s")
+    LOG.info("Request metrics written to " + path)
+
+
+class TransportSession(requests.Session):
+    """
+    Requests session used for all outbound HTTP of the migration.
+
+    Requests are rate limited per host, transient failures are retried with jittered exponential backoff
+    and Retry-After and RateLimit-* response headers are honoured.
+    """
+
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+    RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+    def __init__(self, pool_size: int):
+        super().__init__()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, *args, **kwargs) -> requests.Response:
+        bucket = get_host_bucket(urllib.parse.urlsplit(url).netloc)
+        # streamed request bodies (generators, open files) cannot be sent twice
+        data = kwargs.get('data')
+        replayable = not kwargs.get('files') and (data is None or isinstance(data, (bytes, str, dict, list, tuple)))
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        bytes_sent = [0]
+        if data is not None and not isinstance(data, (bytes, str, dict, list, tuple)):
+            kwargs['data'] = self._counting(data, bytes_sent)
+        elif isinstance(data, (bytes, str)):
+            bytes_sent[0] = len(data)
+
+        attempt = 0
+        while True:
+            bucket.acquire()
+            started = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                REQUEST_METRICS.observe(method, url, time.monotonic() - started, bytes_sent=bytes_sent[0])
+                if not (replayable and idempotent) or attempt >= HTTP_MAX_RETRIES:
+                    raise
+                delay = self._backoff(attempt)
+                print_warning("Request " + method.upper() + " " + url + " failed (" + str(e) + "), retrying in " + str(round(delay, 1)) + "s")
+            else:
+                # the body of a streamed response is not read here, its size is taken from Content-Length
+                bytes_received = int(response.headers.get('Content-Length') or 0) if kwargs.get('stream') else len(response.content)
+                REQUEST_METRICS.observe(method, url, time.monotonic() - started, response.status_code, bytes_sent[0], bytes_received)
+                self._observe_rate_limit(bucket, response)
+                if response.status_code not in self.RETRY_STATUS_CODES or not replayable or attempt >= HTTP_MAX_RETRIES:
+                    return response
+                if not idempotent and response.status_code != 429:
+                    return response
+                delay = max(self._retry_after(response), self._backoff(attempt))
+                print_warning("Request " + method.upper() + " " + url + " returned " + str(response.status_code) + ", retrying in " + str(round(delay, 1)) + "s")
+                response.close()
+
+            REQUEST_METRICS.observe_retry(method, url)
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _counting(chunks, counter: [int]):
+        for chunk in chunks:
+            counter[0] += len(chunk)
+            yield chunk
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> float:
+        retry_after = response.headers.get('Retry-After')
+        if not retry_after:
+            return 0.0
+        try:
+            return min(HTTP_BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+            return min(HTTP_BACKOFF_MAX, max(0.0, retry_at.timestamp() - time.time()))
+        except (TypeError, ValueError):
+            # malformed header, e.g. from a proxy, the normal backoff applies
+            return 0.0
+
+    @staticmethod
+    def _observe_rate_limit(bucket: TokenBucket, response: requests.Response):
+        if response.status_code == 429:
+            bucket.throttle()
+            bucket.block_for(TransportSession._retry_after(response))
+        else:
+            bucket.recover()
+
+        if response.headers.get('RateLimit-Remaining') == '0':
+            try:
+                reset = float(response.headers.get('RateLimit-Reset') or 0)
+            except ValueError:
+                reset = 0.0
+            # GitLab sends a unix timestamp, the IETF draft a number of seconds
+            wait = reset - time.time() if reset > 1e9 else reset
+            bucket.block_for(min(HTTP_BACKOFF_MAX, max(0.0, wait)))
+
+
+GITLAB_SESSION = TransportSession(GITLAB_POOL_SIZE)
+
+
+class GitlabClient(gitlab.Gitlab):
+    """python-gitlab client whose requests are only retried by the TransportSession, within its backoff budget."""
+
+    def http_request(self, *args, **kwargs) -> requests.Response:
+        # python-gitlab would otherwise retry every 429 the session gives up on up to 10 more times
+        kwargs['obey_rate_limit'] = False
+        kwargs['retry_transient_errors'] = False
+        return super().http_request(*args, **kwargs)
+
+
+class GiteaClient:
+    """
+    Minimal Gitea API client on top of a pooled, keep-alive TransportSession.
+
+    The session and its connection pool are shared by all worker threads. All writing requests share
+    the GITEA_WRITE_CONCURRENCY limit; repository migrations are long running and limited by
+    REPO_CLONE_SEMAPHORE (or the clone semaphore of a client copy) instead, so they do not block the write
+    slots of the other project workers.
+    """
+
+    LONG_RUNNING_PATHS = ('/repos/migrate',)
+
+    def __init__(self, url: str, token: str, pool_size: int = GITEA_POOL_SIZE):
+        self.api_url = url.rstrip('/') + '/api/v1'
+        self.session = TransportSession(pool_size)
+        self.session.headers['Authorization'] = 'token ' + token
+        self.clone_semaphore = REPO_CLONE_SEMAPHORE
+
+    def with_clone_slots(self, count: int) -> 'GiteaClient':
+        """Returns a client on the same session whose repository migrations have count slots of their own."""
+        client = copy.copy(self)
+        client.clone_semaphore = threading.BoundedSemaphore(count)
+        return client
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        return self.session.request(method, self.api_url + path, **kwargs)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        if path in self.LONG_RUNNING_PATHS:
+            with self.clone_semaphore:
+                return self.request('POST', path, **kwargs)
+        with GITEA_WRITE_SEMAPHORE:
+            return self.request('POST', path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        with GITEA_WRITE_SEMAPHORE:
+            return self.request('PUT', path, **kwargs)
+
+    def patch(self, path: str, **kwargs) -> requests.Response:
+        with GITEA_WRITE_SEMAPHORE:
+            return self.request('PATCH', path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        with GITEA_WRITE_SEMAPHORE:
+            return self.request('DELETE', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def run_concurrently(func, items, max_workers: int = GITEA_WRITE_CONCURRENCY) -> []:
+    """
+    Calls func for every item on a thread pool and returns the results in the order of items.
+
+    If a call fails or the run is interrupted, all calls that have not started yet are cancelled.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    executor = PhaseThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    futures = [executor.submit(func, item) for item in items]
+    try:
+        return [future.result() for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class MigrationJournal:
+    """
+    Local SQLite journal of the migrated GitLab entities.
+
+    Every entity is recorded by kind and GitLab id together with its Gitea identifier and a hash of the
+    GitLab content it was imported from. Re-runs skip journaled entities whose content hash is unchanged
+    instead of probing Gitea for them.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        # the workers of a sharded migration can share the journal file, writers wait for each other's locks
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=JOURNAL_LOCK_TIMEOUT)
+        if path != ':memory:':
+            self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entities ("
+            "kind TEXT NOT NULL, gitlab_id TEXT NOT NULL, gitea_id TEXT, content_hash TEXT, updated_at REAL, parent_id TEXT, "
+            "PRIMARY KEY (kind, gitlab_id))"
+        )
+        # the GitLab project of issues, comments and milestones and the GitLab user of SSH keys, missing in older journals
+        if 'parent_id' not in [row[1] for row in self.connection.execute("PRAGMA table_info(entities)").fetchall()]:
+            self.connection.execute("ALTER TABLE entities ADD COLUMN parent_id TEXT")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entities_parent ON entities (kind, parent_id)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS attachments ("
+            "upload_key TEXT PRIMARY KEY, repo TEXT NOT NULL, sha256 TEXT NOT NULL, url TEXT NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS attachments_digest ON attachments (repo, sha256)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS repo_clones ("
+            "project_id TEXT PRIMARY KEY, repo TEXT NOT NULL, seconds REAL NOT NULL, finished_at REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state (project_id TEXT PRIMARY KEY, high_water TEXT NOT NULL)"
+        )
+        # the Gitea users, organizations and repositories this tool created itself, not the ones it found in Gitea
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS created (kind TEXT NOT NULL, gitea_id TEXT NOT NULL, PRIMARY KEY (kind, gitea_id))"
+        )
+
+    def get(self, kind: str, gitlab_id) -> ():
+        """Returns the (gitea_id, content_hash) tuple of a journaled entity or None."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT gitea_id, content_hash FROM entities WHERE kind = ? AND gitlab_id = ?", (kind, str(gitlab_id))
+            ).fetchone()
+
+    def is_current(self, kind: str, gitlab_id, content_hash: str) -> bool:
+        entry = self.get(kind, gitlab_id)
+        return entry is not None and entry[1] == content_hash
+
+    def record(self, kind: str, gitlab_id, gitea_id, content_hash: str, parent_id=None):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entities (kind, gitlab_id, gitea_id, content_hash, updated_at, parent_id) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, str(gitlab_id), None if gitea_id is None else str(gitea_id), content_hash, time.time(),
+                 None if parent_id is None else str(parent_id))
+            )
+
+    def record_created(self, kind: str, gitea_id: str):
+        with self.lock:
+            self.connection.execute("INSERT OR IGNORE INTO created (kind, gitea_id) VALUES (?, ?)", (kind, gitea_id))
+
+    def get_attachment_url(self, upload_key: str) -> str:
+        with self.lock:
+            row = self.connection.execute("SELECT url FROM attachments WHERE upload_key = ?", (upload_key,)).fetchone()
+        return row[0] if row else None
+
+    def find_attachment_by_digest(self, repo: str, sha256: str) -> str:
+        with self.lock:
+            row = self.connection.execute("SELECT url FROM attachments WHERE repo = ? AND sha256 = ?", (repo, sha256)).fetchone()
+        return row[0] if row else None
+
+    def record_attachment(self, upload_key: str, repo: str, sha256: str, url: str):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO attachments (upload_key, repo, sha256, url) VALUES (?, ?, ?, ?)", (upload_key, repo, sha256, url)
+            )
+
+    def record_clone_duration(self, project_id, repo: str, seconds: float):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO repo_clones (project_id, repo, seconds, finished_at) VALUES (?, ?, ?, ?)",
+                (str(project_id), repo, seconds, time.time())
+            )
+
+    def slowest_clones(self, limit: int) -> [()]:
+        """Returns the (repo, seconds) tuples of the slowest repository migrations."""
+        with self.lock:
+            return self.connection.execute("SELECT repo, seconds FROM repo_clones ORDER BY seconds DESC LIMIT ?", (limit,)).fetchall()
+
+    def clone_durations(self) -> {}:
+        """Returns the seconds of the last repository migration by GitLab project id."""
+        with self.lock:
+            return dict(self.connection.execute("SELECT project_id, seconds FROM repo_clones").fetchall())
+
+    def get_high_water(self, project_id) -> str:
+        """Returns the ISO 8601 timestamp up to which all changes of a project are migrated or None."""
+        with self.lock:
+            row = self.connection.execute("SELECT high_water FROM sync_state WHERE project_id = ?", (str(project_id),)).fetchone()
+        return row[0] if row else None
+
+    def set_high_water(self, project_id, high_water: str):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sync_state (project_id, high_water) VALUES (?, ?)", (str(project_id), high_water)
+            )
+
+    def find(self, kind: str, gitlab_id_prefix: str) -> [()]:
+        """Returns the (gitlab_id, gitea_id, content_hash) tuples of all journaled entities whose GitLab id starts with the prefix."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT gitlab_id, gitea_id, content_hash FROM entities WHERE kind = ? AND substr(gitlab_id, 1, ?) = ?",
+                (kind, len(gitlab_id_prefix), gitlab_id_prefix)
+            ).fetchall()
+
+    def forget(self, kind: str, gitlab_id):
+        with self.lock:
+            self.connection.execute("DELETE FROM entities WHERE kind = ? AND gitlab_id = ?", (kind, str(gitlab_id)))
+
+    def created_gitea_ids(self, kind: str) -> [str]:
+        """Returns the Gitea identifiers of all entities of the kind that this tool created."""
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT gitea_id FROM created WHERE kind = ?", (kind,)).fetchall()]
+
+    def forget_deleted(self, repos: [str], orgs: [str], users: [str]):
+        """
+        Forgets everything that was migrated into deleted Gitea repositories ("owner/repo"), organizations and users.
+
+        Issues, comments and milestones are forgotten by their GitLab project, SSH keys by their GitLab user.
+        Entries of older journals without a project or user are forgotten as soon as any repository or user is
+        deleted; re-runs look them up in Gitea instead.
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for user in users:
+                    for (user_id,) in self.connection.execute(
+                        "SELECT gitlab_id FROM entities WHERE kind = 'user' AND lower(gitea_id) = ?", (user.lower(),)
+                    ).fetchall():
+                        self.connection.execute("DELETE FROM entities WHERE kind = 'user_key' AND parent_id = ?", (user_id,))
+                for repo in repos:
+                    project_ids = [row[0] for row in self.connection.execute(
+                        "SELECT gitlab_id FROM entities WHERE kind IN ('repo', 'project') AND lower(gitea_id) = ?", (repo.lower(),)
+                    ).fetchall()]
+                    for project_id in project_ids:
+                        self.connection.execute(
+                            "DELETE FROM entities WHERE kind = 'collaborator' AND substr(gitlab_id, 1, ?) = ?", (len(project_id) + 1, project_id + "/")
+                        )
+                        self.connection.execute(
+                            "DELETE FROM entities WHERE kind IN ('issue', 'issue_note', 'milestone') AND parent_id = ?", (project_id,)
+                        )
+                        self.connection.execute("DELETE FROM sync_state WHERE project_id = ?", (project_id,))
+                        self.connection.execute("DELETE FROM repo_clones WHERE project_id = ?", (project_id,))
+                    self.connection.execute("DELETE FROM entities WHERE kind IN ('repo', 'project') AND lower(gitea_id) = ?", (repo.lower(),))
+                    self.connection.execute("DELETE FROM attachments WHERE lower(repo) = ?", (repo.lower(),))
+                    self.connection.execute("DELETE FROM created WHERE kind = 'repo' AND lower(gitea_id) = ?", (repo.lower(),))
+                for org in orgs:
+                    self.connection.execute("DELETE FROM entities WHERE kind = 'group' AND lower(gitea_id) = ?", (org.lower(),))
+                    self.connection.execute("DELETE FROM created WHERE kind = 'group' AND lower(gitea_id) = ?", (org.lower(),))
+                for user in users:
+                    self.connection.execute("DELETE FROM entities WHERE kind = 'user' AND lower(gitea_id) = ?", (user.lower(),))
+                    self.connection.execute("DELETE FROM created WHERE kind = 'user' AND lower(gitea_id) = ?", (user.lower(),))
+                if repos:
+                    self.connection.execute("DELETE FROM entities WHERE kind IN ('issue', 'issue_note', 'milestone') AND parent_id IS NULL")
+                if users:
+                    self.connection.execute("DELETE FROM entities WHERE kind = 'user_key' AND parent_id IS NULL")
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def reset(self):
+        """Forgets all migrated entities, e.g. after the whole Gitea instance was truncated."""
+        with self.lock:
+            for table in ('entities', 'attachments', 'repo_clones', 'sync_state', 'created'):
+                self.connection.execute("DELETE FROM " + table)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+JOURNAL: MigrationJournal = None
+JOURNAL_LOCK = threading.Lock()
+
+
+def get_journal() -> MigrationJournal:
+    global JOURNAL
+    with JOURNAL_LOCK:
+        if JOURNAL is None:
+            JOURNAL = MigrationJournal(JOURNAL_PATH or ':memory:')
+        return JOURNAL
+
+
+def content_hash(*values) -> str:
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class GiteaDatabase:
+    """
+    Direct connection to the Gitea database (SQLite or MariaDB/MySQL) for bulk inserts of issues and comments.
+
+    Every repository is loaded in one transaction. Row ids and issue numbers are allocated up front, so
+    issues, comments, label and assignee links are inserted with batched multi-row inserts without reading
+    back generated ids. The issue index and the issue counters of the repository, its labels and its
+    milestones are fixed up in the same transaction.
+    """
+
+    COMMENT_TYPE = 0  # plain comment
+
+    def __init__(self, db_type: str):
+        self.db_type = db_type
+        self.lock = threading.Lock()
+        if db_type == 'sqlite3':
+            self.connection = sqlite3.connect(GITEA_DB_PATH, check_same_thread=False, isolation_level=None, timeout=60)
+        elif db_type == 'mysql':
+            import mysql.connector  # only needed for this backend
+
+            host, _, port = GITEA_DB_HOST.partition(':')
+            self.connection = mysql.connector.connect(
+                host=host, port=int(port or 3306), user=GITEA_DB_USER, password=GITEA_DB_PASSWD, database=GITEA_DB_NAME, autocommit=False
+            )
+        else:
+            raise ValueError("Unsupported GITEA_DB_TYPE " + db_type + ", use 'sqlite3' or 'mysql'")
+
+    def _sql(self, sql: str) -> str:
+        return sql if self.db_type == 'sqlite3' else sql.replace('?', '%s')
+
+    def _fetchall(self, cursor, sql: str, params=()) -> [()]:
+        cursor.execute(self._sql(sql), params)
+        return cursor.fetchall()
+
+    def _insert(self, cursor, table: str, columns: List[str], rows: List[tuple]):
+        sql = self._sql("INSERT INTO " + table + " (" + ", ".join(columns) + ") VALUES (" + ", ".join("?" * len(columns)) + ")")
+        for start in range(0, len(rows), GITEA_DB_BATCH_SIZE):
+            cursor.executemany(sql, rows[start:start + GITEA_DB_BATCH_SIZE])
+
+    def _user_ids(self, cursor, usernames) -> Dict[str, int]:
+        usernames = sorted({username.lower() for username in usernames if username})
+        user_ids = {}
+        for start in range(0, len(usernames), GITEA_DB_BATCH_SIZE):
+            batch = usernames[start:start + GITEA_DB_BATCH_SIZE]
+            rows = self._fetchall(cursor, "SELECT lower_name, id FROM `user` WHERE lower_name IN (" + ", ".join("?" * len(batch)) + ")", batch)
+            user_ids.update(rows)
+        return user_ids
+
+    def _next_id(self, cursor, table: str) -> int:
+        lock = " FOR UPDATE" if self.db_type == 'mysql' else ""
+        return self._fetchall(cursor, "SELECT COALESCE(MAX(id), 0) FROM " + table + lock)[0][0] + 1
+
+    def bulk_insert_issues(self, owner: str, repo: str, fallback_poster: str, issues: List[dict], comments: List[dict]) -> (Dict, Dict):
+        """
+        Inserts the issues and comments of a repository and returns the Gitea issue numbers by issue key
+        and the Gitea comment ids by comment key.
+
+        Issues are dicts with key, title, body, poster, closed, milestone_id, label_ids, assignees, deadline,
+        created, updated and closed_at (unix timestamps). Comments are dicts with key, issue_key (a new issue)
+        or issue_number (an existing issue), body, poster, created and updated. Posters and assignees are
+        usernames, unknown posters are replaced by the fallback poster.
+        """
+        with self.lock:
+            cursor = self.connection.cursor()
+            try:
+                if self.db_type == 'sqlite3':
+                    # take the write lock right away, ids are allocated from the current maximum
+                    cursor.execute("BEGIN IMMEDIATE")
+                else:
+                    self.connection.start_transaction()
+                numbers, comment_ids = self._insert_issues(cursor, owner, repo, fallback_poster, issues, comments)
+                self.connection.commit()
+                return numbers, comment_ids
+            except BaseException:
+                if self.db_type == 'mysql' or self.connection.in_transaction:
+                    self.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def _insert_issues(self, cursor, owner: str, repo: str, fallback_poster: str, issues: List[dict], comments: List[dict]) -> (Dict, Dict):
+        repo_rows = self._fetchall(
+            cursor, "SELECT repository.id FROM repository JOIN `user` ON repository.owner_id = `user`.id "
+                    "WHERE `user`.lower_name = ? AND repository.lower_name = ?", (owner.lower(), repo.lower())
+        )
+        if not repo_rows:
+            raise LookupError("Repository " + owner + "/" + repo + " not found in the Gitea database")
+        repo_id = repo_rows[0][0]
+
+        usernames = [fallback_poster] + [entry['poster'] for entry in issues + comments]
+        usernames += [assignee for issue in issues for assignee in issue['assignees']]
+        user_ids = self._user_ids(cursor, usernames)
+        fallback_poster_id = user_ids[fallback_poster.lower()]
+
+        def poster_id(username: str) -> int:
+            return user_ids.get((username or '').lower(), fallback_poster_id)
+
+        # allocate the ids and numbers, issue numbers are shared with pull requests
+        next_issue_id = self._next_id(cursor, "issue")
+        next_comment_id = self._next_id(cursor, "comment")
+        max_number = self._fetchall(cursor, "SELECT COALESCE(MAX(`index`), 0) FROM issue WHERE repo_id = ?", (repo_id,))[0][0]
+        index_rows = self._fetchall(cursor, "SELECT max_index FROM issue_index WHERE group_id = ?", (repo_id,))
+        if index_rows:
+            max_number = max(max_number, index_rows[0][0])
+
+        issue_ids = {}
+        numbers = {}
+        for offset, issue in enumerate(issues):
+            issue_ids[issue['key']] = next_issue_id + offset
+            numbers[issue['key']] = max_number + offset + 1
+
+        existing_numbers = sorted({comment['issue_number'] for comment in comments if comment.get('issue_number') is not None})
+        if existing_numbers:
+            rows = self._fetchall(
+                cursor, "SELECT `index`, id FROM issue WHERE repo_id = ? AND `index` IN (" + ", ".join("?" * len(existing_numbers)) + ")",
+                [repo_id] + existing_numbers
+            )
+            existing_issue_ids = dict(rows)
+        else:
+            existing_issue_ids = {}
+
+        comment_ids = {}
+        comment_rows = []
+        comment_counts = collections.Counter()
+        for offset, comment in enumerate(comments):
+            if comment.get('issue_key') is not None:
+                issue_id = issue_ids[comment['issue_key']]
+            else:
+                issue_id = existing_issue_ids[comment['issue_number']]
+            comment_ids[comment['key']] = next_comment_id + offset
+            comment_counts[issue_id] += 1
+            comment_rows.append((
+                next_comment_id + offset, self.COMMENT_TYPE, poster_id(comment['poster']), '', 0, issue_id,
+                comment['body'], comment['created'], comment['updated']
+            ))
+
+        issue_rows = []
+        label_rows = []
+        assignee_rows = []
+        for issue in issues:
+            issue_id = issue_ids[issue['key']]
+            issue_rows.append((
+                issue_id, repo_id, numbers[issue['key']], poster_id(issue['poster']), '', 0, issue['title'], issue['body'],
+                issue['milestone_id'] or 0, 0, int(issue['closed']), 0, comment_counts[issue_id], '', issue['deadline'] or 0,
+                issue['created'], issue['updated'], issue['closed_at'] or 0, 0
+            ))
+            label_rows += [(issue_id, label_id) for label_id in dict.fromkeys(issue['label_ids'])]
+            assignee_rows += [(user_ids[assignee.lower()], issue_id) for assignee in issue['assignees'] if assignee.lower() in user_ids]
+
+        self._insert(cursor, "issue", [
+            "id", "repo_id", "`index`", "poster_id", "original_author", "original_author_id", "name", "content",
+            "milestone_id", "priority", "is_closed", "is_pull", "num_comments", "ref", "deadline_unix",
+            "created_unix", "updated_unix", "closed_unix", "is_locked"
+        ], issue_rows)
+        self._insert(cursor, "issue_label", ["issue_id", "label_id"], label_rows)
+        self._insert(cursor, "issue_assignees", ["assignee_id", "issue_id"], assignee_rows)
+        self._insert(cursor, "comment", [
+            "id", "type", "poster_id", "original_author", "original_author_id", "issue_id", "content", "created_unix", "updated_unix"
+        ], comment_rows)
+
+        self._fix_counters(cursor, repo_id, max_number + len(issues), list(existing_issue_ids.values()),
+                           {label_id for issue in issues for label_id in issue['label_ids']},
+                           {issue['milestone_id'] for issue in issues if issue['milestone_id']})
+        return numbers, comment_ids
+
+    def _fix_counters(self, cursor, repo_id: int, max_number: int, commented_issue_ids: List[int], label_ids, milestone_ids):
+        cursor.execute(self._sql("UPDATE issue_index SET max_index = ? WHERE group_id = ?"), (max_number, repo_id))
+        if cursor.rowcount == 0:
+            cursor.execute(self._sql("INSERT INTO issue_index (group_id, max_index) VALUES (?, ?)"), (repo_id, max_number))
+
+        cursor.execute(self._sql(
+            "UPDATE repository SET "
+            "num_issues = (SELECT COUNT(*) FROM issue WHERE repo_id = ? AND is_pull = ?), "
+            "num_closed_issues = (SELECT COUNT(*) FROM issue WHERE repo_id = ? AND is_pull = ? AND is_closed = ?) "
+            "WHERE id = ?"
+        ), (repo_id, False, repo_id, False, True, repo_id))
+
+        for start in range(0, len(commented_issue_ids), GITEA_DB_BATCH_SIZE):
+            batch = commented_issue_ids[start:start + GITEA_DB_BATCH_SIZE]
+            cursor.execute(self._sql(
+                "UPDATE issue SET num_comments = (SELECT COUNT(*) FROM comment WHERE comment.issue_id = issue.id AND comment.type = ?) "
+                "WHERE id IN (" + ", ".join("?" * len(batch)) + ")"
+            ), [self.COMMENT_TYPE] + batch)
+
+        for label_id in sorted(label_ids):
+            cursor.execute(self._sql(
+                "UPDATE label SET "
+                "num_issues = (SELECT COUNT(*) FROM issue_label WHERE issue_label.label_id = ?), "
+                "num_closed_issues = (SELECT COUNT(*) FROM issue_label JOIN issue ON issue.id = issue_label.issue_id "
+                "WHERE issue_label.label_id = ? AND issue.is_closed = ?) "
+                "WHERE id = ?"
+            ), (label_id, label_id, True, label_id))
+
+        for milestone_id in sorted(milestone_ids):
+            num_issues, num_closed_issues = self._fetchall(
+                cursor, "SELECT COUNT(*), COALESCE(SUM(CASE WHEN is_closed = ? THEN 1 ELSE 0 END), 0) FROM issue WHERE milestone_id = ?",
+                (True, milestone_id)
+            )[0]
+            completeness = int(num_closed_issues) * 100 // num_issues if num_issues else 0
+            cursor.execute(self._sql("UPDATE milestone SET num_issues = ?, num_closed_issues = ?, completeness = ? WHERE id = ?"),
+                           (num_issues, int(num_closed_issues), completeness, milestone_id))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+GITEA_DATABASE: GiteaDatabase = None
+GITEA_DATABASE_LOCK = threading.Lock()
+
+
+def get_gitea_database() -> GiteaDatabase:
+    global GITEA_DATABASE
+    with GITEA_DATABASE_LOCK:
+        if GITEA_DATABASE is None:
+            GITEA_DATABASE = GiteaDatabase(GITEA_DB_TYPE)
+        return GITEA_DATABASE
+
 
 def main():
+    setup_logging()
     print_color(bcolors.HEADER, "---=== Gitlab to Gitea migration ===---")
-    print("Version: " + SCRIPT_VERSION)
-    print()
-
-    # private token or personal token authentication
-    gl = gitlab.Gitlab(GITLAB_URL, private_token=GITLAB_TOKEN)
-    gl.auth()
-    assert(isinstance(gl.user, gitlab.v4.objects.CurrentUser))
-    print_info("Connected to Gitlab, version: " + str(gl.version()))
-
-    gt = pygitea.API(GITEA_URL, token=GITEA_TOKEN)
-    gt_version = gt.get('/version').json()
-    print_info("Connected to Gitea, version: " + str(gt_version['version']))
-
-    if TRUNCATE_GITEA:
-        print('Truncate...')
-        truncate_all(gt)
-        print('Truncate... done')
-
-
-    # Create a directory in /tmp called gitlab_to_gitea
-    tmp_dir = '/tmp/gitlab_to_gitea'
-    if not os.path.exists(tmp_dir):
-        os.makedirs(tmp_dir)
-        print(f"Directory {tmp_dir} created.")
-    else:
-        print(f"Directory {tmp_dir} already exists.")
-
-    print('Gathering projects and users...')
-    users: List[gitlab.v4.objects.User] = []
-    groups: List[gitlab.v4.objects.Group] = gl.groups.list(all=True)
-    projects: List[gitlab.v4.objects.Project] = []
-
-    if MIGRATE_BY_GROUPS:
-        user_ids: Dict[int, int] = {}
-        project_ids: Dict[int, int] = {}
-        groups = gl.groups.list(all=True)
-        for group in groups:
-            print('group:', group.full_path)
-            # ıf we do not have access memberlist do not run member creating
-            try:
-                for member in group.members.list(iterator=True):
-                    print('    member:', member.username)
-                    user_ids[member.id] = 1
-            except Exception as e:
-                print("Skipping group member import for group " + group.full_path + " due to error: " + str(e))
-            
-            for group_project in group.projects.list(iterator=True):
-                print('    group_project:', group_project.name_with_namespace)
-                project_ids[group_project.id] = 1
-                project = gl.projects.get(id=group_project.id)
-                print('    project:', project.name_with_namespace)
-                for member in project.members.list(iterator=True):
-                    print('        member:', member.username)
-                    user_ids[member.id] = 1
-                for user in project.users.list(iterator=True):
-                    print('        user:', user.username)
-                    user_ids[user.id] = 1
-
-        for user_id in user_ids:
-            user = gl.users.get(id=user_id)
-            print('user_id:',user_id,' user:',user.username)
-            users.append(user)
-            for project in user.projects.list(iterator=True):
-                print('    project:',project.name_with_namespace)
-
-        for project_id in project_ids:
-            project = gl.projects.get(id=project_id)
-            print('project_id:',project_id,' project:',project.name_with_namespace,' archived:',project.archived)
-            projects.append(project)
+    LOG.info("Version: " + SCRIPT_VERSION)
+    LOG.info('')
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
+    worker_processes = spawn_workers(WORKER_PROCESSES - 1) if WORK_LEDGER and MIGRATION_STAGE != 'export' else []
 
+    if MIGRATION_STAGE == 'import':
+        # the snapshot stands in for the GitLab API
+        gl = open_snapshot(SNAPSHOT_DIR)
+        print_info("Loaded snapshot of " + gl.url + ", exported at " + gl.exported_at)
     else:
-        users = gl.users.list(all=True)
-        projects = gl.projects.list(all=True)
+        # private token or personal token authentication
+        gl = GitlabClient(GITLAB_URL, private_token=GITLAB_TOKEN, session=GITLAB_SESSION)
+        gl.auth()
+        assert(isinstance(gl.user, gitlab.v4.objects.CurrentUser))
+        print_info("Connected to Gitlab, version: " + str(gl.version()))
+
+    if MIGRATION_STAGE != 'export':
+        gt = GiteaClient(GITEA_URL, GITEA_TOKEN)
+        gt_version = gt.get('/version').json()
+        print_info("Connected to Gitea, version: " + str(gt_version['version']))
+
+        # in a sharded migration the first worker truncates, see import_sharded
+        if TRUNCATE_GITEA and not WORK_LEDGER:
+            LOG.info('Truncate...')
+            with metrics_phase('truncate'):
+                truncate_all(gt)
+            LOG.info('Truncate... done')
+
+
+    if WORK_LEDGER and MIGRATION_STAGE != 'export':
+        # the first worker discovers the users, groups and projects for all of them, see import_sharded
+        import_sharded(gl, gt)
+    else:
+        LOG.info('Gathering projects and users...')
+        with metrics_phase('discovery'):
+            users, groups, projects = discover(gl)
+        LOG.info('Gathering projects and users...done')
+
+        if MIGRATION_STAGE == 'export':
+            with metrics_phase('export'):
+                export_snapshot(gl, users, groups, projects, SNAPSHOT_DIR)
+        else:
+            # IMPORT USERS AND GROUPS
+            import_users_groups(gl, gt, users, groups)
 
-    print('Gathering projects and users...done')
+            # IMPORT PROJECTS
+            with metrics_phase('projects'):
+                if PROJECT_SCHEDULE == 'size':
+                    import_projects_scheduled(gl, gt, projects)
+                else:
+                    import_projects(gl, gt, projects)
 
-    # IMPORT USERS AND GROUPS
-    import_users_groups(gl, gt, users, groups)
+    for worker_process in worker_processes:
+        if worker_process.wait() != 0:
+            print_error("Worker process " + str(worker_process.pid) + " failed with exit code " + str(worker_process.returncode))
 
-    # IMPORT PROJECTS
-    import_projects(gl, gt, projects)
+    if MIGRATION_STAGE != 'export':
+        print_slowest_clones()
 
-    print()
+    LOG.info('')
+    if METRICS_REPORT_PATH:
+        write_metrics_report(METRICS_REPORT_PATH)
     if GLOBAL_ERROR_COUNT == 0:
         print_success("Migration finished with no errors!")
     else:
         print_error("Migration finished with " + str(GLOBAL_ERROR_COUNT) + " errors!")
 
+#
+# Discovery helpers for Gitlab
+#
+
+def discover(gitlab_api: gitlab.Gitlab) -> (List[gitlab.v4.objects.User], List[gitlab.v4.objects.Group], Iterable[gitlab.v4.objects.Project]):
+    """Finds the users, groups and projects to migrate, by listing them or with MIGRATE_BY_GROUPS by crawling the groups."""
+    groups: List[gitlab.v4.objects.Group] = gitlab_api.groups.list(all=True)
+
+    # a snapshot only contains the users and projects discovered by its export
+    if MIGRATE_BY_GROUPS and MIGRATION_STAGE != 'import':
+        users, projects = discover_by_groups(gitlab_api, groups)
+    else:
+        users: List[gitlab.v4.objects.User] = gitlab_api.users.list(all=True)
+        # projects are listed lazily and handed to the import workers page by page
+        projects = gitlab_api.projects.list(iterator=True, **PROJECT_LIST_OPTIONS)
+    return users, groups, projects
+
+
+def discover_by_groups(gitlab_api: gitlab.Gitlab, groups: List[gitlab.v4.objects.Group]) -> (List[gitlab.v4.objects.User], List[gitlab.v4.objects.Project]):
+    """
+    Crawls the given groups for their projects and for the users that are members of the groups or projects.
+
+    Groups and projects are crawled concurrently and every project and user is fetched exactly once. Users are
+    fetched while the crawl is still running. Returns the users and projects in the order they were found.
+    """
+    lock = threading.Lock()
+    executor = PhaseThreadPoolExecutor(max_workers=DISCOVERY_WORKERS, thread_name_prefix='discovery')
+    project_futures: Dict[int, concurrent.futures.Future] = {}
+    user_futures: Dict[int, concurrent.futures.Future] = {}
+
+    def fetch_user(user_id: int) -> gitlab.v4.objects.User:
+        with GITLAB_READ_SEMAPHORE:
+            user = gitlab_api.users.get(id=user_id)
+        LOG.debug("user_id: %s user: %s", user_id, user.username)
+        return user
+
+    def add_users(user_ids: Iterable[int]):
+        with lock:
+            for user_id in user_ids:
+                if user_id not in user_futures:
+                    user_futures[user_id] = executor.submit(fetch_user, user_id)
+
+    def crawl_project(project_id: int) -> gitlab.v4.objects.Project:
+        with GITLAB_READ_SEMAPHORE:
+            project = gitlab_api.projects.get(id=project_id, **PROJECT_LIST_OPTIONS)
+            LOG.debug("    project: %s archived: %s", project.name_with_namespace, project.archived)
+            add_users(member.id for member in project.members.list(iterator=True))
+            add_users(user.id for user in project.users.list(iterator=True))
+        return project
+
+    def crawl_group(group: gitlab.v4.objects.Group):
+        LOG.debug("group: %s", group.full_path)
+        # if we do not have access to the memberlist do not run member creating
+        try:
+            with GITLAB_READ_SEMAPHORE:
+                add_users(member.id for member in group.members.list(iterator=True))
+        except Exception as e:
+            print_warning("Skipping group member import for group " + group.full_path + " due to error: " + str(e))
+
+        with GITLAB_READ_SEMAPHORE:
+            group_projects = group.projects.list(iterator=True)
+            for group_project in group_projects:
+                with lock:
+                    if group_project.id not in project_futures:
+                        project_futures[group_project.id] = executor.submit(crawl_project, group_project.id)
+
+    try:
+        # groups only spawn project crawls and projects only spawn user fetches, so once the
+        # previous stage is done, the futures of the next stage are complete
+        for future in [executor.submit(crawl_group, group) for group in groups]:
+            future.result()
+
+        projects = []
+        for project_id, future in list(project_futures.items()):
+            try:
+                projects.append(future.result())
+            except Exception as e:
+                print_error("Failed to load project " + str(project_id) + ": " + str(e))
+
+        users = []
+        for user_id, future in list(user_futures.items()):
+            try:
+                users.append(future.result())
+            except Exception as e:
+                print_error("Failed to load user " + str(user_id) + ": " + str(e))
+    finally:
+        executor.shutdown(wait=True)
+
+    return users, projects
+
+
 # 
 # Data loading helpers for Gitea
 #
 
-def get_project_labels(gitea_api: pygitea, owner: string, repo: string) -> []:
+def iter_pages(gitea_api: GiteaClient, path: string, params: {} = None):
+    """
+    Yields a (response, items) tuple for every page of a Gitea list endpoint, in page order.
+
+    The X-Total-Count header of the first page determines the remaining pages, which are then fetched
+    concurrently. Iteration stops after the first failed response, which is yielded with items set to None.
+    """
+    params = dict(params or {}, limit=GITEA_PAGE_SIZE, page=1)
+    first_response: requests.Response = gitea_api.get(path, params=params)
+    if not first_response.ok:
+        yield first_response, None
+        return
+
+    first_items = first_response.json()
+    yield first_response, first_items
+
+    # the server silently caps the limit, the real page size is the length of a full page
+    page_size = len(first_items)
+    total_count = first_response.headers.get('X-Total-Count')
+    if page_size == 0 or (total_count is not None and int(total_count) <= page_size):
+        return
+
+    if total_count is None:
+        # no count header, read page by page until a short page
+        page, items = 1, first_items
+        while len(items) >= page_size:
+            page += 1
+            previous_items = items
+            response: requests.Response = gitea_api.get(path, params=dict(params, page=page))
+            items = response.json() if response.ok else None
+            yield response, items
+            if not items or items == previous_items:  # stop if the server ignores the page parameter
+                return
+        return
+
+    page_count = -(-int(total_count) // page_size)
+    executor = PhaseThreadPoolExecutor(max_workers=GITEA_PAGINATION_WORKERS)
+    pending = collections.deque()
+    pages = iter(range(2, page_count + 1))
+    try:
+        while True:
+            # keep a bounded window of pages in flight, so huge lists are not buffered completely
+            for page in pages:
+                pending.append(executor.submit(gitea_api.get, path, params=dict(params, page=page, limit=page_size)))
+                if len(pending) >= GITEA_PAGINATION_WORKERS * 2:
+                    break
+            if not pending:
+                return
+            response = pending.popleft().result()
+            if not response.ok:
+                yield response, None
+                return
+            yield response, response.json()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def get_all_pages(gitea_api: GiteaClient, path: string, params: {} = None) -> (requests.Response, []):
+    """
+    Fetches all pages of a Gitea list endpoint. Returns the first failed response, or the response of the
+    first page if all pages were loaded, together with the items of all loaded pages.
+    """
+    result_response = None
+    items = []
+    for response, page_items in iter_pages(gitea_api, path, params):
+        if result_response is None or not response.ok:
+            result_response = response
+        if page_items is None:
+            break
+        items.extend(page_items)
+
+    return result_response, items
+
+
+def get_project_labels(gitea_api: GiteaClient, owner: string, repo: string) -> []:
     existing_labels = []
-    label_response: requests.Response = gitea_api.get("/repos/" + owner + "/" + repo + "/labels")
+    label_response, labels = get_all_pages(gitea_api, "/repos/" + owner + "/" + repo + "/labels")
     if label_response.ok:
-        existing_labels = label_response.json()
+        existing_labels = labels
     else:
         print_error("Failed to load existing labels for project " + repo + "! " + label_response.text)
 
     return existing_labels
 
-def get_group_labels(gitea_api: pygitea, group: string) -> []:
+def get_group_labels(gitea_api: GiteaClient, group: string) -> []:
     existing_labels = []
-    label_response: requests.Response = gitea_api.get("/orgs/" + group + "/labels")
+    label_response, labels = get_all_pages(gitea_api, "/orgs/" + group + "/labels")
     if label_response.ok:
-        existing_labels = label_response.json()
+        existing_labels = labels
     else:
         print_error("Failed to load existing labels for group " + group + "! " + label_response.text)
 
     return existing_labels
 
-def get_merged_labels(gitea_api: pygitea, owner: string, repo: string) -> []:
+def get_merged_labels(gitea_api: GiteaClient, owner: string, repo: string) -> []:
     project_labels = get_project_labels(gitea_api, owner, repo)
     group_labels = get_group_labels(gitea_api, owner)
     return project_labels + group_labels
 
-def get_milestones(gitea_api: pygitea, owner: string, repo: string) -> []:
-    existing_milestones = []
-    milestone_response: requests.Response = gitea_api.get("/repos/" + owner + "/" + repo + "/milestones")
+def get_milestones(gitea_api: GiteaClient, owner: string, repo: string) -> {}:
+    existing_milestones = {}
+    milestone_response, milestones = get_all_pages(gitea_api, "/repos/" + owner + "/" + repo + "/milestones", params={
+        "state": "all"
+    })
     if milestone_response.ok:
-        existing_milestones = [milestone['title'] for milestone in milestone_response.json()]
+        existing_milestones = {milestone['title']: milestone for milestone in milestones}
     else:
         print_error("Failed to load existing milestones for project " + repo + "! " + milestone_response.text)
 
     return existing_milestones
 
-def get_issues(gitea_api: pygitea, owner: string, repo: string) -> []:
+def get_issues(gitea_api: GiteaClient, owner: string, repo: string) -> []:
     existing_issues = []
-    issue_response: requests.Response = gitea_api.get("/repos/" + owner + "/" + repo + "/issues", params={
-        "state": "all",
-        "page": -1
+    issue_response, issues = get_all_pages(gitea_api, "/repos/" + owner + "/" + repo + "/issues", params={
+        "state": "all"
     })
     if issue_response.ok:
-        existing_issues = issue_response.json()
+        existing_issues = issues
     else:
         print_error("Failed to load existing issues for project " + repo + "! " + issue_response.text)
 
     return existing_issues
 
-def get_issue_comments(gitea_api: pygitea, owner: string, repo: string) -> []:
+def get_issue_comments(gitea_api: GiteaClient, owner: string, repo: string) -> []:
     existing_issue_comments = []
-    issue_comments_response: requests.Response = gitea_api.get("/repos/" + owner + "/" + repo + "/issues/comments", params={
-        "state": "all",
-        "page": -1
-    })
+    issue_comments_response, issue_comments = get_all_pages(gitea_api, "/repos/" + owner + "/" + repo + "/issues/comments")
     if issue_comments_response.ok:
-        existing_issue_comments = issue_comments_response.json()
+        existing_issue_comments = issue_comments
     else:
         print_error("Failed to load existing issue comments for project " + repo + "! " + issue_comments_response.text)
 
     return existing_issue_comments
 
-def get_teams(gitea_api: pygitea, orgname: string) -> []:
+class IssueIndex:
+    """
+    In-memory index of the issues and issue comments of a single Gitea repository.
+
+    The index is loaded from Gitea on first use and updated in place whenever an issue or comment is
+    created or changed, so existence checks do not have to refetch the whole lists from Gitea.
+    """
+
+    def __init__(self, gitea_api: GiteaClient, owner: str, repo: str):
+        self.gitea_api = gitea_api
+        self.owner = owner
+        self.repo = repo
+        self.loaded = False
+        self.issues_by_title = {}
+        self.comments_by_body = {}
+
+    @staticmethod
+    def body_digest(body: str) -> str:
+        return hashlib.sha256((body or '').encode('utf-8')).hexdigest()
+
+    def load(self) -> 'IssueIndex':
+        if not self.loaded:
+            self.loaded = True
+            for issue in get_issues(self.gitea_api, self.owner, self.repo):
+                self.add_issue(issue)
+            for comment in get_issue_comments(self.gitea_api, self.owner, self.repo):
+                self.add_comment(comment)
+
+            LOG.debug("Indexed %d issues and %d comments of project %s", len(self.issues_by_title), len(self.comments_by_body), self.repo)
+        return self
+
+    def add_issue(self, issue: {}):
+        # the first issue with a given title wins, like the former linear search did
+        self.issues_by_title.setdefault(issue['title'], issue)
+
+    def add_comment(self, comment: {}):
+        key = (comment['issue_url'], self.body_digest(comment['body']))
+        self.comments_by_body.setdefault(key, comment)
+
+    def find_issue(self, title: str) -> {}:
+        return self.issues_by_title.get(title)
+
+    def find_comment(self, issue_url: str, body: str) -> {}:
+        return self.comments_by_body.get((issue_url, self.body_digest(body)))
+
+
+def load_issue_index(gitea_api: GiteaClient, owner: string, repo: string) -> IssueIndex:
+    return IssueIndex(gitea_api, owner, repo).load()
+
+
+def get_teams(gitea_api: GiteaClient, orgname: string) -> []:
     existing_teams = []
-    team_response: requests.Response = gitea_api.get("/orgs/" + orgname + "/teams")
+    team_response, teams = get_all_pages(gitea_api, "/orgs/" + orgname + "/teams")
     if team_response.ok:
-        existing_teams = team_response.json()
+        existing_teams = teams
     else:
         print_error("Failed to load existing teams for organization " + orgname + "! " + team_response.text)
 
     return existing_teams
 
 
-def get_team_members(gitea_api: pygitea, teamid: int) -> []:
+def get_team_members(gitea_api: GiteaClient, teamid: int) -> []:
     existing_members = []
-    member_response: requests.Response = gitea_api.get("/teams/" + str(teamid) + "/members")
+    member_response, members = get_all_pages(gitea_api, "/teams/" + str(teamid) + "/members")
     if member_response.ok:
-        existing_members = [member['username'] for member in member_response.json()]
+        existing_members = [member['username'] for member in members]
     else:
         print_error("Failed to load existing members for team " + str(teamid) + "! " + member_response.text)
 
     return existing_members
 
 
-def get_collaborators(gitea_api: pygitea, owner: string, repo: string) -> []:
+def get_collaborators(gitea_api: GiteaClient, owner: string, repo: string) -> []:
     existing_collaborators = []
-    collaborator_response: requests.Response = gitea_api.get("/repos/" + owner+ "/" + repo + "/collaborators")
+    collaborator_response, collaborators = get_all_pages(gitea_api, "/repos/" + owner+ "/" + repo + "/collaborators")
     if collaborator_response.ok:
-        existing_collaborators = collaborator_response.json()
+        existing_collaborators = collaborators
     else:
         print_error("Failed to load existing collaborators for project " + repo + "! " + collaborator_response.text)
 
     return existing_collaborators
 
 
-def get_user_or_group(gitea_api: pygitea, project: gitlab.v4.objects.Project) -> {}:
+def get_user_or_group(gitea_api: GiteaClient, project: gitlab.v4.objects.Project) -> {}:
     result = None
     response: requests.Response = gitea_api.get("/users/" + name_clean(project.namespace['name']))
     if response.ok:
@@ -264,175 +1501,176 @@ def get_user_or_group(gitea_api: pygitea, project: gitlab.v4.objects.Project) ->
     return result
 
 
-def get_user_keys(gitea_api: pygitea, username: string) -> []:
+def get_user_keys(gitea_api: GiteaClient, username: string) -> []:
     existing_keys = []
-    key_response: requests.Response = gitea_api.get("/users/" + username + "/keys")
+    key_response, keys = get_all_pages(gitea_api, "/users/" + username + "/keys")
     if key_response.ok:
-        existing_keys = [key['title'] for key in key_response.json()]
+        existing_keys = [key['title'] for key in keys]
     else:
         print_error("Failed to load user keys for user " + username + "! " + key_response.text)
 
     return existing_keys
 
 
-def user_exists(gitea_api: pygitea, username: string) -> bool:
-    print("Looking for " + "/users/" + username + "/keys" +  " in Gitea!")
+def user_exists(gitea_api: GiteaClient, username: string) -> bool:
+    LOG.debug("Looking for /users/%s in Gitea!", username)
     user_response: requests.Response = gitea_api.get("/users/" + username)
     if user_response.ok:
         print_warning("User " + username + " does already exist in Gitea, skipping!")
     else:
-        print("User " + username + " not found in Gitea, importing!")
+        LOG.debug("User %s not found in Gitea, importing!", username)
 
     return user_response.ok
 
 
-def user_key_exists(gitea_api: pygitea, username: string, keyname: string) -> bool:
-    print("Looking for " + "/users/" + username + "/keys" +  " in Gitea!")
+def user_key_exists(gitea_api: GiteaClient, username: string, keyname: string) -> bool:
+    LOG.debug("Looking for /users/%s/keys in Gitea!", username)
     existing_keys = get_user_keys(gitea_api, username)
     if existing_keys:
         if keyname in existing_keys:
             print_warning("Public key " + keyname + " already exists for user " + username + ", skipping!")
             return True
         else:
-            print("Public key " + keyname + " does not exists for user " + username + ", importing!")
+            LOG.debug("Public key %s does not exists for user %s, importing!", keyname, username)
             return False
     else:
-        print("No public keys for user " + username + ", importing!")
+        LOG.debug("No public keys for user %s, importing!", username)
         return False
 
 
-def organization_exists(gitea_api: pygitea, orgname: string) -> bool:
-    print("Looking for " + "/orgs/" + orgname +  " in Gitea!")
+def organization_exists(gitea_api: GiteaClient, orgname: string) -> bool:
+    LOG.debug("Looking for /orgs/%s in Gitea!", orgname)
     group_response: requests.Response = gitea_api.get("/orgs/" + orgname)
     if group_response.ok:
         print_warning("Group " + orgname + " does already exist in Gitea, skipping!")
     else:
-        print("Group " + orgname + " not found in Gitea, importing!")
+        LOG.debug("Group %s not found in Gitea, importing!", orgname)
 
     return group_response.ok
 
 
-def member_exists(gitea_api: pygitea, username: string, teamid: int) -> bool:
-    print("Looking for " + "/teams/" + str(teamid) + "/members" +  " in Gitea!")
+def member_exists(gitea_api: GiteaClient, username: string, teamid: int) -> bool:
+    LOG.debug("Looking for /teams/%s/members in Gitea!", teamid)
     existing_members = get_team_members(gitea_api, teamid)
     if existing_members:
         if username in existing_members:
             print_warning("Member " + username + " is already in team " + str(teamid) + ", skipping!")
             return True
         else:
-            print("Member " + username + " is not in team " + str(teamid) + ", importing!")
+            LOG.debug("Member %s is not in team %s, importing!", username, teamid)
             return False
     else:
-        print("No members in team " + str(teamid) + ", importing!")
+        LOG.debug("No members in team %s, importing!", teamid)
         return False
 
 
-def collaborator_exists(gitea_api: pygitea, owner: string, repo: string, username: string) -> bool:
-    print("Looking for " + "/repos/" + owner + "/" + repo + "/collaborators/" + username +  " in Gitea!")
+def collaborator_exists(gitea_api: GiteaClient, owner: string, repo: string, username: string) -> bool:
+    LOG.debug("Looking for /repos/%s/%s/collaborators/%s in Gitea!", owner, repo, username)
     collaborator_response: requests.Response = gitea_api.get("/repos/" + owner + "/" + repo + "/collaborators/" + username)
     if collaborator_response.ok:
         print_warning("Collaborator " + username + " does already exist in Gitea, skipping!")
     else:
-        print("Collaborator " + username + " not found in Gitea, importing!")
+        LOG.debug("Collaborator %s not found in Gitea, importing!", username)
 
     return collaborator_response.ok
 
 
-def repo_exists(gitea_api: pygitea, owner: string, repo: string) -> bool:
-    print("Looking for " + "/repos/" + owner + "/" + repo + " in Gitea!")
+def repo_exists(gitea_api: GiteaClient, owner: string, repo: string) -> bool:
+    LOG.debug("Looking for /repos/%s/%s in Gitea!", owner, repo)
     repo_response: requests.Response = gitea_api.get("/repos/" + owner + "/" + repo)
     if repo_response.ok:
         print_warning("Project " + repo + " does already exist in Gitea, skipping!")
     else:
-        print("Project " + repo + " not found in Gitea, importing!")
+        LOG.debug("Project %s not found in Gitea, importing!", repo)
 
     return repo_response.ok
 
 
-def project_label_exists(gitea_api: pygitea, owner: string, repo: string, labelname: string) -> bool:
-    print("Looking for " + "/repos/" + owner + "/" + repo + "/labels in Gitea!")
+def project_label_exists(gitea_api: GiteaClient, owner: string, repo: string, labelname: string) -> bool:
+    LOG.debug("Looking for /repos/%s/%s/labels in Gitea!", owner, repo)
     existing_labels = [label['name'] for label in get_project_labels(gitea_api, owner, repo)]
     if existing_labels:
         if labelname in existing_labels:
             print_warning("Label " + labelname + " already exists in project " + repo + " of owner " + owner)
             return True
         else:
-            print("Label " + labelname + " does not exists in project " + repo + " of owner " + owner)
+            LOG.debug("Label %s does not exists in project %s of owner %s", labelname, repo, owner)
             return False
     else:
-        print("No labels in project " + repo + " of owner " + owner)
+        LOG.debug("No labels in project %s of owner %s", repo, owner)
         return False
 
-def group_label_exists(gitea_api: pygitea, group: string, labelname: string) -> bool:
-    print("Looking for " + "/orgs/" + group + "/labels in Gitea!")
+def group_label_exists(gitea_api: GiteaClient, group: string, labelname: string) -> bool:
+    LOG.debug("Looking for /orgs/%s/labels in Gitea!", group)
     existing_labels = [label['name'] for label in get_group_labels(gitea_api, group)]
     if existing_labels:
         if labelname in existing_labels:
             print_warning("Label " + labelname + " already exists in group " + group)
             return True
         else:
-            print("Label " + labelname + " does not exists in group " + group)
+            LOG.debug("Label %s does not exists in group %s", labelname, group)
             return False
     else:
-        print("No labels in group " + group)
+        LOG.debug("No labels in group %s", group)
         return False
 
-def milestone_exists(gitea_api: pygitea, owner: string, repo: string, milestone: string) -> bool:
-    print("Looking for " + "/repos/" + owner + "/" + repo + "/milestones" + " in Gitea!")
+def milestone_exists(gitea_api: GiteaClient, owner: string, repo: string, milestone: string) -> bool:
+    LOG.debug("Looking for /repos/%s/%s/milestones in Gitea!", owner, repo)
     existing_milestones = get_milestones(gitea_api, owner, repo)
     if existing_milestones:
         if milestone in existing_milestones:
             print_warning("Milestone " + milestone + " already exists in project " + repo + " of owner " + owner)
             return True
         else:
-            print("Milestone " + milestone + " does not exists in project " + repo + " of owner " + owner)
+            LOG.debug("Milestone %s does not exists in project %s of owner %s", milestone, repo, owner)
             return False
     else:
-        print("No milestones in project " + repo + " of owner " + owner)
+        LOG.debug("No milestones in project %s of owner %s", repo, owner)
         return False
 
-def get_issue(gitea_api: pygitea, owner: string, repo: string, issue_title: string = None, issue_id: int = None) -> {}:
+def get_issue(gitea_api: GiteaClient, owner: string, repo: string, issue_title: string = None, issue_id: int = None, issue_index: IssueIndex = None) -> {}:
     if issue_title is not None:
-        print("Looking for " + "/repos/" + owner + "/" + repo + "/issues" + " in Gitea!")
-        existing_issues = get_issues(gitea_api, owner, repo)
-        if existing_issues:
-            existing_issue = next((item for item in existing_issues if item['title'] == issue_title), None)
+        if issue_index is None:
+            LOG.debug("Looking for /repos/%s/%s/issues in Gitea!", owner, repo)
+            issue_index = IssueIndex(gitea_api, owner, repo)
+        if issue_index.load().issues_by_title:
+            existing_issue = issue_index.find_issue(issue_title)
             if existing_issue is not None:
-                print("Issue " + issue_title + " already exists in project " + repo)
+                LOG.debug("Issue %s already exists in project %s", issue_title, repo)
                 return existing_issue
             else:
-                print("Issue " + issue_title + " does not exists in project " + repo)
+                LOG.debug("Issue %s does not exists in project %s", issue_title, repo)
                 return None
         else:
-            print("No issues in project " + repo)
+            LOG.debug("No issues in project %s", repo)
             return None
     elif issue_id is not None:
-        print("Looking for " + "/repos/" + owner + "/" + repo + "/issues/" + str(issue_id) + " in Gitea!")
+        LOG.debug("Looking for /repos/%s/%s/issues/%s in Gitea!", owner, repo, issue_id)
         issue_response: requests.Response = gitea_api.get("/repos/" + owner + "/" + repo + "/issues/" + str(issue_id))
         if issue_response.ok:
-            print("Issue " + str(issue_id) + " already exists in project " + repo)
+            LOG.debug("Issue %s already exists in project %s", issue_id, repo)
             return issue_response.json()
         else:
-            print("Issue " + str(issue_id) + " does not exists in project " + repo)
+            LOG.debug("Issue %s does not exists in project %s", issue_id, repo)
             return None
     else:
         print_error("No issue title or id provided!")
     
-def get_issue_comment(gitea_api: pygitea, owner: string, repo: string, issue_url: string, comment_body: string):
-    print("Looking for " + "/repos/" + owner + "/" + repo + "/issues/comments" + " in Gitea!")
-    existing_issue_comments = get_issue_comments(gitea_api, owner, repo)
-    if existing_issue_comments:
-        existing_issue_comment = next((item for item in existing_issue_comments if (item["body"] == comment_body) and (issue_url == item['issue_url'])), None)
+def get_issue_comment(gitea_api: GiteaClient, owner: string, repo: string, issue_url: string, comment_body: string, issue_index: IssueIndex = None):
+    if issue_index is None:
+        LOG.debug("Looking for /repos/%s/%s/issues/comments in Gitea!", owner, repo)
+        issue_index = IssueIndex(gitea_api, owner, repo)
+    if issue_index.load().comments_by_body:
+        existing_issue_comment = issue_index.find_comment(issue_url, comment_body)
 
-        short_comment_body = (comment_body[0:10] + "...") if len(comment_body) > 10 else comment_body
         if existing_issue_comment is not None:
-            print("Issue comment " + short_comment_body + " already exists in project " + repo)
+            LOG.debug("Issue comment %.10s... already exists in project %s", comment_body, repo)
             return existing_issue_comment
         else:
-            print("Issue comment " + short_comment_body + " does not exists in project " + repo)
+            LOG.debug("Issue comment %.10s... does not exists in project %s", comment_body, repo)
             return None
     else:
-        print("No issue comments in project " + repo)
+        LOG.debug("No issue comments in project %s", repo)
         return None
 
 
@@ -440,111 +1678,182 @@ def get_issue_comment(gitea_api: pygitea, owner: string, repo: string, issue_url
 # Import helper functions
 #
 
-def _import_project_labels(gitea_api: pygitea, labels: [gitlab.v4.objects.ProjectLabel], owner: string, repo: string):
-    merged_labels = [label['name'] for label in get_merged_labels(gitea_api, owner, repo)]
-    for label in labels:
-        if not label.name in merged_labels:
-            import_response: requests.Response = gitea_api.post("/repos/" + owner + "/" + repo + "/labels", json={
-                "name": label.name,
-                "color": label.color,
-                "description": label.description # currently not supported
-            })
-            if import_response.ok:
-                print_info("Label " + label.name + " imported!")
-            else:
-                print_error("Label " + label.name + " import failed: " + import_response.text)
+def _import_project_labels(gitea_api: GiteaClient, labels: [gitlab.v4.objects.ProjectLabel], owner: string, repo: string):
+    existing_labels = get_project_labels(gitea_api, owner, repo)
+    merged_labels = [label['name'] for label in existing_labels + get_group_labels(gitea_api, owner)]
+    existing_labels_by_name = {label['name']: label for label in existing_labels}
+
+    def import_label(label: gitlab.v4.objects.ProjectLabel):
+        import_response: requests.Response = gitea_api.post("/repos/" + owner + "/" + repo + "/labels", json={
+            "name": label.name,
+            "color": label.color,
+            "description": label.description # currently not supported
+        })
+        if import_response.ok:
+            print_info("Label " + label.name + " imported!")
+        else:
+            print_error("Label " + label.name + " import failed: " + import_response.text)
+
+    def update_label(label: gitlab.v4.objects.ProjectLabel):
+        existing_label = existing_labels_by_name[label.name]
+        update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/labels/" + str(existing_label['id']), json={
+            "color": label.color,
+            "description": label.description
+        })
+        if update_response.ok:
+            print_info("Label " + label.name + " updated!")
+        else:
+            print_error("Label " + label.name + " update failed: " + update_response.text)
 
+    run_concurrently(import_label, [label for label in labels if not label.name in merged_labels])
+    run_concurrently(update_label, [label for label in labels if label_changed(existing_labels_by_name.get(label.name), label)])
 
-def _import_project_milestones(gitea_api: pygitea, milestones: [gitlab.v4.objects.ProjectMilestone], owner: string, repo: string):
-    for milestone in milestones:
-        print("_import_project_milestones, " + milestone.title + " with owner: " + owner + ", repo: "+ repo)
-        if not milestone_exists(gitea_api, owner, repo, milestone.title):                    
-            due_date = None
-            if milestone.due_date is not None and milestone.due_date != '':
-                due_date = dateutil.parser.parse(milestone.due_date).strftime('%Y-%m-%dT%H:%M:%SZ')
 
-            import_response: requests.Response = gitea_api.post("/repos/" + owner + "/" + repo + "/milestones", json={
+def label_changed(existing_label: {}, label) -> bool:
+    """Returns True if the color or description of an existing Gitea label differ from the GitLab label."""
+    if existing_label is None:
+        return False
+    return existing_label['color'].lstrip('#').lower() != label.color.lstrip('#').lower() \
+        or (existing_label.get('description') or '') != (label.description or '')
+
+
+def _import_project_milestones(gitea_api: GiteaClient, project_id, milestones: [gitlab.v4.objects.ProjectMilestone], owner: string, repo: string):
+    journal = get_journal()
+    milestone_hashes = {milestone.id: content_hash(owner, repo, milestone.title, milestone.description, milestone.due_date, milestone.state) for milestone in milestones}
+    pending_milestones = []
+    for milestone in milestones:
+        journaled_milestone = journal.get('milestone', milestone.id)
+        if journaled_milestone is not None and journaled_milestone[1] == milestone_hashes[milestone.id]:
+            LOG.debug("Milestone %s already migrated, skipping!", milestone.title)
+        else:
+            pending_milestones.append((milestone, journaled_milestone))
+
+    # the existing milestones are only fetched once, if anything is left to do
+    existing_milestones = get_milestones(gitea_api, owner, repo) if pending_milestones else {}
+
+    def import_milestone(pending: ()):
+        milestone, journaled_milestone = pending
+        milestone_hash = milestone_hashes[milestone.id]
+        LOG.debug("_import_project_milestones, %s with owner: %s, repo: %s", milestone.title, owner, repo)
+
+        due_date = None
+        if milestone.due_date is not None and milestone.due_date != '':
+            due_date = parse_timestamp(milestone.due_date).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        milestone_id = journaled_milestone[0] if journaled_milestone is not None else None
+        if not milestone_id and milestone.title in existing_milestones:
+            existing_milestone = existing_milestones[milestone.title]
+            if _milestone_matches(existing_milestone, milestone, due_date):
+                print_warning("Milestone " + milestone.title + " already exists in project " + repo + " of owner " + owner)
+                journal.record('milestone', milestone.id, existing_milestone['id'], milestone_hash, project_id)
+                return
+            milestone_id = str(existing_milestone['id'])
+
+        if milestone_id:
+            # the milestone changed in GitLab since it was migrated, update it in place
+            update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/milestones/" + milestone_id, json={
                 "description": milestone.description,
                 "due_on": due_date,
                 "title": milestone.title,
+                "state": milestone.state
             })
-            if import_response.ok:
-                print_info("Milestone " + milestone.title + " imported!")
-                existing_milestone = import_response.json()
-
-                if existing_milestone:
-                    # update milestone state, this cannot be done in the initial import :(
-                    # TODO: gitea api ignores the closed state...
-                    update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/milestones/" + str(existing_milestone['id']), json={
-                        "description": milestone.description,
-                        "due_on": due_date,
-                        "title": milestone.title,
-                        "state": milestone.state
-                    })
-                    if update_response.ok:
-                        print_info("Milestone " + milestone.title + " updated!")
-                    else:
-                        print_error("Milestone " + milestone.title + " update failed: " + update_response.text)
+            if update_response.ok:
+                print_info("Milestone " + milestone.title + " updated!")
+                journal.record('milestone', milestone.id, milestone_id, milestone_hash, project_id)
             else:
-                print_error("Milestone " + milestone.title + " import failed: " + import_response.text)
+                print_error("Milestone " + milestone.title + " update failed: " + update_response.text)
+            return
+
+        import_response: requests.Response = gitea_api.post("/repos/" + owner + "/" + repo + "/milestones", json={
+            "description": milestone.description,
+            "due_on": due_date,
+            "title": milestone.title,
+        })
+        if import_response.ok:
+            print_info("Milestone " + milestone.title + " imported!")
+            existing_milestone = import_response.json()
+            journal.record('milestone', milestone.id, existing_milestone['id'], milestone_hash, project_id)
+
+            if existing_milestone:
+                # update milestone state, this cannot be done in the initial import :(
+                # TODO: gitea api ignores the closed state...
+                update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/milestones/" + str(existing_milestone['id']), json={
+                    "description": milestone.description,
+                    "due_on": due_date,
+                    "title": milestone.title,
+                    "state": milestone.state
+                })
+                if update_response.ok:
+                    print_info("Milestone " + milestone.title + " updated!")
+                else:
+                    print_error("Milestone " + milestone.title + " update failed: " + update_response.text)
+        else:
+            print_error("Milestone " + milestone.title + " import failed: " + import_response.text)
 
+    run_concurrently(import_milestone, pending_milestones)
 
-def _import_project_issues(gitea_api: pygitea, project_id, issues: [gitlab.v4.objects.ProjectIssue], owner: string, repo: string):
+
+def _milestone_matches(existing_milestone: {}, milestone: gitlab.v4.objects.ProjectMilestone, due_date: str) -> bool:
+    gitlab_state = 'closed' if milestone.state == 'closed' else 'open'
+    existing_due_date = None
+    if existing_milestone.get('due_on'):
+        existing_due_on = parse_timestamp(existing_milestone['due_on'])
+        if existing_due_on.tzinfo is not None:
+            existing_due_on = existing_due_on.astimezone(datetime.timezone.utc)
+        existing_due_date = existing_due_on.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return (existing_milestone.get('description') or '') == (milestone.description or '') \
+        and existing_milestone.get('state') == gitlab_state and existing_due_date == due_date
+
+
+def _import_project_issues(gitea_api: GiteaClient, project_id, issues: [gitlab.v4.objects.ProjectIssue], owner: string, repo: string):
     # reload all existing milestones and labels, needed for assignment in issues
     existing_milestones = get_milestones(gitea_api, owner, repo)
     existing_labels = get_merged_labels(gitea_api, owner, repo)
 
-    org_members = [member['login'] for member in json.loads(gitea_api.get(f'/orgs/{owner}/members').text)]
+    # index all existing issues and comments on first use, lookups and new imports are served from memory
+    issue_index = IssueIndex(gitea_api, owner, repo)
+    journal = get_journal()
+
+    org_members = [member['login'] for member in get_all_pages(gitea_api, f'/orgs/{owner}/members')[1]]
+
+    if ISSUE_IMPORT_BACKEND == 'database':
+        _bulk_import_project_issues(gitea_api, project_id, issues, owner, repo, existing_milestones, existing_labels, org_members, issue_index)
+        return
 
     for issue in issues:
-        print("_import_project_issues" +  issue.title + " with owner: " + owner + ", repo: "+ repo)
-        notes: List[gitlab.v4.objects.ProjectIssueNote] = sorted(issue.notes.list(all=True), key=lambda x: x.created_at)
+        LOG.debug("_import_project_issues %s with owner: %s, repo: %s", issue.title, owner, repo)
+        with GITLAB_READ_SEMAPHORE:
+            notes: List[gitlab.v4.objects.ProjectIssueNote] = sorted(issue.notes.list(all=True), key=lambda x: x.created_at)
+
+        issue_hash = _issue_hash(issue)
+        journaled_issue = journal.get('issue', issue.id)
+        if journaled_issue is not None:
+            if journaled_issue[1] != issue_hash:
+                # the issue changed in GitLab since it was migrated, update it in place
+                issue_fields, params = _issue_fields(issue, existing_milestones, existing_labels, org_members)
+                if _update_issue(gitea_api, project_id, issue, int(journaled_issue[0]), issue_fields, params, owner, repo):
+                    journal.record('issue', issue.id, journaled_issue[0], issue_hash, project_id)
+
+            pending_notes = [note for note in notes if not journal.is_current('issue_note', note.id, content_hash(note.body))]
+            LOG.debug("Issue %s already migrated, %d new or changed comments", issue.title, len(pending_notes))
+            if pending_notes:
+                gitea_issue = get_issue(gitea_api, owner, repo, issue_id=int(journaled_issue[0]))
+                if gitea_issue:
+                    _import_issue_comments(gitea_api, project_id, gitea_issue, owner, repo, pending_notes, org_members, issue_index)
+                else:
+                    journal.forget('issue', issue.id)
+            continue
 
-        gitea_issue = get_issue(gitea_api, owner, repo, issue.title)
+        gitea_issue = get_issue(gitea_api, owner, repo, issue.title, issue_index=issue_index)
         if not gitea_issue:
-            due_date = ''
-            if issue.due_date is not None:
-                due_date = dateutil.parser.parse(issue.due_date).strftime('%Y-%m-%dT%H:%M:%SZ')
-            
-            assignee = None
-            if issue.assignee is not None:
-                assignee = issue.assignee['username']
-
-            assignees = []
-            for tmp_assignee in issue.assignees:
-                assignees.append(tmp_assignee['username'])
-
-            milestone = None
-            if issue.milestone is not None and issue.milestone['title'] in existing_milestones:
-                milestone = issue.milestone['id']
-
-            labels = [label['id'] for label in existing_labels if label['name'] in issue.labels]
-
-            created_at_utc = dateutil.parser.parse(issue.created_at)
-            created_at_local = created_at_utc.astimezone(pytz.timezone('Europe/Berlin')).strftime('%d.%m.%Y %H:%M')
-            body = f"Created at: {created_at_local}\n\n{issue.description}"
-            body = replace_issue_links(body, GITLAB_URL, GITEA_URL)
-
-            params = {}
-            if issue.author['username'] in org_members:
-                params['sudo'] = issue.author['username']
-            else:
-                body = f"Autor: {issue.author['name']}\n\n{body}"
-
+            issue_fields, params = _issue_fields(issue, existing_milestones, existing_labels, org_members)
+            body = issue_fields['body']
 
-            import_response: requests.Response = gitea_api.post("/repos/" + owner + "/" + repo + "/issues", json={
-                "assignee": assignee,
-                "assignees": assignees,
-                "body": body,
-                "closed": issue.state == 'closed',
-                "due_on": due_date,
-                "labels": labels,
-                "milestone": milestone,
-                "title": issue.title
-            }, params=params)
+            import_response: requests.Response = gitea_api.post("/repos/" + owner + "/" + repo + "/issues", json=issue_fields, params=params)
             if import_response.ok:
                 print_info("Issue " + issue.title + " imported!")
                 gitea_issue = json.loads(import_response.text)
+                issue_index.add_issue(gitea_issue)
             else:
                 print_error("Issue " + issue.title + " import failed: " + import_response.text)
                 continue
@@ -552,35 +1861,8 @@ def _import_project_issues(gitea_api: pygitea, project_id, issues: [gitlab.v4.ob
             # Find and handle markdown image links in the issue description
             description = body
             description_old = description
-            description = replace_issue_links(description, GITLAB_URL, GITEA_URL)
-
-            image_links = re.findall(r'\[.*?\]\((/uploads/.*?)\)', issue.description or '')
-            for image_link in image_links:
-                attachment_url = GITLAB_API_BASEURL + '/projects/' + str(project_id) + image_link
-                attachment_response = requests.get(attachment_url, headers={'PRIVATE-TOKEN': GITLAB_TOKEN})
-                if attachment_response.ok:
-                    tmp_path = f'/tmp/gitlab_to_gitea/{os.path.basename(image_link)}'
-                    with open(tmp_path, 'wb') as file:
-                        file.write(attachment_response.content)
-                    print("Image downloaded successfully!")
-                    url = f'{GITEA_API_BASEURL}/repos/{owner}/{repo}/issues/{str(gitea_issue["number"])}/assets'
-                    headers = {
-                        'Authorization': f'token {GITEA_TOKEN}'
-                    } 
-                    files = {
-                        'attachment': open(tmp_path, 'rb')
-                    }
-                    upload_response = requests.post(url, headers=headers, files=files)
-                    os.remove(tmp_path)
-                    if upload_response.ok:
-                        print_info("Attachment " + os.path.basename(image_link) + " uploaded!")
-                        # Replace the image link in the description with the new link
-                        new_image_link = upload_response.json()['browser_download_url']
-                        description = description.replace(image_link, new_image_link)
-                    else:
-                        print_error("Attachment " + os.path.basename(image_link) + " upload failed: " + upload_response.text)
-                else:
-                    print_error("Failed to download attachment " + attachment_url + " for issue " + issue.title + "!")
+
+            description = _import_attachments(gitea_api, project_id, issue.description, description, f'/repos/{owner}/{repo}/issues/{str(gitea_issue["number"])}/assets', "issue " + issue.title)
 
             if description != description_old:
                 update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/issues/" + str(gitea_issue['number']), json={
@@ -591,36 +1873,280 @@ def _import_project_issues(gitea_api: pygitea, project_id, issues: [gitlab.v4.ob
                 else:
                     print_error("Issue " + issue.title + " update failed: " + update_response.text)
 
+        journal.record('issue', issue.id, gitea_issue['number'], issue_hash, project_id)
+
         # import the comments for the issue
-        _import_issue_comments(gitea_api, project_id, gitea_issue, owner, repo, notes, org_members)
+        _import_issue_comments(gitea_api, project_id, gitea_issue, owner, repo, notes, org_members, issue_index)
+
+
+def _bulk_import_project_issues(gitea_api: GiteaClient, project_id, issues: [gitlab.v4.objects.ProjectIssue], owner: string, repo: string,
+                                existing_milestones: {}, existing_labels: [], org_members: List[str], issue_index: IssueIndex):
+    """
+    Database backend of _import_project_issues: new issues and comments are inserted into the Gitea database
+    in one transaction, changed issues and comments are updated through the API. Attachments are relayed
+    through the API once the rows are committed.
+    """
+    journal = get_journal()
+    fallback_poster = gitea_api.get('/user').json()['login']
+
+    new_issues = []
+    new_comments = []
+    issue_hashes = {}
+    notes_by_id = {}
+    for issue in issues:
+        LOG.debug("_import_project_issues %s with owner: %s, repo: %s", issue.title, owner, repo)
+        with GITLAB_READ_SEMAPHORE:
+            notes: List[gitlab.v4.objects.ProjectIssueNote] = sorted(issue.notes.list(all=True), key=lambda x: x.created_at)
+
+        issue_hash = _issue_hash(issue)
+        journaled_issue = journal.get('issue', issue.id)
+        gitea_issue = None
+        if journaled_issue is not None:
+            if journaled_issue[1] != issue_hash:
+                issue_fields, params = _issue_fields(issue, existing_milestones, existing_labels, org_members)
+                if _update_issue(gitea_api, project_id, issue, int(journaled_issue[0]), issue_fields, params, owner, repo):
+                    journal.record('issue', issue.id, journaled_issue[0], issue_hash, project_id)
+        else:
+            gitea_issue = get_issue(gitea_api, owner, repo, issue.title, issue_index=issue_index)
+            if gitea_issue:
+                journal.record('issue', issue.id, gitea_issue['number'], issue_hash, project_id)
+            else:
+                issue_fields, params = _issue_fields(issue, existing_milestones, existing_labels, org_members)
+                issue_hashes[issue.id] = issue_hash
+                new_issues.append({
+                    "key": issue.id,
+                    "title": issue.title,
+                    "body": issue_fields['body'],
+                    "poster": params.get('sudo'),
+                    "closed": issue_fields['closed'],
+                    "milestone_id": issue_fields['milestone'],
+                    "label_ids": issue_fields['labels'],
+                    "assignees": issue_fields['assignees'],
+                    "deadline": _unix_deadline(issue.due_date),
+                    "created": _unix_timestamp(issue.created_at),
+                    "updated": _unix_timestamp(issue.updated_at),
+                    "closed_at": _unix_timestamp(getattr(issue, 'closed_at', None))
+                })
+
+        pending_notes = []
+        for note in notes:
+            journaled_note = journal.get('issue_note', note.id)
+            if journaled_note is not None and journaled_note[1] == content_hash(note.body):
+                continue
+            elif journaled_note is not None and journaled_note[0]:
+                _update_issue_comment(gitea_api, project_id, note, journaled_note[0], org_members, owner, repo)
+            else:
+                pending_notes.append(note)
+
+        if pending_notes and journaled_issue is not None:
+            gitea_issue = get_issue(gitea_api, owner, repo, issue_id=int(journaled_issue[0]))
+            if not gitea_issue:
+                journal.forget('issue', issue.id)
+                continue
+
+        for note in pending_notes:
+            if gitea_issue:
+                # comments of existing issues might have been created before the journal existed
+                existing_comment = get_issue_comment(gitea_api, owner, repo, gitea_issue['url'], note.body, issue_index=issue_index)
+                if existing_comment:
+                    journal.record('issue_note', note.id, existing_comment['id'], content_hash(note.body), project_id)
+                    continue
+
+            body, params = _note_body(note, org_members)
+            notes_by_id[note.id] = note
+            new_comments.append({
+                "key": note.id,
+                "issue_key": None if gitea_issue else issue.id,
+                "issue_number": gitea_issue['number'] if gitea_issue else None,
+                "body": body,
+                "poster": params.get('sudo'),
+                "created": _unix_timestamp(note.created_at),
+                "updated": _unix_timestamp(note.updated_at)
+            })
+
+    if not new_issues and not new_comments:
+        return
+
+    try:
+        numbers, comment_ids = get_gitea_database().bulk_insert_issues(owner, repo, fallback_poster, new_issues, new_comments)
+    except Exception as e:
+        print_error("Bulk import of " + str(len(new_issues)) + " issues and " + str(len(new_comments)) + " comments into " + owner + "/" + repo + " failed: " + str(e))
+        return
+    print_info(str(len(new_issues)) + " issues and " + str(len(new_comments)) + " comments of " + owner + "/" + repo + " imported into the database!")
+
+    # relay the attachments through the API, the issues and comments exist now
+    issues_by_id = {issue.id: issue for issue in issues}
+    for new_issue in new_issues:
+        issue = issues_by_id[new_issue['key']]
+        number = numbers[new_issue['key']]
+        description = _import_attachments(gitea_api, project_id, issue.description, new_issue['body'], f'/repos/{owner}/{repo}/issues/{str(number)}/assets', "issue " + issue.title)
+        if description != new_issue['body']:
+            update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/issues/" + str(number), json={
+                "body": description
+            })
+            if not update_response.ok:
+                print_error("Issue " + issue.title + " update failed: " + update_response.text)
+        journal.record('issue', issue.id, number, issue_hashes[issue.id], project_id)
+
+    for new_comment in new_comments:
+        note = notes_by_id[new_comment['key']]
+        comment_id = comment_ids[new_comment['key']]
+        comment_body = _import_attachments(gitea_api, project_id, note.body, new_comment['body'], f'/repos/{owner}/{repo}/issues/comments/{comment_id}/assets', "comment " + note.body)
+        if comment_body != new_comment['body']:
+            update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/issues/comments/" + str(comment_id), json={
+                "body": comment_body
+            })
+            if not update_response.ok:
+                print_error("Comment " + str(comment_id) + " update failed: " + update_response.text)
+        journal.record('issue_note', note.id, comment_id, content_hash(note.body), project_id)
+
+
+def _unix_timestamp(value: str) -> int:
+    return int(parse_timestamp(value).timestamp()) if value else 0
+
+
+def _unix_deadline(due_date: str) -> int:
+    # like Gitea, deadlines are the end of the due date
+    if not due_date:
+        return 0
+    due = parse_timestamp(due_date)
+    return int(datetime.datetime(due.year, due.month, due.day, 23, 59, 59, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def _issue_hash(issue: gitlab.v4.objects.ProjectIssue) -> str:
+    milestone_title = issue.milestone['title'] if issue.milestone is not None else None
+    assignees = [assignee['username'] for assignee in issue.assignees]
+    return content_hash(issue.title, issue.description, issue.state, sorted(issue.labels), milestone_title, assignees, issue.due_date)
+
+
+def _issue_fields(issue: gitlab.v4.objects.ProjectIssue, existing_milestones: {}, existing_labels: [], org_members: List[str]) -> ({}, {}):
+    """Returns the Gitea issue fields and the request parameters (sudo) for a GitLab issue."""
+    due_date = ''
+    if issue.due_date is not None:
+        due_date = parse_timestamp(issue.due_date).strftime('%Y-%m-%dT%H:%M:%SZ')
+    
+    assignee = None
+    if issue.assignee is not None:
+        assignee = issue.assignee['username']
 
+    assignees = []
+    for tmp_assignee in issue.assignees:
+        assignees.append(tmp_assignee['username'])
 
-def _import_issue_comments(gitea_api: pygitea, project_id, issue, owner: string, repo: string, notes: List[gitlab.v4.objects.ProjectIssueNote], org_members: List[str]):
+    milestone = None
+    if issue.milestone is not None and issue.milestone['title'] in existing_milestones:
+        milestone = existing_milestones[issue.milestone['title']]['id']
+
+    labels = [label['id'] for label in existing_labels if label['name'] in issue.labels]
+
+    created_at_local = format_local_timestamp(issue.created_at)
+    body = f"Created at: {created_at_local}\n\n{issue.description}"
+    body = replace_issue_links(body, GITLAB_URL, GITEA_URL)
+
+    params = {}
+    if issue.author['username'] in org_members:
+        params['sudo'] = issue.author['username']
+    else:
+        body = f"Autor: {issue.author['name']}\n\n{body}"
+
+    return {
+        "assignee": assignee,
+        "assignees": assignees,
+        "body": body,
+        "closed": issue.state == 'closed',
+        "due_on": due_date,
+        "labels": labels,
+        "milestone": milestone,
+        "title": issue.title
+    }, params
+
+
+def _update_issue(gitea_api: GiteaClient, project_id, issue: gitlab.v4.objects.ProjectIssue, number: int, issue_fields: {}, params: {}, owner: string, repo: string) -> bool:
+    body = _import_attachments(gitea_api, project_id, issue.description, issue_fields['body'], f'/repos/{owner}/{repo}/issues/{str(number)}/assets', "issue " + issue.title)
+    update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/issues/" + str(number), json={
+        "assignee": issue_fields['assignee'],
+        "assignees": issue_fields['assignees'],
+        "body": body,
+        "due_on": issue_fields['due_on'],
+        "milestone": issue_fields['milestone'],
+        "state": 'closed' if issue_fields['closed'] else 'open',
+        "title": issue_fields['title']
+    }, params=params)
+    if not update_response.ok:
+        print_error("Issue " + issue.title + " update failed: " + update_response.text)
+        return False
+
+    labels_response: requests.Response = gitea_api.put("/repos/" + owner + "/" + repo + "/issues/" + str(number) + "/labels", json={
+        "labels": issue_fields['labels']
+    })
+    if not labels_response.ok:
+        print_error("Issue " + issue.title + " label update failed: " + labels_response.text)
+        return False
+
+    print_info("Issue " + issue.title + " updated!")
+    return True
+
+
+def _note_body(note: gitlab.v4.objects.ProjectIssueNote, org_members: List[str]) -> (str, {}):
+    """Returns the Gitea comment body and the request parameters (sudo) for a GitLab note."""
+    created_at_local = format_local_timestamp(note.created_at)
+    body = f"{note.body}\n\n{created_at_local}"
+    body = replace_issue_links(body, GITLAB_URL, GITEA_URL)
+
+    params = {}
+    if note.author['username'] in org_members:
+        params['sudo'] = note.author['username']
+    else:
+        body = f"Autor: {note.author['name']}\n\n{body}"
+
+    return body, params
+
+
+def _update_issue_comment(gitea_api: GiteaClient, project_id, note: gitlab.v4.objects.ProjectIssueNote, comment_id: str, org_members: List[str], owner: string, repo: string):
+    short_comment_body = (note.body[0:10] + "...") if len(note.body) > 10 else note.body
+    body, params = _note_body(note, org_members)
+    body = _import_attachments(gitea_api, project_id, note.body, body, f'/repos/{owner}/{repo}/issues/comments/{comment_id}/assets', "comment " + note.body)
+    update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/issues/comments/" + comment_id, json={
+        "body": body
+    }, params=params)
+    if update_response.ok:
+        print_info("Comment " + short_comment_body + " updated!")
+        get_journal().record('issue_note', note.id, comment_id, content_hash(note.body), project_id)
+    else:
+        print_error("Comment " + short_comment_body + " update failed: " + update_response.text)
+
+
+def _import_issue_comments(gitea_api: GiteaClient, project_id, issue, owner: string, repo: string, notes: List[gitlab.v4.objects.ProjectIssueNote], org_members: List[str], issue_index: IssueIndex):
+    journal = get_journal()
     for note in notes:
         short_comment_body = (note.body[0:10] + "...") if len(note.body) > 10 else note.body
 
-        existing_comment = get_issue_comment(gitea_api, owner, repo, issue['url'], note.body)
+        note_hash = content_hash(note.body)
+        journaled_note = journal.get('issue_note', note.id)
+        if journaled_note is not None and journaled_note[1] == note_hash:
+            LOG.debug("Issue comment %s already migrated, skipping!", short_comment_body)
+            continue
+        elif journaled_note is not None and journaled_note[0]:
+            # the note was edited in GitLab since it was migrated, update the comment in place
+            _update_issue_comment(gitea_api, project_id, note, journaled_note[0], org_members, owner, repo)
+            continue
+
+        existing_comment = get_issue_comment(gitea_api, owner, repo, issue['url'], note.body, issue_index=issue_index)
         comment_id = existing_comment['id'] if existing_comment else None
         body = note.body
+        params = {}
 
         if not existing_comment:
-            created_at_utc = dateutil.parser.parse(note.created_at)
-            created_at_local = created_at_utc.astimezone(pytz.timezone('Europe/Berlin')).strftime('%d.%m.%Y %H:%M')
-            body = f"{note.body}\n\n{created_at_local}"
-            body = replace_issue_links(body, GITLAB_URL, GITEA_URL)
-            
-            params = {}
-            if note.author['username'] in org_members:
-                params['sudo'] = note.author['username']
-            else:
-                body = f"Autor: {note.author['name']}\n\n{body}"
+            body, params = _note_body(note, org_members)
 
             import_response: requests.Response = gitea_api.post("/repos/" + owner + "/" + repo + "/issues/" + str(issue['number']) + "/comments", json={
                 "body": body,
             },
             params=params)
             if import_response.ok:
-                comment_id = json.loads(import_response.text)['id']
+                new_comment = json.loads(import_response.text)
+                comment_id = new_comment['id']
+                issue_index.add_comment(new_comment)
                 print_info("Issue comment " + short_comment_body + " imported!")
             else:
                 print_error("Issue comment " + short_comment_body + " import failed: " + import_response.text)
@@ -634,33 +2160,7 @@ def _import_issue_comments(gitea_api: pygitea, project_id, issue, owner: string,
         comment_body_old = comment_body
         comment_body = replace_issue_links(comment_body, GITLAB_URL, GITEA_URL)
 
-        image_links = re.findall(r'\[.*?\]\((/uploads/.*?)\)', note.body or '')
-        for image_link in image_links:
-            attachment_url = GITLAB_API_BASEURL + '/projects/' + str(project_id) + image_link
-            attachment_response = requests.get(attachment_url, headers={'PRIVATE-TOKEN': GITLAB_TOKEN})
-            if attachment_response.ok:
-                tmp_path = f'/tmp/gitlab_to_gitea/{os.path.basename(image_link)}'
-                with open(tmp_path, 'wb') as file:
-                    file.write(attachment_response.content)
-                print("Image downloaded successfully!")
-                url = f'{GITEA_API_BASEURL}/repos/{owner}/{repo}/issues/comments/{comment_id}/assets'
-                headers = {
-                    'Authorization': f'token {GITEA_TOKEN}'
-                } 
-                files = {
-                    'attachment': open(tmp_path, 'rb')
-                }
-                upload_response = requests.post(url, headers=headers, files=files)
-                os.remove(tmp_path)
-                if upload_response.ok:
-                    print_info("Attachment " + os.path.basename(image_link) + " uploaded!")
-                    # Replace the image link in the comment body with the new link
-                    new_image_link = upload_response.json()['browser_download_url']
-                    comment_body = comment_body.replace(image_link, new_image_link)
-                else:
-                    print_error("Attachment " + os.path.basename(image_link) + " upload failed: " + upload_response.text)
-            else:
-                print_error("Failed to download attachment " + attachment_url + " for comment " + note.body + "!")
+        comment_body = _import_attachments(gitea_api, project_id, note.body, comment_body, f'/repos/{owner}/{repo}/issues/comments/{comment_id}/assets', "comment " + note.body)
 
         if comment_body != comment_body_old:
             update_response: requests.Response = gitea_api.patch("/repos/" + owner + "/" + repo + "/issues/comments/" + str(comment_id), json={
@@ -668,128 +2168,516 @@ def _import_issue_comments(gitea_api: pygitea, project_id, issue, owner: string,
             }, params=params)
             if update_response.ok:
                 print_info("Comment " + short_comment_body + " updated!")
+                issue_index.add_comment(update_response.json())
             else:
                 print_error("Comment " + short_comment_body + " update failed: " + update_response.text)
 
+        journal.record('issue_note', note.id, comment_id, note_hash, project_id)
 
-def _import_project_repo(gitea_api: pygitea, project: gitlab.v4.objects.Project):
-    if not repo_exists(gitea_api, name_clean(project.namespace['name']), name_clean(project.name)):
-        clone_url = project.http_url_to_repo
-        if GITLAB_ADMIN_PASS == '' and GITLAB_ADMIN_USER == '':
-            clone_url = project.ssh_url_to_repo
-        private = project.visibility == 'private' or project.visibility == 'internal'
 
-        # Load the owner (users and groups can both be fetched using the /users/ endpoint)
-        owner = get_user_or_group(gitea_api, project)
-        if owner:
-            description = project.description
-
-            if description is not None and len(description) > 255:
-                description = description[:255]
-                print_warning(f"Description of {name_clean(project.name)} had to be truncated to 255 characters!")
-
-            import_response: requests.Response = gitea_api.post("/repos/migrate", json={
-                "auth_password": GITLAB_ADMIN_PASS,
-                "auth_token": GITLAB_TOKEN,
-                "auth_username": GITLAB_ADMIN_USER,
-                "clone_addr": clone_url,
-                "description": description,
-                "mirror": REPOSITORY_MIRROR,
-                "private": private,
-                "repo_name": name_clean(project.name),
-                "uid": owner['id']
-            })
-            if import_response.ok:
-                print_info("Project " + name_clean(project.name) + " imported!")
-            else:
-                print_error("Project " + name_clean(project.name) + " import failed: " + import_response.text)
+def _import_attachments(gitea_api: GiteaClient, project_id, source_text: str, body: str, asset_path: str, context: str) -> str:
+    """
+    Relays all GitLab uploads referenced in source_text to the given Gitea asset endpoint
+    and returns body with the upload links replaced by the new Gitea links.
+    """
+    rewriter = get_body_rewriter(GITLAB_URL, GITEA_URL)
+    image_links = rewriter.upload_links(source_text)
+    if not image_links:
+        return body
+
+    new_image_links = run_concurrently(lambda image_link: relay_attachment(gitea_api, project_id, image_link, asset_path, context), image_links, ATTACHMENT_WORKERS)
+    return rewriter.rewrite(body, dict(zip(image_links, new_image_links)))
+
+
+def relay_attachment(gitea_api: GiteaClient, project_id, upload_path: str, asset_path: str, context: str) -> str:
+    """
+    Streams a GitLab upload into a Gitea asset upload chunk by chunk, without buffering the whole file
+    in memory or on disk. Returns the browser_download_url of the new asset or None on failure.
+
+    Relayed uploads are cached in the journal by upload path and by SHA-256 of their content, repeated
+    references to the same upload or to identical files in the same repository are not transferred again.
+    """
+    journal = get_journal()
+    upload_key = str(project_id) + upload_path
+    asset_repo = '/'.join(asset_path.split('/')[2:4])  # asset paths start with /repos/{owner}/{repo}/
+    filename = os.path.basename(upload_path)
+
+    cached_url = journal.get_attachment_url(upload_key)
+    if cached_url:
+        LOG.debug("Attachment %s already uploaded, reusing %s", filename, cached_url)
+        return cached_url
+
+    attachment_url = GITLAB_API_BASEURL + '/projects/' + str(project_id) + upload_path
+    if SNAPSHOT is not None:
+        attachment_response = SNAPSHOT.open_upload(project_id, upload_path)
+    else:
+        with GITLAB_READ_SEMAPHORE:
+            attachment_response = GITLAB_SESSION.get(attachment_url, headers={'PRIVATE-TOKEN': GITLAB_TOKEN}, stream=True)
+
+    with attachment_response:
+        if not attachment_response.ok:
+            print_error("Failed to download attachment " + attachment_url + " for " + context + "!")
+            return None
+
+        digest = hashlib.sha256()
+        content_length = int(attachment_response.headers.get('Content-Length') or -1)
+        content_type = attachment_response.headers.get('Content-Type', 'application/octet-stream')
+        if 0 <= content_length <= ATTACHMENT_DEDUP_MAX_SIZE:
+            content = attachment_response.content
+            digest.update(content)
+            with ATTACHMENT_DIGEST_LOCKS[int(digest.hexdigest()[:8], 16) % len(ATTACHMENT_DIGEST_LOCKS)]:
+                existing_url = journal.find_attachment_by_digest(asset_repo, digest.hexdigest())
+                if existing_url:
+                    LOG.debug("Attachment %s has the same content as an uploaded attachment, reusing %s", filename, existing_url)
+                    journal.record_attachment(upload_key, asset_repo, digest.hexdigest(), existing_url)
+                    return existing_url
+                return _upload_attachment(gitea_api, asset_path, filename, content_type, [content], digest, upload_key, asset_repo)
         else:
-            print_error("Failed to load project owner for project " + name_clean(project.name))
+            chunks = _hashing_chunks(attachment_response.iter_content(ATTACHMENT_CHUNK_SIZE), digest)
+            return _upload_attachment(gitea_api, asset_path, filename, content_type, chunks, digest, upload_key, asset_repo)
 
 
-def _import_project_repo_collaborators(gitea_api: pygitea, collaborators: [gitlab.v4.objects.ProjectMember], project: gitlab.v4.objects.Project):
-    for collaborator in collaborators:
-        
-        if not collaborator_exists(gitea_api, name_clean(project.namespace['name']), name_clean(project.name), collaborator.username):
-            permission = "read"
-            
-            if collaborator.access_level == 10:    # guest access
-                permission = "read"
-            elif collaborator.access_level == 20:  # reporter access
-                permission = "read"
-            elif collaborator.access_level == 30:  # developer access
-                permission = "write"
-            elif collaborator.access_level == 40:  # maintainer access
-                permission = "admin"
-            elif collaborator.access_level == 50:  # owner access (only for groups)
-                print_error("Groupmembers are currently not supported!")
-                continue  # groups are not supported
-            else:
-                print_warning("Unsupported access level " + str(collaborator.access_level) + ", setting permissions to 'read'!")
-            
-            import_response: requests.Response = gitea_api.put("/repos/" + name_clean(project.namespace['name']) +"/" + name_clean(project.name) + "/collaborators/" + collaborator.username, json={
-                "permission": permission
-            })
-            if import_response.ok:
-                print_info("Collaborator " + collaborator.username + " imported!")
-            else:
-                print_error("Collaborator " + collaborator.username + " import failed: " + import_response.text)
+def _upload_attachment(gitea_api: GiteaClient, asset_path: str, filename: str, content_type: str, chunks, digest, upload_key: str, asset_repo: str) -> str:
+    boundary = uuid.uuid4().hex
+    upload_response = gitea_api.post(asset_path, data=_multipart_stream(boundary, 'attachment', filename, content_type, chunks), headers={
+        'Content-Type': 'multipart/form-data; boundary=' + boundary
+    })
 
+    if upload_response.ok:
+        print_info("Attachment " + filename + " uploaded!")
+        new_url = upload_response.json()['browser_download_url']
+        # the digest is complete once the streamed upload consumed all chunks
+        get_journal().record_attachment(upload_key, asset_repo, digest.hexdigest(), new_url)
+        return new_url
+    else:
+        print_error("Attachment " + filename + " upload failed: " + upload_response.text)
+        return None
 
-def _import_users(gitea_api: pygitea, users: [gitlab.v4.objects.User], notify: bool = False):
-    with open('created_users.txt', 'a') as f:
-        for user in users:
-            keys: [gitlab.v4.objects.UserKey] = user.keys.list(all=True)
 
-            print("Importing user " + user.username + "...")
-            print("Found " + str(len(keys)) + " public keys for user " + user.username)
+def _hashing_chunks(chunks, digest):
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+def _multipart_stream(boundary: str, field: str, filename: str, content_type: str, chunks):
+    """Generates a multipart/form-data body with a single file field from an iterable of byte chunks."""
+    yield (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename.replace(chr(34), "%22")}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    ).encode('utf-8')
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+
+def _import_project_repo(gitea_api: GiteaClient, project: gitlab.v4.objects.Project) -> bool:
+    """Migrates the repository of the project. Returns True once the repository is available in Gitea."""
+    if REPOSITORY_TRANSFER_MODE == 'push':
+        return _push_project_repo(gitea_api, project)
+
+    journal = get_journal()
+    owner_name = name_clean(project.namespace['name'])
+    repo_name = name_clean(project.name)
+    repo_hash = content_hash(owner_name, repo_name)
+    if journal.is_current('repo', project.id, repo_hash):
+        LOG.debug("Project %s repository already migrated, skipping!", repo_name)
+        return True
+    elif repo_exists(gitea_api, owner_name, repo_name):
+        journal.record('repo', project.id, owner_name + "/" + repo_name, repo_hash)
+        return True
+
+    clone_url = project.http_url_to_repo
+    if GITLAB_ADMIN_PASS == '' and GITLAB_ADMIN_USER == '':
+        clone_url = project.ssh_url_to_repo
+    private = project.visibility == 'private' or project.visibility == 'internal'
+
+    # Load the owner (users and groups can both be fetched using the /users/ endpoint)
+    owner = get_user_or_group(gitea_api, project)
+    if not owner:
+        print_error("Failed to load project owner for project " + repo_name)
+        return False
 
-            if not user_exists(gitea_api, user.username):
-                tmp_password = 'Tmp1!' + ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+    description = project.description
+
+    if description is not None and len(description) > 255:
+        description = description[:255]
+        print_warning(f"Description of {repo_name} had to be truncated to 255 characters!")
+
+    started = time.monotonic()
+    try:
+        import_response: requests.Response = gitea_api.post("/repos/migrate", json={
+            "auth_password": GITLAB_ADMIN_PASS,
+            "auth_token": GITLAB_TOKEN,
+            "auth_username": GITLAB_ADMIN_USER,
+            "clone_addr": clone_url,
+            "description": description,
+            "mirror": REPOSITORY_MIRROR,
+            "private": private,
+            "repo_name": repo_name,
+            "uid": owner['id']
+        }, timeout=REPO_MIGRATE_REQUEST_TIMEOUT)
+        ready = import_response.ok
+        if not ready and import_response.status_code not in (502, 504):
+            print_error("Project " + repo_name + " import failed: " + import_response.text)
+            return False
+    except requests.exceptions.Timeout:
+        ready = False
+
+    if not ready:
+        # Gitea keeps cloning in the background when the request times out
+        print_warning("Project " + repo_name + " is still being migrated, waiting for Gitea...")
+        ready = _wait_for_repo(gitea_api, owner_name, repo_name, getattr(project, 'empty_repo', False), started)
+        if not ready:
+            return False
 
-                tmp_email = user.username + '@noemail-git.local'  # Some gitlab instances do not publish user emails
-                try:
-                    tmp_email = user.email
-                except AttributeError:
-                    pass
-                import_response: requests.Response = gitea_api.post("/admin/users", json={
-                    "email": tmp_email,
-                    "full_name": user.name,
-                    "login_name": user.username,
-                    "password": tmp_password,
-                    "send_notify": notify,
-                    "source_id": 0, # local user
-                    "username": user.username,
-                    "visibility": "internal"
-                })
-                if import_response.ok:
-                    print_info("User " + user.username + " imported, temporary password: " + tmp_password)
-                    f.write(f"{user.username},{tmp_password}\n")
-                else:
-                    print_error("User " + user.username + " import failed: " + import_response.text)
+    duration = time.monotonic() - started
+    journal.record_clone_duration(project.id, owner_name + "/" + repo_name, duration)
+    journal.record_created('repo', owner_name + "/" + repo_name)
+    journal.record('repo', project.id, owner_name + "/" + repo_name, repo_hash)
+    print_info("Project " + repo_name + " imported in " + str(round(duration, 1)) + "s!")
+    return True
+
+
+def _push_project_repo(gitea_api: GiteaClient, project: gitlab.v4.objects.Project) -> bool:
+    """
+    Synchronizes the repository of the project through the local mirror cache: the GitLab repository is cloned
+    with --mirror on the first run and fetched incrementally afterwards, then all branches and tags are pushed to Gitea.
+    """
+    owner_name = name_clean(project.namespace['name'])
+    repo_name = name_clean(project.name)
+
+    if not repo_exists(gitea_api, owner_name, repo_name):
+        private = project.visibility == 'private' or project.visibility == 'internal'
+        description = project.description
+        if description is not None and len(description) > 255:
+            description = description[:255]
+            print_warning(f"Description of {repo_name} had to be truncated to 255 characters!")
+
+        # the admin endpoint creates repositories for users and organizations alike
+        create_response: requests.Response = gitea_api.post("/admin/users/" + owner_name + "/repos", json={
+            "name": repo_name,
+            "description": description,
+            "private": private,
+        })
+        if not create_response.ok:
+            print_error("Project " + repo_name + " creation failed: " + create_response.text)
+            return False
+        get_journal().record_created('repo', owner_name + "/" + repo_name)
+
+    started = time.monotonic()
+    mirror_path = os.path.join(MIRROR_CACHE_DIR, str(project.id) + ".git")
+    if MIGRATION_STAGE == 'import':
+        # the export stage filled the mirror cache, GitLab is not contacted
+        if not os.path.exists(mirror_path):
+            print_error("Repository of project " + repo_name + " is missing in the mirror cache " + MIRROR_CACHE_DIR + "!")
+            return False
+    elif not _fetch_mirror(project, mirror_path, repo_name):
+        return False
+
+    # only branches and tags are pushed, Gitea rejects GitLab internal refs like refs/merge-requests/*
+    gitea_url = GITEA_URL.rstrip('/') + "/" + owner_name + "/" + repo_name + ".git"
+    if not _run_git(["-C", mirror_path, "push", "--prune", gitea_url, "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"], "push", repo_name,
+                    auth_header="Authorization: token " + GITEA_TOKEN):
+        return False
+
+    duration = time.monotonic() - started
+    get_journal().record_clone_duration(project.id, owner_name + "/" + repo_name, duration)
+    print_info("Project " + repo_name + " synchronized in " + str(round(duration, 1)) + "s!")
+    return True
+
+
+def _fetch_mirror(project: gitlab.v4.objects.Project, mirror_path: str, repo_name: string) -> bool:
+    """Clones the GitLab repository into the mirror cache with --mirror or fetches it incrementally."""
+    if GITLAB_ADMIN_PASS == '' and GITLAB_ADMIN_USER == '':
+        gitlab_url = project.ssh_url_to_repo
+        gitlab_auth = None
+    else:
+        gitlab_url = project.http_url_to_repo
+        credentials = base64.b64encode((GITLAB_ADMIN_USER + ":" + GITLAB_ADMIN_PASS).encode('utf-8')).decode('ascii')
+        gitlab_auth = "Authorization: Basic " + credentials
+
+    # credentials are passed per command, so they are never stored in the mirror cache
+    if os.path.exists(mirror_path):
+        fetched = _run_git(["-C", mirror_path, "fetch", "--prune", gitlab_url, "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"], "fetch", repo_name,
+                           auth_header=gitlab_auth)
+    else:
+        os.makedirs(MIRROR_CACHE_DIR, exist_ok=True)
+        fetched = _run_git(["clone", "--mirror", gitlab_url, mirror_path], "clone", repo_name, auth_header=gitlab_auth)
+    return fetched
+
+
+def _run_git(args: [str], action: str, repo_name: string, auth_header: str = None) -> bool:
+    env = None
+    if auth_header:
+        # the header is passed in the environment (git 2.31 or later), the command line is visible to all local users
+        index = int(os.environ.get('GIT_CONFIG_COUNT', '0'))
+        env = dict(os.environ, GIT_CONFIG_COUNT=str(index + 1))
+        env['GIT_CONFIG_KEY_' + str(index)] = 'http.extraHeader'
+        env['GIT_CONFIG_VALUE_' + str(index)] = auth_header
+    result = subprocess.run(["git"] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, env=env)
+    if result.returncode != 0:
+        print_error("git " + action + " failed for project " + repo_name + ": " + result.stderr.strip())
+        return False
+    return True
+
+
+def _wait_for_repo(gitea_api: GiteaClient, owner: string, repo: string, empty_repo: bool, started: float) -> bool:
+    missing_since = None
+    while time.monotonic() - started < REPO_READY_TIMEOUT:
+        repo_response: requests.Response = gitea_api.get("/repos/" + owner + "/" + repo)
+        # an empty repository means the clone has not finished yet, unless the GitLab repository is empty as well
+        if repo_response.ok and (empty_repo or not repo_response.json().get('empty', False)):
+            return True
+        if repo_response.status_code == 404:
+            missing_since = missing_since or time.monotonic()
+            if time.monotonic() - missing_since >= REPO_MISSING_GRACE:
+                print_error("Project " + repo + " import failed: Gitea removed the repository, the migration failed in the background")
+                return False
+        else:
+            missing_since = None
+        time.sleep(REPO_POLL_INTERVAL)
+
+    print_error("Project " + repo + " import failed: repository not ready after " + str(REPO_READY_TIMEOUT) + "s")
+    return False
+
+
+# Gitea collaborator permissions of the GitLab project access levels
+COLLABORATOR_PERMISSIONS = {
+    10: "read",   # guest access
+    20: "read",   # reporter access
+    30: "write",  # developer access
+    40: "admin",  # maintainer access
+}
+
+
+def _import_project_repo_collaborators(gitea_api: GiteaClient, collaborators: [gitlab.v4.objects.ProjectMember], project: gitlab.v4.objects.Project):
+    """
+    Reconciles the repository collaborators with the GitLab project members. The current collaborators are
+    fetched once, added collaborators and their permissions are journaled, so collaborators that were
+    removed from the GitLab project are removed again while collaborators added in Gitea are kept.
+    """
+    owner = name_clean(project.namespace['name'])
+    repo = name_clean(project.name)
+    journal = get_journal()
+    journal_prefix = str(project.id) + "/"
+
+    permissions = {}
+    for collaborator in collaborators:
+        if collaborator.access_level == 50:  # owner access (only for groups)
+            print_error("Groupmembers are currently not supported!")
+            continue  # groups are not supported
+        if collaborator.access_level not in COLLABORATOR_PERMISSIONS:
+            print_warning("Unsupported access level " + str(collaborator.access_level) + ", setting permissions to 'read'!")
+        permissions[collaborator.username] = COLLABORATOR_PERMISSIONS.get(collaborator.access_level, "read")
+
+    existing_collaborators = {collaborator['login'] for collaborator in get_collaborators(gitea_api, owner, repo)}
+    migrated_collaborators = {gitlab_id[len(journal_prefix):] for gitlab_id, _, _ in journal.find('collaborator', journal_prefix)}
+
+    # new collaborators and collaborators whose access level changed (or is not journaled yet)
+    changed = [username for username, permission in permissions.items()
+               if username not in existing_collaborators or not journal.is_current('collaborator', journal_prefix + username, permission)]
+    removed = sorted(migrated_collaborators - set(permissions))
+    LOG.info("Collaborators of project " + repo + ": " + str(len(permissions) - len(changed)) + " unchanged, " + str(len(changed)) + " to add or update, " + str(len(removed)) + " to remove")
+
+    def import_collaborator(username: str):
+        import_response: requests.Response = gitea_api.put("/repos/" + owner + "/" + repo + "/collaborators/" + username, json={
+            "permission": permissions[username]
+        })
+        if import_response.ok:
+            print_info("Collaborator " + username + " imported!")
+            journal.record('collaborator', journal_prefix + username, username, permissions[username])
+        else:
+            print_error("Collaborator " + username + " import failed: " + import_response.text)
+
+    def remove_collaborator(username: str):
+        if username in existing_collaborators:
+            delete_response: requests.Response = gitea_api.delete("/repos/" + owner + "/" + repo + "/collaborators/" + username)
+            if not delete_response.ok:
+                print_error("Collaborator " + username + " removal failed: " + delete_response.text)
+                return
+            print_info("Collaborator " + username + " removed!")
+        journal.forget('collaborator', journal_prefix + username)
+
+    run_concurrently(import_collaborator, changed)
+    run_concurrently(remove_collaborator, removed)
+
+
+class AvatarCache:
+    """
+    Downloads user avatars in the background while the users are created. Avatar URLs shared by several
+    users (e.g. default avatars) are only downloaded once, all other avatars are dropped once they are used.
+    """
+
+    def __init__(self, users: List[gitlab.v4.objects.User], max_workers: int):
+        references = collections.Counter(user.avatar_url for user in users if user.avatar_url)
+        self.shared_urls = {url for url, count in references.items() if count > 1}
+        self.downloads = {}
+        self.lock = threading.Lock()
+        self.executor = PhaseThreadPoolExecutor(max_workers=max(1, max_workers))
+
+    def prefetch(self, url: str):
+        with self.lock:
+            if url not in self.downloads:
+                self.downloads[url] = self.executor.submit(self._download, url)
+
+    def get(self, url: str) -> str:
+        """Returns the base64 encoded avatar or None if the download failed."""
+        self.prefetch(url)
+        with self.lock:
+            download = self.downloads[url] if url in self.shared_urls else self.downloads.pop(url)
+        return download.result()
+
+    def release(self, url: str):
+        """Drops a prefetched avatar that is not needed."""
+        if url not in self.shared_urls:
+            with self.lock:
+                download = self.downloads.pop(url, None)
+            if download is not None:
+                download.cancel()
+
+    @staticmethod
+    def _download(url: str) -> str:
+        if SNAPSHOT is not None:
+            avatar = SNAPSHOT.read_avatar(url)
+            return base64.b64encode(avatar).decode('utf-8') if avatar is not None else None
+        try:
+            avatar_response = GITLAB_SESSION.get(url)
+        except requests.RequestException:
+            return None
+        if not avatar_response.ok:
+            return None
+        return base64.b64encode(avatar_response.content).decode('utf-8')
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            for download in self.downloads.values():
+                download.cancel()
+            self.downloads.clear()
+
+
+class CreatedUsersLog:
+    """
+    Append-only log of the created users and their temporary passwords. Every entry is written with a
+    single write to the file opened in append mode and synced to disk before the next user is created,
+    so entries are never interleaved or lost when the migration is interrupted.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    def write(self, username: str, password: str):
+        entry = f"{username},{password}\n".encode('utf-8')
+        with self.lock:
+            os.write(self.fd, entry)
+            os.fsync(self.fd)
+
+    def close(self):
+        with self.lock:
+            os.close(self.fd)
+
+
+def _import_users(gitea_api: GiteaClient, users: [gitlab.v4.objects.User], notify: bool = False):
+    journal = get_journal()
+    users = list(users)
+    avatars = AvatarCache(users, AVATAR_WORKERS)
+    created_users = CreatedUsersLog('created_users.txt')
+
+    def import_user_logged(user: gitlab.v4.objects.User):
+        with log_context(user=user.username):
+            import_user(user)
+
+    def import_user(user: gitlab.v4.objects.User):
+        user_hash = content_hash(user.username, user.name)
+        pending = not journal.is_current('user', user.id, user_hash)
+        if pending and user.avatar_url:
+            # the avatar download runs while the user is looked up and created
+            avatars.prefetch(user.avatar_url)
+
+        with GITLAB_READ_SEMAPHORE:
+            keys: [gitlab.v4.objects.UserKey] = user.keys.list(all=True)
 
-                # Download and upload user avatar
+        LOG.debug("Importing user %s...", user.username)
+        LOG.debug("Found %d public keys for user %s", len(keys), user.username)
+
+        if not pending:
+            LOG.debug("User %s already migrated, skipping!", user.username)
+        elif user_exists(gitea_api, user.username):
+            journal.record('user', user.id, user.username, user_hash)
+            if user.avatar_url:
+                avatars.release(user.avatar_url)
+        else:
+            tmp_password = 'Tmp1!' + ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+
+            tmp_email = user.username + '@noemail-git.local'  # Some gitlab instances do not publish user emails
+            try:
+                tmp_email = user.email
+            except AttributeError:
+                pass
+            import_response: requests.Response = gitea_api.post("/admin/users", json={
+                "email": tmp_email,
+                "full_name": user.name,
+                "login_name": user.username,
+                "password": tmp_password,
+                "send_notify": notify,
+                "source_id": 0, # local user
+                "username": user.username,
+                "visibility": "internal"
+            })
+            if import_response.ok:
+                print_info("User " + user.username + " imported, temporary password: " + tmp_password)
+                created_users.write(user.username, tmp_password)
+                journal.record_created('user', user.username)
+                journal.record('user', user.id, user.username, user_hash)
+            else:
+                print_error("User " + user.username + " import failed: " + import_response.text)
                 if user.avatar_url:
-                    avatar_response = requests.get(user.avatar_url)
-                    if avatar_response.ok:
-                        avatar_base64 = base64.b64encode(avatar_response.content).decode('utf-8')
-                        import_response: requests.Response = gitea_api.post("/user/avatar", json={
-                            "image": avatar_base64
-                        }, params={'sudo': user.username})
-                        if import_response.ok:
-                            print_info("Avatar for user " + user.username + " uploaded!")
-                        else:
-                            print_error("Avatar for user " + user.username + " upload failed: " + import_response.text)
+                    avatars.release(user.avatar_url)
+
+            # Upload the prefetched user avatar
+            if import_response.ok and user.avatar_url:
+                avatar_base64 = avatars.get(user.avatar_url)
+                if avatar_base64:
+                    import_response: requests.Response = gitea_api.post("/user/avatar", json={
+                        "image": avatar_base64
+                    }, params={'sudo': user.username})
+                    if import_response.ok:
+                        print_info("Avatar for user " + user.username + " uploaded!")
                     else:
-                        print_error("Failed to download avatar for user " + user.username + "!")
+                        print_error("Avatar for user " + user.username + " upload failed: " + import_response.text)
+                else:
+                    print_error("Failed to download avatar for user " + user.username + "!")
+
+        # import public keys
+        _import_user_keys(gitea_api, keys, user)
+
+    try:
+        run_concurrently(import_user_logged, users, USER_WORKERS)
+    finally:
+        avatars.close()
+        created_users.close()
+
 
-            # import public keys
-            _import_user_keys(gitea_api, keys, user)
+def _import_user_keys(gitea_api: GiteaClient, keys: [gitlab.v4.objects.UserKey], user: gitlab.v4.objects.User):
+    journal = get_journal()
+    key_hashes = {key.id: content_hash(user.username, key.title, key.key) for key in keys}
+    pending_keys = [key for key in keys if not journal.is_current('user_key', key.id, key_hashes[key.id])]
+    if not pending_keys:
+        return
 
+    # the existing keys are fetched once and compared by title
+    existing_keys = set(get_user_keys(gitea_api, user.username))
 
-def _import_user_keys(gitea_api: pygitea, keys: [gitlab.v4.objects.UserKey], user: gitlab.v4.objects.User):
-    for key in keys:
-        if not user_key_exists(gitea_api, user.username, key.title):
+    def import_key(key: gitlab.v4.objects.UserKey):
+        key_hash = key_hashes[key.id]
+        if key.title in existing_keys:
+            print_warning("Public key " + key.title + " already exists for user " + user.username + ", skipping!")
+            journal.record('user_key', key.id, None, key_hash, user.id)
+        else:
             import_response: requests.Response = gitea_api.post("/admin/users/" + user.username + "/keys", json={
                 "key": key.key,
                 "read_only": True,
@@ -797,22 +2685,31 @@ def _import_user_keys(gitea_api: pygitea, keys: [gitlab.v4.objects.UserKey], use
             })
             if import_response.ok:
                 print_info("Public key " + key.title + " imported!")
+                journal.record('user_key', key.id, import_response.json()['id'], key_hash, user.id)
             else:
                 print_error("Public key " + key.title + " import failed: " + import_response.text)
 
+    run_concurrently(import_key, pending_keys)
+
 
-def _import_groups(gitea_api: pygitea, groups: [gitlab.v4.objects.Group]):
+def _import_groups(gitea_api: GiteaClient, groups: [gitlab.v4.objects.Group]):
+    journal = get_journal()
     for group in groups:
         try:
             members: [gitlab.v4.objects.GroupMember] = group.members_all.list(all=True)
             labels: [gitlab.v4.objects.GroupLabel] = group.labels.list(all=True)
         except Exception as e:
-            print("Skipping group member import for group " + group.full_path + " due to error: " + str(e))
+            print_warning("Skipping group member import for group " + group.full_path + " due to error: " + str(e))
             continue
-        print("Importing group " + name_clean(group.name) + "...")
-        print("Found " + str(len(members)) + " gitlab members for group " + name_clean(group.name))
-
-        if not organization_exists(gitea_api, name_clean(group.name)):
+        LOG.info("Importing group %s...", name_clean(group.name))
+        LOG.debug("Found %d gitlab members for group %s", len(members), name_clean(group.name))
+
+        group_hash = content_hash(name_clean(group.name))
+        if journal.is_current('group', group.id, group_hash):
+            LOG.debug("Group %s already migrated, skipping!", name_clean(group.name))
+        elif organization_exists(gitea_api, name_clean(group.name)):
+            journal.record('group', group.id, name_clean(group.name), group_hash)
+        else:
             import_response: requests.Response = gitea_api.post("/orgs", json={
                 "description": group.description,
                 "full_name": group.full_name,
@@ -823,155 +2720,1136 @@ def _import_groups(gitea_api: pygitea, groups: [gitlab.v4.objects.Group]):
             })
             if import_response.ok:
                 print_info("Group " + name_clean(group.name) + " imported!")
+                journal.record_created('group', name_clean(group.name))
+                journal.record('group', group.id, name_clean(group.name), group_hash)
             else:
                 print_error("Group " + name_clean(group.name) + " import failed: " + import_response.text)
 
-        # import group members
-        _import_group_members(gitea_api, members, group)
+        with log_context(group=name_clean(group.name)):
+            # import group members
+            _import_group_members(gitea_api, members, group)
+
+            _import_group_labels(gitea_api, labels, group)
+
+
+# Gitea teams of the GitLab group access levels, owners are added to the Owners team every organization has
+OWNER_TEAM = "Owners"
+GROUP_ACCESS_TEAMS = {
+    10: ("Guests", "read"),
+    20: ("Reporters", "read"),
+    30: ("Developers", "write"),
+    40: ("Maintainers", "admin"),
+    50: (OWNER_TEAM, "owner"),
+}
+TEAM_UNITS = ["repo.code", "repo.issues", "repo.ext_issues", "repo.wiki", "repo.ext_wiki", "repo.pulls", "repo.releases", "repo.projects"]
+
+
+def _import_group_members(gitea_api: GiteaClient, members: [gitlab.v4.objects.GroupMember], group: gitlab.v4.objects.Group):
+    """
+    Reconciles the organization teams with the GitLab group members. Every member is put into the team of
+    their highest access level and removed from the other access level teams, the current team members are
+    fetched once per team. Members are never removed from the Owners team.
+    """
+    orgname = name_clean(group.name)
+    existing_teams = {team['name']: team for team in get_teams(gitea_api, orgname)}
+    if not existing_teams:
+        print_error("Failed to import members to group " + orgname + ": no teams found!")
+        return
+
+    access_levels = {}
+    for member in members:
+        if member.access_level in GROUP_ACCESS_TEAMS:
+            access_levels[member.username] = max(member.access_level, access_levels.get(member.username, 0))
+        else:
+            print_warning("Unsupported access level " + str(member.access_level) + " of member " + member.username + ", skipping!")
+
+    # if members empty just add the fallback user, the member details might not be accessible
+    # with the permissions of the GitLab token, so nobody is removed in that case
+    fallback = not access_levels
+    if fallback:
+        access_levels[GITEA_FALLBACK_GROUP_MEMBER] = 50
+
+    desired_members = collections.defaultdict(set)
+    for username, access_level in access_levels.items():
+        desired_members[GROUP_ACCESS_TEAMS[access_level][0]].add(username)
+
+    teams = {}
+    for team_name, permission in GROUP_ACCESS_TEAMS.values():
+        if team_name in existing_teams:
+            teams[team_name] = existing_teams[team_name]
+        elif team_name in desired_members:
+            team = _create_team(gitea_api, orgname, team_name, permission)
+            if team:
+                teams[team_name] = team
+
+    team_names = list(teams)
+    current_members = dict(zip(team_names, run_concurrently(lambda team_name: set(get_team_members(gitea_api, teams[team_name]['id'])), team_names)))
+
+    additions = [(team_name, username) for team_name in team_names for username in sorted(desired_members[team_name] - current_members[team_name])]
+    removals = [(team_name, username) for team_name in team_names if team_name != OWNER_TEAM and not fallback
+                for username in sorted(current_members[team_name] - desired_members[team_name])]
+    LOG.info("Members of group " + orgname + ": " + str(len(additions)) + " to add, " + str(len(removals)) + " to remove")
+
+    def add_member(change: ()):
+        team_name, username = change
+        import_response: requests.Response = gitea_api.put("/teams/" + str(teams[team_name]['id']) + "/members/" + username)
+        if import_response.ok:
+            print_info("Member " + username + " added to team " + team_name + " of group " + orgname + "!")
+        else:
+            print_error("Failed to add member " + username + " to team " + team_name + " of group " + orgname + "!")
 
-        _import_group_labels(gitea_api, labels, group)
+    def remove_member(change: ()):
+        team_name, username = change
+        delete_response: requests.Response = gitea_api.delete("/teams/" + str(teams[team_name]['id']) + "/members/" + username)
+        if delete_response.ok:
+            print_info("Member " + username + " removed from team " + team_name + " of group " + orgname + "!")
+        else:
+            print_error("Failed to remove member " + username + " from team " + team_name + " of group " + orgname + "!")
 
+    # add before removing, members changing teams never lose access in between
+    run_concurrently(add_member, additions)
+    run_concurrently(remove_member, removals)
 
-def _import_group_members(gitea_api: pygitea, members: [gitlab.v4.objects.GroupMember], group: gitlab.v4.objects.Group):
-    # TODO: create teams based on gitlab permissions (access_level of group member)
-    existing_teams = get_teams(gitea_api, name_clean(group.name))
-    if existing_teams:
-        first_team = existing_teams[0]
-        print("Organization teams fetched, importing users to first team: " + first_team['name'])
 
-        # if members empty just add the fallback user
-        if len(members) == 0:
-            members = [{"username": GITEA_FALLBACK_GROUP_MEMBER}]
-        # add members to teams
-        for member in members:
-            if not member_exists(gitea_api, member.username, first_team['id']):
-                import_response: requests.Response = gitea_api.put("/teams/" + str(first_team['id']) + "/members/" + member.username)
-                if import_response.ok:
-                    print_info("Member " + member.username + " added to group " + name_clean(group.name) + "!")
-                else:
-                    print_error("Failed to add member " + member.username + " to group " + name_clean(group.name) + "!")
+def _create_team(gitea_api: GiteaClient, orgname: str, team_name: str, permission: str) -> {}:
+    import_response: requests.Response = gitea_api.post("/orgs/" + orgname + "/teams", json={
+        "name": team_name,
+        "permission": permission,
+        "includes_all_repositories": True,
+        "units": TEAM_UNITS
+    })
+    if import_response.ok:
+        print_info("Team " + team_name + " of group " + orgname + " created!")
+        return import_response.json()
     else:
-        print_error("Failed to import members to group " + name_clean(group.name) + ": no teams found!")
+        print_error("Team " + team_name + " of group " + orgname + " creation failed: " + import_response.text)
+        return None
 
 
-def _import_group_labels(gitea_api: pygitea, labels: [gitlab.v4.objects.GroupLabel], group: gitlab.v4.objects.Group):
-    group_labels = get_group_labels(gitea_api, name_clean(group.name))
-    for label in labels:
-        if label.name not in group_labels:
-            import_response: requests.Response = gitea_api.post("/orgs/" + name_clean(group.name) + "/labels", json={
-                "color": label.color,
-                "description": label.description,
-                "name": label.name
-            })
-            if import_response.ok:
-                print_info("Label " + label.name + " imported!")
-            else:
-                print_error("Label " + label.name + " import failed: " + import_response.text)
+def _import_group_labels(gitea_api: GiteaClient, labels: [gitlab.v4.objects.GroupLabel], group: gitlab.v4.objects.Group):
+    orgname = name_clean(group.name)
+    group_labels = {label['name']: label for label in get_group_labels(gitea_api, orgname)}
+
+    def import_label(label: gitlab.v4.objects.GroupLabel):
+        import_response: requests.Response = gitea_api.post("/orgs/" + orgname + "/labels", json={
+            "color": label.color,
+            "description": label.description,
+            "name": label.name
+        })
+        if import_response.ok:
+            print_info("Label " + label.name + " imported!")
+        else:
+            print_error("Label " + label.name + " import failed: " + import_response.text)
+
+    def update_label(label: gitlab.v4.objects.GroupLabel):
+        update_response: requests.Response = gitea_api.patch("/orgs/" + orgname + "/labels/" + str(group_labels[label.name]['id']), json={
+            "color": label.color,
+            "description": label.description
+        })
+        if update_response.ok:
+            print_info("Label " + label.name + " updated!")
+        else:
+            print_error("Label " + label.name + " update failed: " + update_response.text)
+
+    run_concurrently(import_label, [label for label in labels if label.name not in group_labels])
+    run_concurrently(update_label, [label for label in labels if label_changed(group_labels.get(label.name), label)])
 
 #
 # Import functions
 #
 
-def import_users_groups(gitlab_api: gitlab.Gitlab, gitea_api: pygitea, users: List[gitlab.v4.objects.User], groups: List[gitlab.v4.objects.Group], notify=False):
-    print("Found " + str(len(users)) + " gitlab users as user " + gitlab_api.user.username)
-    print("Found " + str(len(groups)) + " gitlab groups as user " + gitlab_api.user.username)
+def import_users_groups(gitlab_api: gitlab.Gitlab, gitea_api: GiteaClient, users: List[gitlab.v4.objects.User], groups: List[gitlab.v4.objects.Group], notify=False):
+    LOG.info("Found " + str(len(users)) + " gitlab users as user " + gitlab_api.user.username)
+    LOG.info("Found " + str(len(groups)) + " gitlab groups as user " + gitlab_api.user.username)
 
     # import all non existing users
-    _import_users(gitea_api, users, notify)
+    with metrics_phase('users'):
+        _import_users(gitea_api, users, notify)
 
     # import all non existing groups
-    _import_groups(gitea_api, groups)
+    with metrics_phase('groups'):
+        _import_groups(gitea_api, groups)
+
+
+def import_projects(gitlab_api: gitlab.Gitlab, gitea_api: GiteaClient, projects: Iterable[gitlab.v4.objects.Project],
+                    on_project_done=None, project_workers: int = PROJECT_WORKERS, clone_workers: int = REPO_CLONE_CONCURRENCY):
+    # Repositories are migrated in their own stage. As soon as the repository of a project is ready, the
+    # metadata import of the project is queued, so slow clones do not hold up the other projects.
+    # on_project_done is called with every project and whether it succeeded once it is imported, skipped or failed.
+    project_done = on_project_done or (lambda project, succeeded: None)
+    clone_executor = PhaseThreadPoolExecutor(max_workers=clone_workers, thread_name_prefix='clone')
+    project_executor = PhaseThreadPoolExecutor(max_workers=project_workers, thread_name_prefix='project')
+    futures_lock = threading.Lock()
+    futures = {}
+
+    def on_repo_done(project: gitlab.v4.objects.Project, errors: 'ErrorCounter', repo_future: concurrent.futures.Future):
+        try:
+            ready = repo_future.result()
+        except Exception as e:
+            print_error("Project " + name_clean(project.name) + " import failed: " + str(e))
+            project_done(project, False)
+            return
+
+        if ready:
+            with futures_lock, log_context(project=_project_path(project)), counting_errors(errors):
+                metadata_future = project_executor.submit(_import_project_metadata, gitea_api, project, errors)
+                futures[metadata_future] = project
+            metadata_future.add_done_callback(lambda future: project_done(project, future.exception() is None and errors.count == 0))
+        else:
+            print_error("Repository of project " + name_clean(project.name) + " is not available, skipping its metadata!")
+            project_done(project, False)
+
+    project_count = 0
+    # projects may be a lazy listing, every repository is queued as soon as its project has been listed
+    for project in projects:
+        project_count += 1
+        if _project_is_current(project):
+            print_warning("Project " + name_clean(project.name) + " has not changed since its last migration, skipping!")
+            project_done(project, True)
+            continue
 
+        # the errors of every project are counted separately, the other project workers log errors meanwhile
+        errors = ErrorCounter()
+        with log_context(project=_project_path(project)), counting_errors(errors):
+            repo_future = clone_executor.submit(_migrate_project_repo, gitea_api, project)
+        repo_future.add_done_callback(functools.partial(on_repo_done, project, errors))
+    LOG.info("Found " + str(project_count) + " gitlab projects as user " + gitlab_api.user.username)
+
+    # the clone workers queue the metadata imports, so all of them are known once the clone stage is done
+    clone_executor.shutdown(wait=True)
+    project_executor.shutdown(wait=True)
+    for future, project in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            print_error("Project " + name_clean(project.name) + " import failed: " + str(e))
 
-def import_projects(gitlab_api: gitlab.Gitlab, gitea_api: pygitea, projects: List[gitlab.v4.objects.Project]):
-    print("Found " + str(len(projects)) + " gitlab projects as user " + gitlab_api.user.username)
 
-    for project in projects:
-        if GITLAB_ARCHIVE_MIGRATED_PROJECTS:
-            try:
-                project.archive()
-            except Exception as e:
-                print("WARNING: Failed to archive project '{}', reason: {}".format(project.name, e))
-        
+def print_slowest_clones():
+    slowest_clones = get_journal().slowest_clones(10)
+    if slowest_clones:
+        LOG.info("Slowest repository migrations:")
+        for repo, seconds in slowest_clones:
+            LOG.info("    " + repo + ": " + str(round(seconds, 1)) + "s")
+
+
+def _estimate_project(project: gitlab.v4.objects.Project, clone_durations: {}) -> (gitlab.v4.objects.Project, float, float):
+    """Returns the project with the estimated seconds of its repository migration and of its metadata import."""
+    if _project_is_current(project):
+        return project, 0.0, 0.0
+
+    if str(project.id) in clone_durations:
+        repo_seconds = clone_durations[str(project.id)]
+    else:
+        statistics = getattr(project, 'statistics', None) or {}
+        size_mb = (statistics.get('repository_size', 0) + statistics.get('lfs_objects_size', 0)) / 1024 / 1024
+        repo_seconds = SCHEDULE_SECONDS_PER_PROJECT + size_mb * SCHEDULE_SECONDS_PER_MB
+
+    try:
+        with GITLAB_READ_SEMAPHORE:
+            issue_count = project.issues_statistics.get().statistics['counts']['all']
+    except Exception as e:
+        # e.g. a snapshot project, only the open issues are known
+        LOG.debug("No issue statistics for project %s: %s", _project_path(project), e)
+        issue_count = getattr(project, 'open_issues_count', 0) or 0
+
+    return project, repo_seconds, SCHEDULE_SECONDS_PER_PROJECT + issue_count * SCHEDULE_SECONDS_PER_ISSUE
+
+
+def plan_projects(projects: Iterable[gitlab.v4.objects.Project]) -> [(gitlab.v4.objects.Project, float, float)]:
+    """Estimates the import time of every project, see _estimate_project, and orders them longest first."""
+    clone_durations = get_journal().clone_durations()
+    plan = run_concurrently(lambda project: _estimate_project(project, clone_durations), projects, GITLAB_READ_CONCURRENCY)
+    return sorted(plan, key=lambda entry: entry[1] + entry[2], reverse=True)
+
+
+def predict_makespan(plan: [(gitlab.v4.objects.Project, float, float)], clone_workers: int, project_workers: int) -> float:
+    """
+    Simulates import_projects: the repositories are migrated by clone_workers in plan order, the metadata of
+    every project is imported by the next free of the project_workers once its repository is ready.
+    """
+    clone_slots = [0.0] * max(1, clone_workers)
+    ready = []
+    for project, repo_seconds, metadata_seconds in plan:
+        repo_done = heapq.heappop(clone_slots) + repo_seconds
+        heapq.heappush(clone_slots, repo_done)
+        ready.append((repo_done, metadata_seconds))
+
+    project_slots = [0.0] * max(1, project_workers)
+    makespan = 0.0
+    for repo_done, metadata_seconds in sorted(ready, key=lambda entry: entry[0]):
+        done = max(repo_done, heapq.heappop(project_slots)) + metadata_seconds
+        heapq.heappush(project_slots, done)
+        makespan = max(makespan, done)
+    return makespan
+
+
+def import_projects_scheduled(gitlab_api: gitlab.Gitlab, gitea_api: GiteaClient, projects: Iterable[gitlab.v4.objects.Project]):
+    """
+    Imports the projects longest first, so the largest ones do not start last and set the end of the run.
+    Small projects run in a fast lane with their own workers next to the large ones.
+    """
+    LOG.info('Planning the project imports...')
+    with metrics_phase('planning'):
+        plan = plan_projects(projects)
+    fast_lane = [entry for entry in plan if SCHEDULE_FAST_LANE_WORKERS > 0 and entry[1] + entry[2] < SCHEDULE_FAST_LANE_SECONDS]
+    main_lane = plan[:len(plan) - len(fast_lane)]
+
+    makespan = max(predict_makespan(main_lane, REPO_CLONE_CONCURRENCY, PROJECT_WORKERS),
+                   predict_makespan(fast_lane, SCHEDULE_FAST_LANE_WORKERS, SCHEDULE_FAST_LANE_WORKERS))
+    LOG.info("Project plan: " + str(len(main_lane)) + " projects longest first, " + str(len(fast_lane)) + " in the fast lane")
+    for project, repo_seconds, metadata_seconds in main_lane[:10]:
+        LOG.info("    " + _project_path(project) + ": repository " + str(round(repo_seconds)) + "s, metadata " + str(round(metadata_seconds)) + "s")
+    finish = datetime.datetime.now() + datetime.timedelta(seconds=makespan)
+    LOG.info("Predicted completion in " + str(datetime.timedelta(seconds=round(makespan))) + " at " + finish.strftime('%d.%m.%Y %H:%M'))
+
+    executor = PhaseThreadPoolExecutor(max_workers=1, thread_name_prefix='fast-lane')
+    try:
+        fast_lane_future = executor.submit(
+            import_projects, gitlab_api, gitea_api.with_clone_slots(max(1, SCHEDULE_FAST_LANE_WORKERS)), [entry[0] for entry in fast_lane],
+            project_workers=max(1, SCHEDULE_FAST_LANE_WORKERS), clone_workers=max(1, SCHEDULE_FAST_LANE_WORKERS)
+        )
+        import_projects(gitlab_api, gitea_api, [entry[0] for entry in main_lane])
+        fast_lane_future.result()
+    finally:
+        executor.shutdown(wait=True)
+
+
+def _project_path(project: gitlab.v4.objects.Project) -> str:
+    return name_clean(project.namespace['name']) + "/" + name_clean(project.name)
+
+
+def _project_hash(project: gitlab.v4.objects.Project) -> str:
+    return content_hash(name_clean(project.namespace['name']), name_clean(project.name), project.last_activity_at)
+
+
+def _project_is_current(project: gitlab.v4.objects.Project) -> bool:
+    return get_journal().is_current('project', project.id, _project_hash(project))
+
+
+def _migrate_project_repo(gitea_api: GiteaClient, project: gitlab.v4.objects.Project) -> bool:
+    # projects of a snapshot are archived by the stage that reads GitLab
+    if GITLAB_ARCHIVE_MIGRATED_PROJECTS and MIGRATION_STAGE != 'import':
         try:
+            project.archive()
+        except Exception as e:
+            print_warning("Failed to archive project '{}', reason: {}".format(project.name, e))
+
+    with metrics_phase('repository'):
+        return _import_project_repo(gitea_api, project)
+
+
+def _import_project_metadata(gitea_api: GiteaClient, project: gitlab.v4.objects.Project, errors: 'ErrorCounter'):
+    # in delta mode only issues and milestones changed since the last complete run are listed,
+    # labels and members are cheap to list and are always compared in full
+    sync_started = datetime.datetime.now(datetime.timezone.utc)
+    high_water = get_journal().get_high_water(project.id) if DELTA_SYNC else None
+    list_filter = {'updated_after': high_water} if high_water else {}
+    try:
+        with GITLAB_READ_SEMAPHORE, metrics_phase('project_listing'):
             collaborators: [gitlab.v4.objects.ProjectMember] = project.members.list(all=True)
             labels: [gitlab.v4.objects.ProjectLabel] = project.labels.list(all=True)
-            milestones: [gitlab.v4.objects.ProjectMilestone] = project.milestones.list(all=True)
-            issues: [gitlab.v4.objects.ProjectIssue] = sorted(project.issues.list(all=True), key=lambda x: x.iid)
+            milestones: [gitlab.v4.objects.ProjectMilestone] = project.milestones.list(all=True, **list_filter)
+            issues: [gitlab.v4.objects.ProjectIssue] = sorted(project.issues.list(all=True, **list_filter), key=lambda x: x.iid)
 
-            print("Importing project " + name_clean(project.name) + " from owner " + name_clean(project.namespace['name']))
-            print("Found " + str(len(collaborators)) + " collaborators for project " + name_clean(project.name))
-            print("Found " + str(len(labels)) + " labels for project " + name_clean(project.name))
-            print("Found " + str(len(milestones)) + " milestones for project " + name_clean(project.name))
-            print("Found " + str(len(issues)) + " issues for project " + name_clean(project.name))
+        if high_water:
+            LOG.info("Delta sync of project " + name_clean(project.name) + ", changes since " + high_water)
 
-        except Exception as e:
-            print("This project failed: \n {}, \n reason {}: ".format(project.name, e))
-        
-        else:
-            projectOwner = name_clean(project.namespace['name'])
-            projectName = name_clean(project.name)
+        LOG.info("Importing project " + name_clean(project.name) + " from owner " + name_clean(project.namespace['name']))
+        LOG.info("Found " + str(len(collaborators)) + " collaborators for project " + name_clean(project.name))
+        LOG.info("Found " + str(len(labels)) + " labels for project " + name_clean(project.name))
+        LOG.info("Found " + str(len(milestones)) + " milestones for project " + name_clean(project.name))
+        LOG.info("Found " + str(len(issues)) + " issues for project " + name_clean(project.name))
 
-            # import project repo
-            _import_project_repo(gitea_api, project)
+    except Exception as e:
+        print_warning("This project failed: \n {}, \n reason {}: ".format(project.name, e))
+    
+    else:
+        projectOwner = name_clean(project.namespace['name'])
+        projectName = name_clean(project.name)
 
-            # import collaborators
+        # import collaborators
+        with metrics_phase('collaborators'):
             _import_project_repo_collaborators(gitea_api, collaborators, project)
 
-            # import labels
+        # import labels
+        with metrics_phase('labels'):
             _import_project_labels(gitea_api, labels, projectOwner, projectName)
 
-            # import milestones
-            _import_project_milestones(gitea_api, milestones, projectOwner, projectName)
+        # import milestones
+        with metrics_phase('milestones'):
+            _import_project_milestones(gitea_api, project.id, milestones, projectOwner, projectName)
 
-            # import issues
+        # import issues
+        with metrics_phase('issues'):
             _import_project_issues(gitea_api, project.id, issues, projectOwner, projectName)
 
+        # a project is only skipped on the next run if all of it was migrated without errors
+        if errors.count == 0:
+            get_journal().record('project', project.id, projectOwner + "/" + projectName, _project_hash(project))
+            if DELTA_SYNC:
+                high_water = sync_started - datetime.timedelta(seconds=DELTA_SYNC_OVERLAP)
+                get_journal().set_high_water(project.id, high_water.strftime('%Y-%m-%dT%H:%M:%SZ'))
 
-def truncate_all(gitea_api: pygitea):
-    print("Truncate all projects, organizations, and users!")
-
-    # Get all users
-    users_response = gitea_api.get('/admin/users')
-    users =  json.loads(users_response.text)
-    for user in users:
-        # Delete user repositories
-        user_repos_response = gitea_api.get(f'/users/{user["login"]}/repos')
-        user_repos = json.loads(user_repos_response.text)
-        for repo in user_repos:
-            repo_delete_response = gitea_api.delete(f'/repos/{repo["owner"]["login"]}/{repo["name"]}')
-            if repo_delete_response.ok:
-                print_info("Repository " + repo["owner"]["login"] + "/" + repo["name"] + " deleted!")
-            else:
-                print_error("Repository " + repo["owner"]["login"] + "/" + repo["name"] + " deletion failed: " + repo_delete_response.text)
-
-    # Get all organizations
-    organizations_response = gitea_api.get('/orgs')
-    organizations = json.loads(organizations_response.text)
-    for org in organizations:
-        # Delete organization repositories
-        org_repos_response = gitea_api.get(f'/orgs/{org["username"]}/repos')
-        org_repos = json.loads(org_repos_response.text)
-        for repo in org_repos:
-            repo_delete_response = gitea_api.delete(f'/repos/{repo["owner"]["login"]}/{repo["name"]}')
-            if repo_delete_response.ok:
-                print_info("Repository " + repo["owner"]["login"] + "/" + repo["name"] + " deleted!")
-            else:
-                print_error("Repository " + repo["owner"]["login"] + "/" + repo["name"] + " deletion failed: " + repo_delete_response.text)
-        # Delete organization
-        orga_delete_response = gitea_api.delete(f'/orgs/{org["username"]}')
-        if orga_delete_response.ok:
-            print_info("Organization " + org["username"] + " deleted!")
+
+def _truncate_owner_repos(gitea_api: GiteaClient, owner: ()) -> [str]:
+    kind, name = owner
+    repos_response, repos = get_all_pages(gitea_api, ('/orgs/' if kind == 'org' else '/users/') + name + '/repos')
+    if not repos_response.ok:
+        print_error("Failed to list the repositories of " + name + ": " + repos_response.text)
+    return [repo["owner"]["login"] + "/" + repo["name"] for repo in repos]
+
+
+def _truncate_namespace(gitea_api: GiteaClient, name: str) -> ():
+    if gitea_api.get('/orgs/' + name).ok:
+        return 'org', name
+    user_response = gitea_api.get('/users/' + name)
+    if user_response.ok:
+        return 'user', user_response.json()['login']
+    print_warning("Namespace " + name + " not found in Gitea, skipping!")
+    return None
+
+
+def _truncate_targets(gitea_api: GiteaClient, own_login: str) -> ([str], [str], [str]):
+    """Returns the repositories ("owner/repo"), organizations and users to delete for TRUNCATE_SCOPE."""
+    if TRUNCATE_SCOPE == 'journal':
+        # entities that already existed in Gitea are journaled as well, only the created ones are deleted
+        journal = get_journal()
+        return (sorted(journal.created_gitea_ids('repo')), sorted(journal.created_gitea_ids('group')),
+                [user for user in sorted(journal.created_gitea_ids('user')) if user.lower() != own_login.lower()])
+
+    if TRUNCATE_SCOPE == 'namespaces':
+        owners = [owner for owner in run_concurrently(lambda name: _truncate_namespace(gitea_api, name), TRUNCATE_NAMESPACES, TRUNCATE_WORKERS)
+                  if owner is not None]
+    elif TRUNCATE_SCOPE == 'all':
+        (users_response, users), (orgs_response, orgs) = run_concurrently(
+            lambda path: get_all_pages(gitea_api, path), ['/admin/users', '/orgs'], max_workers=2
+        )
+        for response, path in ((users_response, '/admin/users'), (orgs_response, '/orgs')):
+            if not response.ok:
+                print_error("Failed to list " + path + ": " + response.text)
+        owners = [('user', user["login"]) for user in users] + [('org', org["username"]) for org in orgs]
+    else:
+        raise ValueError("Unsupported TRUNCATE_SCOPE " + TRUNCATE_SCOPE + ", use 'all', 'namespaces' or 'journal'")
+
+    repos = [repo for owner_repos in run_concurrently(lambda owner: _truncate_owner_repos(gitea_api, owner), owners, TRUNCATE_WORKERS)
+             for repo in owner_repos]
+    return (repos, [name for kind, name in owners if kind == 'org'],
+            [name for kind, name in owners if kind == 'user' and name.lower() != own_login.lower()])
+
+
+def _truncate_delete(gitea_api: GiteaClient, entity: str, name: str, path: str) -> bool:
+    delete_response = gitea_api.delete(path)
+    if delete_response.ok:
+        print_info(entity + " " + name + " deleted!")
+        return True
+    if delete_response.status_code == 404:
+        LOG.debug("%s %s does not exist anymore", entity, name)
+        return True
+    print_error(entity + " " + name + " deletion failed: " + delete_response.text)
+    return False
+
+
+def truncate_all(gitea_api: GiteaClient):
+    """
+    Deletes the repositories, organizations and users of TRUNCATE_SCOPE from Gitea.
+
+    All listings are fully paginated. Repositories are deleted first, then organizations (which must not own
+    repositories anymore) and then users (which must not own repositories or be the last owner of an organization),
+    each step with TRUNCATE_WORKERS parallel deletions. The journal forgets everything that was deleted.
+    """
+    LOG.info("Truncate all projects, organizations, and users! (scope: " + TRUNCATE_SCOPE + ")")
+
+    own_login = gitea_api.get('/user').json()['login']
+    repos, orgs, users = _truncate_targets(gitea_api, own_login)
+    LOG.info("Deleting %d repositories, %d organizations and %d users", len(repos), len(orgs), len(users))
+
+    def delete_all(entity: str, names: [str], path: str) -> [str]:
+        deleted = run_concurrently(lambda name: _truncate_delete(gitea_api, entity, name, path + name), names, TRUNCATE_WORKERS)
+        return [name for name, ok in zip(names, deleted) if ok]
+
+    deleted_repos = delete_all("Repository", repos, '/repos/')
+    deleted_orgs = delete_all("Organization", orgs, '/orgs/')
+    deleted_users = delete_all("User", users, '/admin/users/')
+
+    journal = get_journal()
+    if TRUNCATE_SCOPE == 'all' and len(deleted_repos) == len(repos) and len(deleted_orgs) == len(orgs) and len(deleted_users) == len(users):
+        # Gitea is empty now, nothing in the journal exists anymore
+        journal.reset()
+    else:
+        journal.forget_deleted(deleted_repos, deleted_orgs, deleted_users)
+
+
+#
+# Sharded migration
+#
+
+class WorkLedger:
+    """
+    Shared ledger of the work items of a sharded migration, one ledger for all worker processes.
+
+    The items are grouped in stages (discovery, truncate, users, groups, projects) that are worked off in this
+    order, a stage starts once every item of the previous one is done. The worker that claims the discovery
+    seeds the other stages with the ids and payloads (GitLab attributes) of the items, then all workers claim
+    batches of them. A claim expires WORK_CLAIM_TTL seconds after it was made or last renewed, the heartbeat
+    thread renews the claims of this worker until they are done or released, so only the items of a crashed
+    worker are claimed again by the others. Items are claimed at most max_attempts times, the ones that still
+    failed are left open until retry_exhausted is called, e.g. by the workers of a restarted migration.
+
+    Backends implement seed, claim, renew, complete, release, remaining, exhausted and retry_exhausted; claims
+    must be atomic across all workers.
+    """
+
+    def __init__(self, url: str, worker_id: str, claim_ttl: int, max_attempts: int):
+        self.url = url
+        self.worker_id = worker_id
+        self.claim_ttl = claim_ttl
+        self.max_attempts = max_attempts
+        self.heartbeat_stopped = threading.Event()
+        self.heartbeat_thread = None
+
+    def seed(self, stage: str, items: Dict[str, str]):
+        """Adds the items (payloads by id) to the stage, items that are already in the ledger are left as they are."""
+        raise NotImplementedError
+
+    def claim(self, stage: str, limit: int) -> Dict[str, str]:
+        """
+        Claims up to limit items of the stage that are unclaimed or whose claim expired and that were claimed less
+        than max_attempts times, in seed order. Returns their payloads by id.
+        """
+        raise NotImplementedError
+
+    def renew(self):
+        """Extends all open claims of this worker by the claim TTL."""
+        raise NotImplementedError
+
+    def complete(self, stage: str, item_ids: [str]):
+        raise NotImplementedError
+
+    def release(self, stage: str, item_ids: [str]):
+        """Drops the claims of this worker on the items without completing them, so they can be claimed again."""
+        raise NotImplementedError
+
+    def remaining(self, stage: str) -> int:
+        """Returns the number of items of the stage that are not done and are claimed or can still be claimed."""
+        raise NotImplementedError
+
+    def exhausted(self, stage: str) -> [str]:
+        """Returns the ids of the items of the stage that are not done and were claimed max_attempts times."""
+        raise NotImplementedError
+
+    def retry_exhausted(self):
+        """Allows max_attempts more claims of every exhausted item of all stages."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def start_heartbeat(self):
+        def heartbeat():
+            while not self.heartbeat_stopped.wait(self.claim_ttl / 3):
+                try:
+                    self.renew()
+                except Exception as e:
+                    print_warning("Failed to renew the work ledger claims of " + self.worker_id + ": " + str(e))
+
+        self.heartbeat_thread = threading.Thread(target=heartbeat, name='ledger-heartbeat', daemon=True)
+        self.heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        self.heartbeat_stopped.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+
+
+class SqliteWorkLedger(WorkLedger):
+    """
+    Work ledger in a SQLite database file. Claims run in BEGIN IMMEDIATE transactions, so the file lock of
+    SQLite serializes them across all processes; the file system must support the locks (no NFS).
+    """
+
+    def __init__(self, url: str, worker_id: str, claim_ttl: int, max_attempts: int):
+        super().__init__(url, worker_id, claim_ttl, max_attempts)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(url, check_same_thread=False, isolation_level=None, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS work_items ("
+            "stage TEXT NOT NULL, item_id TEXT NOT NULL, payload TEXT NOT NULL DEFAULT '', worker TEXT, claimed_until REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, done INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (stage, item_id))"
+        )
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def seed(self, stage: str, items: Dict[str, str]):
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR IGNORE INTO work_items (stage, item_id, payload) VALUES (?, ?, ?)",
+                                   [(stage, item_id, payload) for item_id, payload in items.items()])
+
+    def claim(self, stage: str, limit: int) -> Dict[str, str]:
+        now = time.time()
+        with self.transaction() as connection:
+            items = dict(connection.execute(
+                "SELECT item_id, payload FROM work_items WHERE stage = ? AND done = 0 AND (claimed_until IS NULL OR claimed_until < ?) "
+                "AND attempts < ? ORDER BY rowid LIMIT ?", (stage, now, self.max_attempts, limit)
+            ).fetchall())
+            connection.executemany(
+                "UPDATE work_items SET worker = ?, claimed_until = ?, attempts = attempts + 1 WHERE stage = ? AND item_id = ?",
+                [(self.worker_id, now + self.claim_ttl, stage, item_id) for item_id in items]
+            )
+        return items
+
+    def renew(self):
+        with self.transaction() as connection:
+            connection.execute("UPDATE work_items SET claimed_until = ? WHERE worker = ? AND done = 0", (time.time() + self.claim_ttl, self.worker_id))
+
+    def complete(self, stage: str, item_ids: [str]):
+        with self.transaction() as connection:
+            connection.executemany("UPDATE work_items SET done = 1 WHERE stage = ? AND item_id = ?", [(stage, item_id) for item_id in item_ids])
+
+    def release(self, stage: str, item_ids: [str]):
+        with self.transaction() as connection:
+            connection.executemany("UPDATE work_items SET worker = NULL, claimed_until = NULL WHERE stage = ? AND item_id = ? AND worker = ?",
+                                   [(stage, item_id, self.worker_id) for item_id in item_ids])
+
+    def remaining(self, stage: str) -> int:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT count(*) FROM work_items WHERE stage = ? AND done = 0 AND (attempts < ? OR claimed_until >= ?)",
+                (stage, self.max_attempts, time.time())
+            ).fetchone()[0]
+
+    def exhausted(self, stage: str) -> [str]:
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                "SELECT item_id FROM work_items WHERE stage = ? AND done = 0 AND attempts >= ? AND (claimed_until IS NULL OR claimed_until < ?) "
+                "ORDER BY rowid", (stage, self.max_attempts, time.time())
+            ).fetchall()]
+
+    def retry_exhausted(self):
+        with self.transaction() as connection:
+            connection.execute("UPDATE work_items SET attempts = 0 WHERE done = 0 AND attempts >= ? AND (claimed_until IS NULL OR claimed_until < ?)",
+                               (self.max_attempts, time.time()))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def open_work_ledger() -> WorkLedger:
+    if WORK_LEDGER_BACKEND == 'sqlite':
+        ledger_class = SqliteWorkLedger
+    else:
+        module_name, _, class_name = WORK_LEDGER_BACKEND.rpartition('.')
+        ledger_class = getattr(importlib.import_module(module_name), class_name)
+    return ledger_class(WORK_LEDGER, WORKER_ID, WORK_CLAIM_TTL, WORK_MAX_ATTEMPTS)
+
+
+def spawn_workers(count: int) -> [subprocess.Popen]:
+    """Starts count more worker processes of this script on the local host with the same configuration."""
+    worker_processes = []
+    for index in range(1, count + 1):
+        suffix = '.' + str(index)
+        env = dict(os.environ, WORKER_PROCESSES='1', WORKER_ID=WORKER_ID + '/' + str(index), METRICS_PORT='0',
+                   METRICS_REPORT_PATH=METRICS_REPORT_PATH and METRICS_REPORT_PATH + suffix,
+                   LOG_JSON_PATH=LOG_JSON_PATH and LOG_JSON_PATH + suffix)
+        worker_processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+    LOG.info("Started " + str(count) + " more worker processes")
+    return worker_processes
+
+
+def run_ledger_stage(ledger: WorkLedger, stage: str, import_items, batch_size: int):
+    """
+    Claims and imports batches of the items of a stage until every item of the stage is done, also those
+    claimed by other workers. import_items is called with the payloads by id of the claimed items. A batch
+    that raises or logs errors is released, so it is claimed again, by this or another worker, until the
+    attempts of its items are used up.
+    """
+    while True:
+        items = ledger.claim(stage, batch_size)
+        if not items:
+            if ledger.remaining(stage) == 0:
+                return
+            time.sleep(WORK_POLL_INTERVAL)
+            continue
+
+        errors = ErrorCounter()
+        try:
+            with counting_errors(errors):
+                import_items(items)
+        except Exception as e:
+            errors.increment()
+            print_error("Importing " + stage + " " + ", ".join(items) + " failed: " + str(e))
+        if errors.count == 0:
+            ledger.complete(stage, list(items))
         else:
-            print_error("Organization " + org["username"] + " deletion failed: " + orga_delete_response.text)
+            print_warning("Released " + stage + " " + ", ".join(items) + " to the work ledger for another attempt")
+            ledger.release(stage, list(items))
+
+
+def _ledger_payloads(objects: Iterable) -> Dict[str, str]:
+    return {str(gitlab_object.id): json.dumps(gitlab_object.attributes, default=str) for gitlab_object in objects}
+
+
+def _ledger_objects(manager, items: Dict[str, str]) -> list:
+    """Rebuilds the claimed GitLab objects from their seeded attributes, snapshot objects are looked up in the snapshot."""
+    if isinstance(manager, SnapshotManager):
+        return [manager.get(item_id) for item_id in items]
+    return [manager._obj_cls(manager, json.loads(payload)) for payload in items.values()]
+
+
+def _seed_ledger(ledger: WorkLedger, gitlab_api: gitlab.Gitlab):
+    """Discovers the users, groups and projects for all workers and seeds the work ledger with them."""
+    LOG.info('Gathering projects and users...')
+    with metrics_phase('discovery'):
+        users, groups, projects = discover(gitlab_api)
+    if PROJECT_SCHEDULE == 'size':
+        # projects are claimed in seed order, so all workers together work the plan longest first
+        with metrics_phase('planning'):
+            projects = [entry[0] for entry in plan_projects(projects)]
+    LOG.info('Gathering projects and users...done')
+
+    project_items = _ledger_payloads(projects)
+    ledger.seed('truncate', {'gitea': ''} if TRUNCATE_GITEA else {})
+    ledger.seed('users', _ledger_payloads(users))
+    ledger.seed('groups', _ledger_payloads(groups))
+    ledger.seed('projects', project_items)
+    LOG.info("Worker " + WORKER_ID + " seeded the work ledger " + WORK_LEDGER + " with " + str(len(users)) + " users, "
+             + str(len(groups)) + " groups and " + str(len(project_items)) + " projects")
+
+
+def _claim_projects(ledger: WorkLedger, projects: gitlab.v4.objects.ProjectManager, slots: threading.Semaphore):
+    """Yields the claimed projects one by one, each as soon as a slot is free, until every project is done."""
+    while True:
+        slots.acquire()
+        items = ledger.claim('projects', 1)
+        if not items:
+            slots.release()
+            if ledger.remaining('projects') == 0:
+                return
+            time.sleep(WORK_POLL_INTERVAL)
+            continue
+
+        try:
+            project = _ledger_objects(projects, items)[0]
+        except Exception as e:
+            print_error("Loading project " + ", ".join(items) + " of the work ledger failed: " + str(e))
+            ledger.release('projects', list(items))
+            slots.release()
+            continue
+        yield project
+
+
+def import_sharded(gitlab_api: gitlab.Gitlab, gitea_api: GiteaClient):
+    """
+    Imports the share of this worker of a sharded migration. The first worker that claims the discovery
+    discovers for all of them, the others wait for the ledger to be seeded instead of crawling GitLab again.
+    Users and groups are completely imported, by all workers together, before the first project is claimed,
+    projects are claimed one by one whenever a project worker or clone slot of this worker is free.
+    """
+    ledger = open_work_ledger()
+    # the items that failed in an earlier run of the migration get their attempts back
+    ledger.retry_exhausted()
+    ledger.seed('discovery', {'gitlab': ''})
+    LOG.info("Worker " + WORKER_ID + " joined the work ledger " + WORK_LEDGER)
+
+    ledger.start_heartbeat()
+    try:
+        run_ledger_stage(ledger, 'discovery', lambda items: _seed_ledger(ledger, gitlab_api), 1)
+        with metrics_phase('truncate'):
+            run_ledger_stage(ledger, 'truncate', lambda items: truncate_all(gitea_api), 1)
+        with metrics_phase('users'):
+            run_ledger_stage(ledger, 'users', lambda items: _import_users(gitea_api, _ledger_objects(gitlab_api.users, items)),
+                             max(1, USER_WORKERS) * 10)
+        with metrics_phase('groups'):
+            run_ledger_stage(ledger, 'groups', lambda items: _import_groups(gitea_api, _ledger_objects(gitlab_api.groups, items)), 10)
+
+        def project_done(project: gitlab.v4.objects.Project, succeeded: bool):
+            if succeeded:
+                ledger.complete('projects', [str(project.id)])
+            else:
+                print_warning("Released project " + str(project.id) + " to the work ledger for another attempt")
+                ledger.release('projects', [str(project.id)])
+            slots.release()
+
+        # keep the clone and the metadata stage of import_projects busy, but claim no further ahead
+        slots = threading.BoundedSemaphore(max(1, PROJECT_WORKERS) + max(1, REPO_CLONE_CONCURRENCY))
+        with metrics_phase('projects'):
+            import_projects(gitlab_api, gitea_api, _claim_projects(ledger, gitlab_api.projects, slots), project_done)
+
+        for stage in ('discovery', 'truncate', 'users', 'groups', 'projects'):
+            exhausted = ledger.exhausted(stage)
+            if exhausted:
+                print_warning("Gave up on " + stage + " " + ", ".join(exhausted) + " after " + str(WORK_MAX_ATTEMPTS)
+                              + " attempts, restart the workers on the work ledger to retry them")
+    finally:
+        ledger.stop_heartbeat()
+        ledger.close()
+
+
+#
+# Snapshot export and import
+#
 
-    for user in users:
-        # Delete user
-        user_delete_response = gitea_api.delete(f'/admin/users/{user["login"]}')
-        if user_delete_response.ok:
-            print_info("User " + user["login"] + " deleted!")
+class SnapshotWriter:
+    """
+    Writes a GitLab snapshot: meta.json, users.jsonl.gz, groups.jsonl.gz, projects.jsonl.gz, one
+    projects/<id>.jsonl.gz file with the members, labels, milestones, issues, notes and uploads per project,
+    and a content-addressed blob store (blobs/<sha256 prefix>/<sha256>) for uploads and avatars.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.join(path, 'projects'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'blobs'), exist_ok=True)
+
+    def open_records(self, name: str) -> 'SnapshotRecords':
+        return SnapshotRecords(os.path.join(self.path, name))
+
+    def write_blob(self, chunks) -> str:
+        """Stores the chunks in the blob store and returns their SHA-256, identical content is stored once."""
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(self.path, 'blobs', 'tmp-' + uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+
+        blob_path = snapshot_blob_path(self.path, digest.hexdigest())
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
         else:
-            print_error("User " + user["login"] + " deletion failed: " + user_delete_response.text)
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+        return digest.hexdigest()
+
+    def write_meta(self, meta: {}):
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+
+class SnapshotRecords:
+    """Gzip compressed JSONL file that is written to a temporary file and moved into place when closed."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.lock = threading.Lock()
+        self.file = gzip.open(self.tmp_path, 'wt', encoding='utf-8')
+
+    def write(self, record: {}):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def snapshot_blob_path(snapshot_path: str, sha256: str) -> str:
+    return os.path.join(snapshot_path, 'blobs', sha256[:2], sha256)
+
+
+def read_snapshot_records(path: str):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def export_snapshot(gitlab_api: gitlab.Gitlab, users: List[gitlab.v4.objects.User], groups: List[gitlab.v4.objects.Group],
+                    projects: Iterable[gitlab.v4.objects.Project], path: str):
+    """Export stage: reads everything the import needs from GitLab into a snapshot, see SnapshotWriter."""
+    writer = SnapshotWriter(path)
+    started = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    avatars = {}
+    avatars_lock = threading.Lock()
+
+    def export_avatar(url: str) -> str:
+        # identical avatar urls (e.g. default avatars) are only downloaded once
+        with avatars_lock:
+            if url in avatars:
+                return avatars[url]
+        try:
+            with GITLAB_READ_SEMAPHORE:
+                avatar_response = GITLAB_SESSION.get(url)
+        except requests.RequestException:
+            avatar_response = None
+        sha256 = writer.write_blob([avatar_response.content]) if avatar_response is not None and avatar_response.ok else None
+        if sha256 is None:
+            print_error("Failed to download avatar " + url + "!")
+        with avatars_lock:
+            avatars[url] = sha256
+        return sha256
+
+    def export_user(user: gitlab.v4.objects.User) -> {}:
+        with GITLAB_READ_SEMAPHORE:
+            keys = user.keys.list(all=True)
+        LOG.debug("Exported user %s with %d public keys", user.username, len(keys))
+        return {
+            "attributes": user.attributes,
+            "keys": [key.attributes for key in keys],
+            "avatar": export_avatar(user.avatar_url) if user.avatar_url else None
+        }
+
+    def export_group(group: gitlab.v4.objects.Group) -> {}:
+        try:
+            with GITLAB_READ_SEMAPHORE:
+                members = group.members_all.list(all=True)
+                labels = group.labels.list(all=True)
+        except Exception as e:
+            print_warning("Skipping group member export for group " + group.full_path + " due to error: " + str(e))
+            members = None
+            labels = None
+        LOG.debug("Exported group %s", name_clean(group.name))
+        return {
+            "attributes": group.attributes,
+            "members_all": [member.attributes for member in members] if members is not None else None,
+            "labels": [label.attributes for label in labels] if labels is not None else None
+        }
+
+    user_records = writer.open_records('users.jsonl.gz')
+    for record in run_concurrently(export_user, users, GITLAB_READ_CONCURRENCY):
+        user_records.write(record)
+    user_records.close()
+
+    group_records = writer.open_records('groups.jsonl.gz')
+    for record in run_concurrently(export_group, groups, GITLAB_READ_CONCURRENCY):
+        group_records.write(record)
+    group_records.close()
+
+    project_records = writer.open_records('projects.jsonl.gz')
+    project_executor = PhaseThreadPoolExecutor(max_workers=PROJECT_WORKERS, thread_name_prefix='export')
+    futures = {}
+    for project in projects:
+        futures[project_executor.submit(_export_project, writer, project)] = project
+    project_executor.shutdown(wait=True)
+    for future, project in futures.items():
+        try:
+            future.result()
+            project_records.write({"attributes": project.attributes})
+        except Exception as e:
+            print_error("Project " + name_clean(project.name) + " export failed: " + str(e))
+    project_records.close()
+
+    writer.write_meta({
+        "url": GITLAB_URL,
+        "username": gitlab_api.user.username,
+        "exported_at": started,
+        "version": SCRIPT_VERSION
+    })
+    print_info("Exported " + str(len(users)) + " users, " + str(len(groups)) + " groups and " + str(len(futures)) + " projects to " + path)
+
+
+def _export_project(writer: SnapshotWriter, project: gitlab.v4.objects.Project):
+    repo_name = name_clean(project.name)
+    if REPOSITORY_TRANSFER_MODE == 'push':
+        if not _fetch_mirror(project, os.path.join(MIRROR_CACHE_DIR, str(project.id) + ".git"), repo_name):
+            raise RuntimeError("mirror of the repository could not be fetched")
+
+    records = writer.open_records(os.path.join('projects', str(project.id) + '.jsonl.gz'))
+    try:
+        with GITLAB_READ_SEMAPHORE:
+            members = project.members.list(all=True)
+            labels = project.labels.list(all=True)
+            milestones = project.milestones.list(all=True)
+            issues = project.issues.list(all=True)
+        for member in members:
+            records.write({"kind": "member", "attributes": member.attributes})
+        for label in labels:
+            records.write({"kind": "label", "attributes": label.attributes})
+        for milestone in milestones:
+            records.write({"kind": "milestone", "attributes": milestone.attributes})
+
+        rewriter = get_body_rewriter(GITLAB_URL, GITEA_URL)
+        upload_paths = []
+        for issue in issues:
+            with GITLAB_READ_SEMAPHORE:
+                notes = issue.notes.list(all=True)
+            records.write({"kind": "issue", "attributes": issue.attributes})
+            upload_paths += rewriter.upload_links(issue.description)
+            for note in notes:
+                records.write({"kind": "note", "issue_id": issue.id, "attributes": note.attributes})
+                upload_paths += rewriter.upload_links(note.body)
+
+        for upload_path in dict.fromkeys(upload_paths):
+            attachment_url = GITLAB_API_BASEURL + '/projects/' + str(project.id) + upload_path
+            with GITLAB_READ_SEMAPHORE:
+                attachment_response = GITLAB_SESSION.get(attachment_url, headers={'PRIVATE-TOKEN': GITLAB_TOKEN}, stream=True)
+            with attachment_response:
+                if not attachment_response.ok:
+                    print_error("Failed to download attachment " + attachment_url + "!")
+                    continue
+                sha256 = writer.write_blob(attachment_response.iter_content(ATTACHMENT_CHUNK_SIZE))
+                records.write({"kind": "upload", "path": upload_path, "sha256": sha256,
+                               "content_type": attachment_response.headers.get('Content-Type', 'application/octet-stream')})
+    finally:
+        records.close()
+
+    print_info("Exported project " + repo_name + " with " + str(len(issues)) + " issues and " + str(len(upload_paths)) + " uploads")
+
+
+class SnapshotManager:
+    """Stand-in for a python-gitlab manager, lists the objects of a snapshot."""
+
+    def __init__(self, load):
+        self.load = load
+        self.lock = threading.Lock()
+        self.objects_by_id = None
+
+    def get(self, id, **kwargs):
+        # the snapshot is read once for the lookups, e.g. of the items claimed from a work ledger
+        with self.lock:
+            if self.objects_by_id is None:
+                self.objects_by_id = {str(item.id): item for item in self.load()}
+        return self.objects_by_id[str(id)]
+
+    def list(self, iterator: bool = False, updated_after: str = None, **kwargs):
+        items = self.load()
+        if updated_after:
+            threshold = parse_timestamp(updated_after)
+            items = (item for item in items if parse_timestamp(item.updated_at) >= threshold)
+        return items if iterator else list(items)
+
+
+class SnapshotObject:
+    """Read-only stand-in for a python-gitlab object, attributes and managers are loaded from a snapshot."""
+
+    def __init__(self, attributes: {}, managers: Dict[str, SnapshotManager] = None):
+        self.attributes = attributes
+        self.managers = managers or {}
+
+    def __getattr__(self, name: str):
+        if name in ('attributes', 'managers'):
+            raise AttributeError(name)
+        if name in self.managers:
+            return self.managers[name]
+        try:
+            return self.attributes[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class SnapshotBlob:
+    """Response-like view of a snapshot blob, used in place of a streamed GitLab download."""
+
+    def __init__(self, path: str, content_type: str):
+        self.path = path
+        self.ok = path is not None and os.path.exists(path)
+        self.headers = {'Content-Type': content_type, 'Content-Length': str(os.path.getsize(path))} if self.ok else {}
+
+    @property
+    def content(self) -> bytes:
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def iter_content(self, chunk_size: int):
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class Snapshot:
+    """
+    Import stage stand-in for the GitLab API: users, groups and projects are listed from a snapshot written by
+    the export stage, the issues, notes and uploads of a project are loaded when the project is imported.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.url = meta['url']
+        self.exported_at = meta['exported_at']
+        self.user = SnapshotObject({"username": meta['username']})
+        self.avatars = {}
+        self.uploads = {}
+        self.uploads_lock = threading.Lock()
+
+        self.users = SnapshotManager(self._load_users)
+        self.groups = SnapshotManager(self._load_groups)
+        self.projects = SnapshotManager(self._load_projects)
+
+    def _load_users(self):
+        for record in read_snapshot_records(os.path.join(self.path, 'users.jsonl.gz')):
+            if record['avatar']:
+                self.avatars[record['attributes']['avatar_url']] = record['avatar']
+            keys = [SnapshotObject(key) for key in record['keys']]
+            yield SnapshotObject(record['attributes'], {"keys": SnapshotManager(functools.partial(iter, keys))})
+
+    def _load_groups(self):
+        for record in read_snapshot_records(os.path.join(self.path, 'groups.jsonl.gz')):
+            managers = {}
+            if record['members_all'] is not None:
+                managers['members_all'] = SnapshotManager(functools.partial(iter, [SnapshotObject(member) for member in record['members_all']]))
+                managers['labels'] = SnapshotManager(functools.partial(iter, [SnapshotObject(label) for label in record['labels']]))
+            yield SnapshotObject(record['attributes'], managers)
+
+    def _load_projects(self):
+        for record in read_snapshot_records(os.path.join(self.path, 'projects.jsonl.gz')):
+            project_id = record['attributes']['id']
+            yield SnapshotObject(record['attributes'], {
+                kind: SnapshotManager(functools.partial(self._load_project_objects, project_id, kind))
+                for kind in ('members', 'labels', 'milestones', 'issues')
+            })
+
+    def _load_project_objects(self, project_id, kind: str):
+        # every listing reads the project file again, so only the project being imported is held in memory
+        objects = {'members': [], 'labels': [], 'milestones': [], 'issues': []}
+        notes = collections.defaultdict(list)
+        uploads = {}
+        for record in read_snapshot_records(os.path.join(self.path, 'projects', str(project_id) + '.jsonl.gz')):
+            if record['kind'] == 'note':
+                notes[record['issue_id']].append(SnapshotObject(record['attributes']))
+            elif record['kind'] == 'upload':
+                uploads[record['path']] = (record['sha256'], record['content_type'])
+            else:
+                objects[record['kind'] + 's'].append(record['attributes'])
+
+        with self.uploads_lock:
+            self.uploads[str(project_id)] = uploads
+        if kind == 'issues':
+            return iter([SnapshotObject(issue, {"notes": SnapshotManager(functools.partial(iter, notes[issue['id']]))}) for issue in objects['issues']])
+        return iter([SnapshotObject(attributes) for attributes in objects[kind]])
+
+    def open_upload(self, project_id, upload_path: str) -> SnapshotBlob:
+        with self.uploads_lock:
+            upload = self.uploads.get(str(project_id), {}).get(upload_path)
+        if upload is None:
+            return SnapshotBlob(None, None)
+        return SnapshotBlob(snapshot_blob_path(self.path, upload[0]), upload[1])
+
+    def read_avatar(self, url: str) -> bytes:
+        sha256 = self.avatars.get(url)
+        if sha256 is None:
+            return None
+        with open(snapshot_blob_path(self.path, sha256), 'rb') as f:
+            return f.read()
+
+
+SNAPSHOT: Snapshot = None
+
+
+def open_snapshot(path: str) -> Snapshot:
+    global SNAPSHOT
+    SNAPSHOT = Snapshot(path)
+    return SNAPSHOT
 
 
 #
@@ -996,7 +3874,7 @@ def color_message(color, message, colorend=bcolors.ENDC, bold=False):
     return color + message + colorend
 
 def print_color(color, message, colorend=bcolors.ENDC, bold=False):
-    print(color_message(color, message, colorend))
+    LOG.info(message, extra={'color': bcolors.BOLD + color if bold else color})
 
 
 def print_info(message):
@@ -1008,13 +3886,155 @@ def print_success(message):
 
 
 def print_warning(message):
-    print_color(bcolors.WARNING, message)
+    LOG.warning(message)
 
 
 def print_error(message):
     global GLOBAL_ERROR_COUNT
-    GLOBAL_ERROR_COUNT += 1
-    print_color(bcolors.FAIL, message)
+    with GLOBAL_ERROR_LOCK:
+        GLOBAL_ERROR_COUNT += 1
+    for counter in current_error_counters():
+        counter.increment()
+    LOG.error(message)
+
+
+ERROR_SCOPE = threading.local()
+
+
+class ErrorCounter:
+    """Number of errors logged within counting_errors, e.g. by all threads that work on one project."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def increment(self):
+        with self.lock:
+            self.count += 1
+
+
+def current_error_counters() -> ():
+    return getattr(ERROR_SCOPE, 'counters', ())
+
+
+@contextlib.contextmanager
+def counting_errors(*counters: ErrorCounter):
+    """Counts the errors of the current thread and of the tasks it submits in the counters."""
+    previous = current_error_counters()
+    ERROR_SCOPE.counters = previous + counters
+    try:
+        yield
+    finally:
+        ERROR_SCOPE.counters = previous
+
+
+LOG = logging.getLogger('migrate')
+LOG_CONTEXT = threading.local()
+
+
+def current_log_context() -> {}:
+    return getattr(LOG_CONTEXT, 'fields', {})
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """Adds entity fields (e.g. project, user, group) to the log records of the current thread and of the tasks it submits."""
+    previous = current_log_context()
+    LOG_CONTEXT.fields = dict(previous, **fields)
+    try:
+        yield
+    finally:
+        LOG_CONTEXT.fields = previous
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Queues log records without blocking, the message, phase and log context are captured in the logging thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.phase = current_phase()
+        record.context = current_log_context()
+        return record
+
+
+class ConsoleFormatter(logging.Formatter):
+    LEVEL_COLORS = {logging.WARNING: bcolors.WARNING, logging.ERROR: bcolors.FAIL, logging.CRITICAL: bcolors.FAIL}
+
+    def format(self, record: logging.LogRecord) -> str:
+        color = getattr(record, 'color', None) or self.LEVEL_COLORS.get(record.levelno)
+        return color_message(color, record.message) if color and LOG_COLOR else record.message
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            "level": record.levelname,
+            "message": record.message,
+            "thread": record.threadName,
+            "phase": record.phase
+        }
+        entry.update(record.context)
+        return json.dumps(entry)
+
+
+class LogWriter:
+    """
+    Background thread that writes the queued log records in batches: every sink gets one write and one flush per
+    batch instead of one per line, so logging threads never wait for the terminal or the log file.
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, log_queue: queue.Queue, sinks: [(object, logging.Formatter)]):
+        self.queue = log_queue
+        self.sinks = sinks
+        self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch = [self.queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopped = True
+                batch = [record for record in batch if record is not None]
+            for stream, formatter in self.sinks:
+                if batch:
+                    stream.write(''.join(formatter.format(record) + '\n' for record in batch))
+                stream.flush()
+
+    def stop(self):
+        """Writes the remaining records and stops the thread."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+LOG_WRITER: LogWriter = None
+
+
+def setup_logging():
+    """Routes the log records of the migration through a ContextQueueHandler to the console and the JSON lines file."""
+    global LOG_WRITER
+    if LOG_WRITER is not None:
+        return
+
+    sinks = [(sys.stdout, ConsoleFormatter())]
+    if LOG_JSON_PATH:
+        sinks.append((open(LOG_JSON_PATH, 'a', encoding='utf-8'), JsonFormatter()))
+    log_queue = queue.Queue()
+    LOG_WRITER = LogWriter(log_queue, sinks)
+    atexit.register(LOG_WRITER.stop)
+
+    LOG.addHandler(ContextQueueHandler(log_queue))
+    LOG.setLevel(LOG_LEVEL)
+    LOG.propagate = False
 
 
 def name_clean(name):
@@ -1033,14 +4053,94 @@ def name_clean(name):
     return newName
 
 
+class BodyRewriter:
+    """
+    Rewrites the GitLab links in issue and comment bodies in a single scan, the patterns are compiled once.
+
+    Issue links of projects in groups and subgroups point to the Gitea repository of the innermost namespace.
+    Upload links are replaced by the links of their relayed Gitea attachments when a mapping is given.
+    Merge request links and user mentions are kept, merge requests are not migrated and usernames do not change.
+    """
+
+    ISSUE_LINK = r'/(?:[^/]+/)?([^/]+)/([^/]+)/-/issues/(\d+)'
+    UPLOAD_LINK = r'\[.*?\]\((/uploads/.*?)\)'
+
+    def __init__(self, gitlab_url: str, gitea_url: str):
+        self.gitlab_url = gitlab_url
+        self.gitea_url = gitea_url
+        self.issue_pattern = re.compile(re.escape(gitlab_url) + self.ISSUE_LINK)
+        self.upload_pattern = re.compile(self.UPLOAD_LINK)
+        self.pattern = re.compile(re.escape(gitlab_url) + self.ISSUE_LINK + '|' + self.UPLOAD_LINK)
+
+    def _issue_link(self, match) -> str:
+        return self.gitea_url + '/' + match.group(1) + '/' + match.group(2) + '/issues/' + match.group(3)
+
+    def rewrite(self, text: str, uploads: Dict[str, str] = None) -> str:
+        if not text:
+            return ''
+        # most bodies contain no links at all, the substring checks are much cheaper than a scan
+        if self.gitlab_url not in text and '](/uploads/' not in text:
+            return text
+
+        def replace(match) -> str:
+            if match.group(4) is None:
+                return self._issue_link(match)
+
+            link = match.group(0)
+            if uploads:
+                new_upload_link = uploads.get(match.group(4))
+                if new_upload_link:
+                    link = link[:match.start(4) - match.start(0)] + new_upload_link + ')'
+            # the link text may contain issue links as well
+            return self.issue_pattern.sub(self._issue_link, link)
+
+        return self.pattern.sub(replace, text)
+
+    def upload_links(self, text: str) -> List[str]:
+        """Returns the distinct upload paths linked in text, in order of appearance."""
+        return list(dict.fromkeys(self.upload_pattern.findall(text or '')))
+
+
+@functools.lru_cache(maxsize=None)
+def get_body_rewriter(gitlab_url: str, gitea_url: str) -> BodyRewriter:
+    return BodyRewriter(gitlab_url, gitea_url)
+
+
 def replace_issue_links(text: str, gitlab_url: str, gitea_url: str) -> str:
-    pattern = re.escape(gitlab_url) + r'/([^/]+)/([^/]+)/([^/]+)/-/issues/(\d+)'
-    replacement = gitea_url + r'/\2/\3/issues/\4'
-    text = re.sub(pattern, replacement, text or '')
-    pattern = re.escape(gitlab_url) + r'/([^/]+)/([^/]+)/-/issues/(\d+)'
-    replacement = gitea_url + r'/\1/\2/issues/\3'
-    text = re.sub(pattern, replacement, text or '')
-    return text
+    return get_body_rewriter(gitlab_url, gitea_url).rewrite(text)
+
+
+ISO_TIMESTAMP = re.compile(r'(\d{4})-(\d\d)-(\d\d)(?:T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:?\d\d)?)?$')
+
+
+def parse_timestamp(value: str) -> datetime.datetime:
+    """
+    Parses the ISO 8601 timestamps and dates of the GitLab API without the overhead of dateutil,
+    other formats are passed on to dateutil.
+    """
+    match = ISO_TIMESTAMP.match(value)
+    if match is None:
+        return dateutil.parser.parse(value)
+
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    if hour is None:
+        return datetime.datetime(int(year), int(month), int(day))
+
+    tzinfo = None
+    if offset == 'Z':
+        tzinfo = datetime.timezone.utc
+    elif offset is not None:
+        offset_minutes = int(offset[1:3]) * 60 + int(offset[-2:])
+        tzinfo = datetime.timezone(datetime.timedelta(minutes=-offset_minutes if offset[0] == '-' else offset_minutes))
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+    return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond, tzinfo)
+
+
+LOCAL_TIMEZONE = pytz.timezone('Europe/Berlin')
+
+
+def format_local_timestamp(value: str) -> str:
+    return parse_timestamp(value).astimezone(LOCAL_TIMEZONE).strftime('%d.%m.%Y %H:%M')
 
 
 if __name__ == "__main__":